@@ -0,0 +1,432 @@
+"""Background jobs for the AI features.
+
+Asking the LLM (and transcribing a recording first) takes seconds. Done on the
+request thread, a handful of those occupy every worker the server has.
+AIJobQueue runs them on a bounded pool of its own instead: submit() hands back a
+Job right away and clients poll it (see /api/v1/ai/jobs/ in app.py). Once every
+worker is busy and the queue is full, submit() fails with AIQueueFull (answered
+with a 503) rather than queueing without bound.
+
+A job runs in the process it was submitted to, but its state lives in a
+JobStore, so a poll answered by any process finds it:
+
+- MemoryJobStore keeps jobs in this process (one process only)
+- SQLiteJobStore keeps them in the AIJobs table of the app's database
+
+The LLM and the transcriber are backends: OpenAILLM/AssemblyAITranscriber talk
+to the real services, FakeLLM/FakeTranscriber answer deterministically without
+the network (for benchmarks and offline development).
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import chat_gpt
+
+
+class AIQueueFull(Exception):
+    pass
+
+
+# =================================================================================
+# Backends
+# =================================================================================
+
+
+class LLMBackend(ABC):
+    @abstractmethod
+    def ask(
+        self, question: str, names: chat_gpt.PromptNames
+    ) -> chat_gpt.Chat_GPT_Response:
+        """The LLM's answer to question, given the user's names for context"""
+
+
+class TranscriberBackend(ABC):
+    @abstractmethod
+    def transcribe(self, path: str) -> str:
+        """The text spoken in the recording at path"""
+
+
+class OpenAILLM(LLMBackend):
+    def ask(
+        self, question: str, names: chat_gpt.PromptNames
+    ) -> chat_gpt.Chat_GPT_Response:
+        return chat_gpt.Chat_GPT().newAsk(question, names)
+
+
+class AssemblyAITranscriber(TranscriberBackend):
+    def __init__(self, apikey: str):
+        # only needed when transcribing for real
+        import assemblyai
+
+        assemblyai.settings.api_key = apikey
+        self.transcriber = assemblyai.Transcriber()
+
+    def transcribe(self, path: str) -> str:
+        return self.transcriber.transcribe(path).text
+
+
+class FakeLLM(LLMBackend):
+    """Answers every question with one task named after it (the same question
+    always gives the same answer), after sleeping delay seconds like a real
+    round trip would"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay: float = delay
+
+    def ask(
+        self, question: str, names: chat_gpt.PromptNames
+    ) -> chat_gpt.Chat_GPT_Response:
+        time.sleep(self.delay)
+        task = chat_gpt.Task(
+            name=question[:80],
+            starred=False,
+            duedate="01/01/2030,09:00",
+            priority=len(question) % 10 + 1,
+            tasklistnames=["none"],
+        )
+        return chat_gpt.Chat_GPT_Response(
+            tasklists=[],
+            numtasklists=0,
+            tasks=[task],
+            numtasks=1,
+            subtasks=[],
+            numsubtasks=0,
+            error_message="None",
+        )
+
+
+class FakeTranscriber(TranscriberBackend):
+    """A text file transcribes to its text, anything else to a name derived from
+    its bytes"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay: float = delay
+
+    def transcribe(self, path: str) -> str:
+        time.sleep(self.delay)
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return f"recording {hashlib.sha1(data).hexdigest()[:8]}"
+
+
+# =================================================================================
+# Jobs
+# =================================================================================
+
+
+class Job:
+    def __init__(
+        self,
+        userid: int,
+        question: str | None = None,
+        audiopath: str | None = None,
+        jobid: str | None = None,
+    ):
+        self.id: str = jobid or secrets.token_urlsafe(16)
+        self.userid: int = userid
+        self.question: str | None = question
+        # a recording to transcribe into the question first (deleted afterwards)
+        self.audiopath: str | None = audiopath
+        # queued -> transcribing -> asking -> done or failed
+        self.status: str = "queued"
+        self.result: dict | None = None
+        self.error: str | None = None
+        # epoch seconds
+        self.created: float = time.time()
+        self.finished: float | None = None
+        # set once the job is done or failed, for waiting in the process running it
+        self.settled = threading.Event()
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def row(self) -> dict:
+        return {
+            "id": self.id,
+            "userid": self.userid,
+            "status": self.status,
+            "result": None if self.result is None else json.dumps(self.result),
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+    @staticmethod
+    def fromrow(row: dict) -> Job:
+        job = Job(row["userid"], jobid=row["id"])
+        job.status = row["status"]
+        job.result = None if row["result"] is None else json.loads(row["result"])
+        job.error = row["error"]
+        job.created = row["created"]
+        job.finished = row["finished"]
+        return job
+
+
+class JobStore(ABC):
+    """Where the jobs' state lives, so a job can be polled from any process and
+    not just the one running it"""
+
+    @abstractmethod
+    def add(self, job: Job) -> None: ...
+
+    @abstractmethod
+    def update(self, job: Job) -> None: ...
+
+    @abstractmethod
+    def load(self, jobid: str, userid: int) -> Job | None:
+        """The job, if it exists and belongs to userid"""
+
+    @abstractmethod
+    def claimerror(self, jobid: str) -> bool:
+        """Mark the job's error as shown, True for the first caller only"""
+
+    @abstractmethod
+    def prune(self, finishedbefore: float, createdbefore: float) -> int:
+        """Delete the jobs that finished before finishedbefore or were created
+        before createdbefore, returns how many there were"""
+
+
+class MemoryJobStore(JobStore):
+    """Jobs in this process only"""
+
+    def __init__(self):
+        self.jobs: dict[str, dict] = {}
+        self.lock = threading.Lock()
+
+    def add(self, job: Job) -> None:
+        with self.lock:
+            self.jobs[job.id] = job.row() | {"reported": False}
+
+    def update(self, job: Job) -> None:
+        with self.lock:
+            if job.id in self.jobs:
+                self.jobs[job.id].update(job.row())
+
+    def load(self, jobid: str, userid: int) -> Job | None:
+        with self.lock:
+            row = self.jobs.get(jobid)
+        if row is None or row["userid"] != userid:
+            return None
+        return Job.fromrow(row)
+
+    def claimerror(self, jobid: str) -> bool:
+        with self.lock:
+            row = self.jobs.get(jobid)
+            if row is None or row["reported"]:
+                return False
+            row["reported"] = True
+            return True
+
+    def prune(self, finishedbefore: float, createdbefore: float) -> int:
+        with self.lock:
+            stale = [
+                jobid
+                for jobid, row in self.jobs.items()
+                if (row["finished"] or math.inf) < finishedbefore
+                or row["created"] < createdbefore
+            ]
+            for jobid in stale:
+                del self.jobs[jobid]
+        return len(stale)
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs in the AIJobs table (created by migrations.py), shared by every worker
+    process using the database"""
+
+    def __init__(self, engine: Engine):
+        self.engine: Engine = engine
+
+    def add(self, job: Job) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO AIJobs "
+                    "(id, userid, status, result, error, created, finished) "
+                    "VALUES (:id, :userid, :status, :result, :error, :created, "
+                    ":finished)"
+                ),
+                job.row(),
+            )
+
+    def update(self, job: Job) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "UPDATE AIJobs SET status = :status, result = :result, "
+                    "error = :error, finished = :finished WHERE id = :id"
+                ),
+                job.row(),
+            )
+
+    def load(self, jobid: str, userid: int) -> Job | None:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT id, userid, status, result, error, created, finished "
+                    "FROM AIJobs WHERE id = :id AND userid = :userid"
+                ),
+                {"id": jobid, "userid": userid},
+            ).first()
+        return None if row is None else Job.fromrow(row._asdict())
+
+    def claimerror(self, jobid: str) -> bool:
+        with self.engine.begin() as conn:
+            claimed = conn.execute(
+                text("UPDATE AIJobs SET reported = 1 WHERE id = :id AND reported = 0"),
+                {"id": jobid},
+            ).rowcount
+        return claimed == 1
+
+    def prune(self, finishedbefore: float, createdbefore: float) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(
+                text(
+                    "DELETE FROM AIJobs WHERE finished < :finishedbefore "
+                    "OR created < :createdbefore"
+                ),
+                {"finishedbefore": finishedbefore, "createdbefore": createdbefore},
+            ).rowcount
+
+
+class AIJobQueue:
+    def __init__(
+        self,
+        llm: LLMBackend,
+        transcriber: TranscriberBackend,
+        context: Callable[[int], chat_gpt.PromptNames],
+        apply: Callable[[int, chat_gpt.Chat_GPT_Response], dict],
+        workers: int,
+        queuelimit: int,
+        store: JobStore | None = None,
+        keepfor: float = 600.0,
+        lostafter: float = 3600.0,
+        pollinterval: float = 0.25,
+    ):
+        self.llm: LLMBackend = llm
+        self.transcriber: TranscriberBackend = transcriber
+        # userid -> the user's task list names and task names for the prompt
+        self.context = context
+        # (userid, response) -> the job's result, after saving what the LLM made
+        self.apply = apply
+        self.workers: int = workers
+        # one slot per job that is running or queued
+        self.slots = threading.BoundedSemaphore(workers + queuelimit)
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="aijob")
+        self.store: JobStore = store if store is not None else MemoryJobStore()
+        # finished jobs can be fetched for keepfor seconds. A job still unfinished
+        # lostafter seconds after it was submitted went down with its process
+        self.keepfor: float = keepfor
+        self.lostafter: float = lostafter
+        # how often wait() looks at a job that another process is running
+        self.pollinterval: float = pollinterval
+        # the jobs this process has queued or is running
+        self.running: dict[str, Job] = {}
+        self.lock = threading.Lock()
+
+    def submit(
+        self, userid: int, question: str | None = None, audiopath: str | None = None
+    ) -> Job:
+        """Queue a question (or a recording to transcribe into one) for userid"""
+        if not self.slots.acquire(blocking=False):
+            raise AIQueueFull("every AI worker is busy")
+        job = Job(userid, question, audiopath)
+        try:
+            self.prune()
+            self.store.add(job)
+            with self.lock:
+                self.running[job.id] = job
+            self.executor.submit(self.run, job)
+        except BaseException:
+            with self.lock:
+                self.running.pop(job.id, None)
+            self.slots.release()
+            raise
+        return job
+
+    def get(self, jobid: str, userid: int) -> Job | None:
+        """The job, if it exists and belongs to userid"""
+        return self.store.load(jobid, userid)
+
+    def wait(self, jobid: str, userid: int, timeout: float) -> Job | None:
+        """The job once it is done or failed, or as it is after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(jobid, userid)
+            remaining = deadline - time.monotonic()
+            if job is None or job.finished is not None or remaining <= 0:
+                return job
+            with self.lock:
+                local = self.running.get(jobid)
+            if local is not None:
+                local.settled.wait(remaining)
+            else:
+                time.sleep(min(self.pollinterval, remaining))
+
+    def claimerror(self, job: Job) -> bool:
+        """True the first time this is asked about a failed job, so its error is
+        shown once however often it is polled"""
+        return job.status == "failed" and self.store.claimerror(job.id)
+
+    def prune(self) -> None:
+        now = time.time()
+        self.store.prune(now - self.keepfor, now - self.lostafter)
+
+    def setstatus(self, job: Job, status: str) -> None:
+        job.status = status
+        self.store.update(job)
+
+    def run(self, job: Job) -> None:
+        try:
+            if job.audiopath is not None:
+                self.setstatus(job, "transcribing")
+                try:
+                    job.question = self.transcriber.transcribe(job.audiopath)
+                finally:
+                    os.remove(job.audiopath)
+            self.setstatus(job, "asking")
+            response = self.llm.ask(job.question, self.context(job.userid))
+            if response.error_message != "None":
+                job.result = {"status": "error", "GPTResponse": response.toDict()}
+                job.error = response.error_message
+                job.status = "failed"
+            else:
+                job.result = self.apply(job.userid, response)
+                job.status = "done"
+        except Exception as e:
+            print(f"AI job {job.id} failed: {e!r}")
+            job.error = "the AI request failed, please try again"
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            try:
+                self.store.update(job)
+            finally:
+                with self.lock:
+                    self.running.pop(job.id, None)
+                job.settled.set()
+                self.slots.release()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown()
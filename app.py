@@ -1,23 +1,39 @@
 # pip install assemblyai
 from __future__ import annotations
 import os
+import re
 import json
+import base64
+import hashlib
+import math
+import tempfile
+from functools import wraps
 from flask import Flask, render_template, url_for, redirect
 from flask import request, session, flash, jsonify, get_flashed_messages
+from flask import make_response, g
+import click
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from flask_login import UserMixin, LoginManager, login_required
 from flask_login import login_user, logout_user, current_user
 
 from datetime import date, time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 # general use cases:
 # date(year,month,day)
 # time(hour,minute)
 
 # local imports
-from hashing_examples import UpdatedHasher
+from hashing_examples import UpdatedHasher, calibrate, load_params, save_params
+from hashpool import HashPool, HashPoolBusy
+from usercache import CachedUser, UserCache
+from ratelimit import RateLimiter
+from serversession import MemoryStore, ServerSessionInterface, SQLiteStore
 from loginforms import RegisterForm, LoginForm
+import migrations
+import dbprofile
 
 # no need to import since we moved the forms to app.py
 # from taskandtasklistforms import (
@@ -34,8 +50,13 @@ from loginforms import RegisterForm, LoginForm
 # =================================================================================
 
 scriptdir = os.path.dirname(os.path.abspath(__file__))
-dbfile = os.path.join(scriptdir, "todo.sqlite3")
+# TODO_DATABASE lets the benchmarks point the app at a throwaway database
+dbfile = os.environ.get("TODO_DATABASE", os.path.join(scriptdir, "todo.sqlite3"))
 pepperfile = os.path.join(scriptdir, "pepper.bin")
+# argon2 parameters tuned for this machine (`flask --app app calibrate-hasher`)
+hashparamsfile = os.environ.get(
+    "TODO_HASH_PARAMS", os.path.join(scriptdir, "hashparams.json")
+)
 
 # =================================================================================
 # Set up hasher
@@ -53,8 +74,39 @@ if not os.path.exists(pepperfile) or not pepper_key:
     with open(pepperfile, "wb") as fout:
         fout.write(pepper_key)
 
+# hashing runs in a few worker processes with a short queue in front of them;
+# when both are full, logins and registrations get a 503 instead of waiting
+# (TODO_HASH_WORKERS=0 hashes on the request thread instead)
+hashworkers = int(os.environ.get("TODO_HASH_WORKERS", 2))
+hashpool = HashPool(workers=hashworkers, queuelimit=2 * hashworkers, timeout=5.0)
+if hashworkers:
+    hashpool.start()
+
 # create a new instance of UpdatedHasher using that pepper key
-pwd_hasher = UpdatedHasher(pepper_key)
+pwd_hasher = UpdatedHasher(
+    pepper_key, hashpool if hashworkers else None, load_params(hashparamsfile)
+)
+
+# =================================================================================
+# Set up login rate limiting
+# =================================================================================
+
+# login attempts are limited per username and per client address (see
+# ratelimit.py): a burst of TODO_LOGIN_BURST, then TODO_LOGIN_RATE per second, and
+# TODO_LOGIN_LOCKOUT_AFTER failures in a row lock the key out for 1 s, doubling
+# with each further failure up to 15 minutes. Rejected attempts never reach the
+# hasher
+loginlimiter = RateLimiter(
+    burst=int(os.environ.get("TODO_LOGIN_BURST", 10)),
+    rate=float(os.environ.get("TODO_LOGIN_RATE", 0.5)),
+    lockoutafter=int(os.environ.get("TODO_LOGIN_LOCKOUT_AFTER", 5)),
+)
+# registrations hash a password too, but there is nothing to fail -> per address
+# only, and slower
+registerlimiter = RateLimiter(
+    burst=int(os.environ.get("TODO_REGISTER_BURST", 5)),
+    rate=float(os.environ.get("TODO_REGISTER_RATE", 0.05)),
+)
 
 # =================================================================================
 # Configure the Flask Application
@@ -66,6 +118,11 @@ app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
 app.config["SECRET_KEY"] = "droporangemineorate"
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{dbfile}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# pragmas and pool sizing for the engine, see dbprofile.py (TODO_DB_PROFILE=legacy
+# gives the old rollback journal behaviour)
+engineprofile = dbprofile.getprofile(os.environ.get("TODO_DB_PROFILE", "concurrent"))
+app.config["SQLITE_PRAGMAS"] = engineprofile["pragmas"]
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = dbprofile.engineoptions(engineprofile)
 
 # Prepare and connect the LoginManager to this app
 login_manager = LoginManager()
@@ -75,10 +132,27 @@ login_manager.login_view = "get_login"  # type: ignore
 login_manager.session_protection = "strong"
 
 
-# function that takes a user id and returns that user from the database
+# current_user is rebuilt on every authenticated request -> keep a lightweight
+# copy of each recently seen user instead of loading the row every time
+# (see usercache.py). Drop a user's entry whenever their row changes
+usercache = UserCache(maxsize=4096, ttl=60.0)
+
+
+# function that takes a user id and returns that user (a CachedUser, not a User:
+# use current_user.id in queries)
 @login_manager.user_loader
-def load_user(uid: int) -> User | None:
-    return User.query.get(int(uid))
+def load_user(uid: int) -> CachedUser | None:
+    userid = int(uid)
+    if (user := usercache.get(userid)) is not None:
+        return user
+    row = (
+        db.session.query(User.id, User.username, User.themecolor)
+        .filter(User.id == userid)
+        .first()
+    )
+    if row is None:
+        return None
+    return usercache.put(CachedUser(*row))
 
 
 # =================================================================================
@@ -88,6 +162,11 @@ def load_user(uid: int) -> User | None:
 # Getting the database object handle from the app
 db = SQLAlchemy(app)
 
+# pragmas are per connection, so every new connection gets the profile's (this is
+# also what turns on foreign keys, and with them ON DELETE CASCADE)
+with app.app_context():
+    dbprofile.installpragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+
 # =================================================================================
 
 
@@ -98,6 +177,15 @@ class User(UserMixin, db.Model):
     username = db.Column(db.Unicode, nullable=False, unique=True)
     themecolor = db.Column(db.Unicode, default="#2662cb")
     password_hash = db.Column(db.LargeBinary)  # hash is a binary attribute
+    # bumped once per flush that changes any of this user's tasks, task lists, or
+    # subtasks (see stampchanges) -> the rows changed get stamped with the new value
+    changeseq = db.Column(db.Integer, nullable=False, default=0)
+    # the newest change number whose tombstones prunetombstones has deleted -> a
+    # client that last synced before it may have missed deletions
+    prunedseq = db.Column(db.Integer, nullable=False, default=0)
+    # kept up to date by triggers on Tasks (see migrations.py), never set these
+    opentasks = db.Column(db.Integer, nullable=False, default=0)
+    completedtasks = db.Column(db.Integer, nullable=False, default=0)
 
     tasklists = db.relationship("TaskList", backref="user")
 
@@ -111,10 +199,23 @@ class User(UserMixin, db.Model):
     @password.setter
     def password(self, pwd: str) -> None:
         self.password_hash = pwd_hasher.hash(pwd)
+        if self.id is not None:
+            usercache.invalidate(self.id)
 
     # add a verify_password convenience method
     def verify_password(self, pwd: str) -> bool:
-        return pwd_hasher.check(pwd, self.password_hash)
+        if not pwd_hasher.check(pwd, self.password_hash):
+            return False
+        # hashed with parameters from before the last calibration -> this is the
+        # only time we have the password, so hash it again with the current ones
+        # (the caller commits)
+        if pwd_hasher.needs_rehash(self.password_hash):
+            try:
+                self.password = pwd
+            except HashPoolBusy:
+                # not worth failing the login over, try again next time
+                pass
+        return True
 
     def __init__(self, username, password):
         self.username = username
@@ -136,8 +237,24 @@ class User(UserMixin, db.Model):
 
 TasksToTaskLists = db.Table(
     "TasksToTaskLists",
-    db.Column("tlid", db.Unicode, db.ForeignKey("TaskLists.id"), nullable=False),
-    db.Column("taskid", db.Integer, db.ForeignKey("Tasks.id"), nullable=False),
+    # memberships go away with their task or task list (ON DELETE CASCADE)
+    db.Column(
+        "tlid",
+        db.Integer,
+        db.ForeignKey("TaskLists.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column(
+        "taskid",
+        db.Integer,
+        db.ForeignKey("Tasks.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    # the (tlid, taskid) primary key answers "which tasks are in this list" and
+    # this index answers "which lists is this task in" -> both are index-only
+    # lookups, since a WITHOUT ROWID table is stored as its primary key
+    db.Index("ix_taskstotasklists_taskid", "taskid"),
+    sqlite_with_rowid=False,
 )
 
 # =================================================================================
@@ -154,8 +271,75 @@ TasksToTaskLists = db.Table(
 # return context.get_current_parameters()["duetime"]
 
 
+# due dates are stored as UTC epoch milliseconds, so they sort and compare as
+# plain integers and range queries can use the (userid, duedate) index
+EPOCHMS_MAX = int(datetime(9999, 12, 31, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def epochms(value) -> int | None:
+    """Convert a due date in any of the forms it shows up in to epoch ms
+
+    Accepts epoch ms, epoch seconds (what chat_gpt used to send), datetimes
+    (naive ones are local time), dates (midnight UTC), and numeric or ISO 8601
+    strings.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, date):
+        return int(
+            datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+            * 1000
+        )
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{value!r} is not a due date")
+    if not math.isfinite(value):
+        raise ValueError(f"{value!r} is not a due date")
+    # anything below 10^11 can't be milliseconds (that would be before 1973)
+    if abs(value) < 100_000_000_000:
+        value *= 1000
+    # past the year 9999 -> not a date, and soon too big for a SQLite integer
+    if abs(value) > EPOCHMS_MAX:
+        raise ValueError(f"{value!r} is out of range for a due date")
+    return int(value)
+
+
 class Task(db.Model):
     __tablename__ = "Tasks"
+    # almost every query filters on userid, so lead each index with it
+    # (keep these in sync with migrations.py)
+    __table_args__ = (
+        db.Index("ix_tasks_userid_duedate", "userid", "duedate"),
+        # covers the smart list counts and the starred smart list (in due order)
+        db.Index(
+            "ix_tasks_userid_complete_starred_duedate",
+            "userid",
+            "complete",
+            "starred",
+            "duedate",
+        ),
+        # open tasks by due date, for the today/overdue/planned smart lists
+        db.Index(
+            "ix_tasks_open_userid_duedate",
+            "userid",
+            "duedate",
+            sqlite_where=db.text("complete = 0"),
+        ),
+        # finished tasks by when they were finished, for the archive job
+        db.Index(
+            "ix_tasks_done_completedat",
+            "completedat",
+            sqlite_where=db.text("complete = 1"),
+        ),
+        db.Index("ix_tasks_userid_priority", "userid", "priority"),
+        db.Index("ix_tasks_userid_changeseq", "userid", "changeseq"),
+    )
 
     # -----------------------------------------------------
     # non-nullable attributes
@@ -183,25 +367,53 @@ class Task(db.Model):
     notes = db.Column(db.Unicode, nullable=True)
     userid = db.Column(db.Integer, db.ForeignKey("Users.id"), nullable=False)
 
+    # set by stampchanges whenever the task changes (for /api/v1/sync/)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    changeseq = db.Column(db.Integer, nullable=False, default=0)
+    # when the task was marked complete (UTC) -> the archive job moves tasks that
+    # have been done for a while out of this table
+    completedat = db.Column(db.DateTime, nullable=True)
+
     # now we have a list of subtasks which can refer to their task through the task var
-    subtasks = db.relationship("Subtask", backref="task")
+    # the database deletes subtasks along with their task (ON DELETE CASCADE)
+    subtasks = db.relationship("Subtask", backref="task", passive_deletes=True)
     tasklists = db.relationship(
         "TaskList", secondary=TasksToTaskLists, back_populates="tasks"
     )
 
+    @db.validates("duedate")
+    def validate_duedate(self, key, value):
+        return epochms(value)
+
+    @db.validates("complete")
+    def validate_complete(self, key, value):
+        value = bool(value)
+        if value and not self.complete:
+            self.completedat = datetime.utcnow()
+        elif not value:
+            self.completedat = None
+        return value
+
     def __eq__(self, othertask):
         return isinstance(othertask, Task) and self.id == othertask.id
 
-    def to_json(self) -> dict:
-        return {
+    # tasklistnames/subtasks can be passed in by serializetasks() so that
+    # serializing many tasks doesn't lazy load self.tasklists once per task
+    def to_json(self, tasklistnames: list[str] | None = None, subtasks=None) -> dict:
+        if tasklistnames is None:
+            tasklistnames = [tasklist.name for tasklist in self.tasklists]
+        taskjson = {
             "id": self.id,
             "name": self.name,
             "duedate": self.duedate,
             "complete": self.complete,
             "starred": self.starred,
             "notes": self.notes,
-            "tasklistnames": [tasklist.name for tasklist in self.tasklists],
+            "tasklistnames": tasklistnames,
         }
+        if subtasks is not None:
+            taskjson["subtasks"] = [subtask.to_json() for subtask in subtasks]
+        return taskjson
 
     def from_json(json):
         return Task(
@@ -219,17 +431,40 @@ class Task(db.Model):
 
 class Subtask(db.Model):
     __tablename__ = "Subtasks"
+    __table_args__ = (
+        db.Index("ix_subtasks_taskid", "taskid"),
+        db.Index("ix_subtasks_userid_changeseq", "userid", "changeseq"),
+        # a task's subtasks are uniquely named
+        db.Index("ux_subtasks_taskid_name", "taskid", "name", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Unicode, nullable=False)
     complete = db.Column(db.Boolean, nullable=False, default=False)
-    taskid = db.Column(db.Integer, db.ForeignKey("Tasks.id"), nullable=False)
+    taskid = db.Column(
+        db.Integer, db.ForeignKey("Tasks.id", ondelete="CASCADE"), nullable=False
+    )
 
     # should be a value in range [1,10] if not null
     priority = db.Column(db.Integer, nullable=True)
 
+    # copy of task.userid (filled in by stampchanges) so that syncing subtasks
+    # doesn't have to go through every one of the user's tasks
+    userid = db.Column(db.Integer, db.ForeignKey("Users.id"), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    changeseq = db.Column(db.Integer, nullable=False, default=0)
+
     def __eq__(self, otherst):
         return isinstance(otherst, Subtask) and self.id == otherst.id
 
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "taskid": self.taskid,
+            "name": self.name,
+            "complete": self.complete,
+            "priority": self.priority,
+        }
+
     # def __init__(self,name,taskid,complete=False):
     # self.name=name
     # self.taskid=taskid
@@ -241,6 +476,12 @@ class Subtask(db.Model):
 
 class TaskList(db.Model):
     __tablename__ = "TaskLists"
+    __table_args__ = (
+        db.Index("ix_tasklists_userid", "userid"),
+        db.Index("ix_tasklists_userid_changeseq", "userid", "changeseq"),
+        # a user's task lists are uniquely named
+        db.Index("ux_tasklists_userid_name", "userid", "name", unique=True),
+    )
     # need an integer id because we want different users to be able to have
     # task lists with the same name
     id = db.Column(db.Integer, primary_key=True)
@@ -250,6 +491,12 @@ class TaskList(db.Model):
     )
     userid = db.Column(db.Integer, db.ForeignKey("Users.id"), nullable=False)
 
+    updated_at = db.Column(db.DateTime, nullable=True)
+    changeseq = db.Column(db.Integer, nullable=False, default=0)
+    # kept up to date by triggers on Tasks and TasksToTaskLists, never set these
+    opentasks = db.Column(db.Integer, nullable=False, default=0)
+    completedtasks = db.Column(db.Integer, nullable=False, default=0)
+
     def appendtask(self, task):
         self.tasks.append(task)
 
@@ -260,7 +507,12 @@ class TaskList(db.Model):
         return isinstance(othertl, TaskList) and self.id == othertl.id
 
     def to_json(self):
-        return {"id": self.id, "name": self.name}
+        return {
+            "id": self.id,
+            "name": self.name,
+            "open": self.opentasks,
+            "completed": self.completedtasks,
+        }
 
     # def __init__(self,name,userid=None,user=None):
     # self.name=name
@@ -270,17 +522,250 @@ class TaskList(db.Model):
 
 # =================================================================================
 
-# remember that all database operations must occur within an app context
-# we'll want to get rid of drop_all() + create_all() in the future
-with app.app_context():
-    db.drop_all()
-    db.create_all()  # this is only needed if the database doesn't already exist
 
+# a deleted task, task list, or subtask -> lets /api/v1/sync/ tell clients what
+# to remove
+class Tombstone(db.Model):
+    __tablename__ = "Tombstones"
+    __table_args__ = (
+        db.Index("ix_tombstones_userid_changeseq", "userid", "changeseq"),
+        db.Index("ix_tombstones_deleted_at", "deleted_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    userid = db.Column(db.Integer, db.ForeignKey("Users.id"), nullable=False)
+    # "task", "tasklist", or "subtask"
+    kind = db.Column(db.Unicode, nullable=False)
+    objectid = db.Column(db.Integer, nullable=False)
+    changeseq = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False)
+
+    def to_json(self) -> dict:
+        return {"kind": self.kind, "id": self.objectid}
+
+
+# tombstones older than this many days are deleted by prune-tombstones
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get("TODO_TOMBSTONE_RETENTION_DAYS", 30))
+
+
+# a task the archive job moved out of Tasks, with what it needs to be searched
+# and restored -> its lists and subtasks are kept as JSON, so the join table and
+# Subtasks only hold working data
+class ArchivedTask(db.Model):
+    __tablename__ = "ArchivedTasks"
+    __table_args__ = (
+        db.Index("ix_archivedtasks_userid_completedat", "userid", "completedat"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    # id the task had in Tasks (a restored task gets a new one)
+    taskid = db.Column(db.Integer, nullable=False)
+    userid = db.Column(db.Integer, db.ForeignKey("Users.id"), nullable=False)
+    name = db.Column(db.Unicode, nullable=False)
+    starred = db.Column(db.Boolean, nullable=False, default=False)
+    progressnotes = db.Column(db.Unicode, nullable=True)
+    duedate = db.Column(db.Integer, nullable=True)
+    duetime = db.Column(db.Time, nullable=True)
+    priority = db.Column(db.Integer, nullable=True)
+    notes = db.Column(db.Unicode, nullable=True)
+    completedat = db.Column(db.DateTime, nullable=False)
+    archivedat = db.Column(db.DateTime, nullable=False)
+    # JSON: [tasklistid, ...] and [{"name", "complete", "priority"}, ...]
+    tasklistids = db.Column(db.Unicode, nullable=False, default="[]")
+    subtasks = db.Column(db.Unicode, nullable=False, default="[]")
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "taskid": self.taskid,
+            "name": self.name,
+            "duedate": self.duedate,
+            "starred": self.starred,
+            "notes": self.notes,
+            "completedat": epochms(self.completedat.replace(tzinfo=timezone.utc)),
+            "tasklistids": json.loads(self.tasklistids),
+            "subtasks": json.loads(self.subtasks),
+        }
+
+
+# =================================================================================
+# Change tracking
+# =================================================================================
+
+TOMBSTONE_KINDS = {Task: "task", TaskList: "tasklist", Subtask: "subtask"}
+
+
+def nextchangeseq(userid: int) -> int:
+    """Atomically bump and return the user's change sequence"""
+    # go through the connection so this doesn't autoflush in the middle of a flush
+    return (
+        db.session.connection()
+        .execute(
+            User.__table__.update()
+            .where(User.id == userid)
+            .values(changeseq=User.changeseq + 1)
+            .returning(User.changeseq)
+        )
+        .scalar_one()
+    )
+
+
+def changeowner(obj) -> int | User:
+    """The id of the user whose task/task list/subtask this is (or the User itself
+    when it is pending and doesn't have an id yet)"""
+    if isinstance(obj, Subtask):
+        task = obj.task if obj.task is not None else db.session.get(Task, obj.taskid)
+        owner = changeowner(task)
+        if not isinstance(owner, User):
+            obj.userid = owner
+        return owner
+    if obj.userid is not None:
+        return obj.userid
+    return obj.user.id if obj.user.id is not None else obj.user
+
+
+@event.listens_for(db.session, "before_flush")
+def stampchanges(session, flush_context, instances):
+    """Give everything this flush creates, changes, or deletes the owner's next
+    change sequence number, and leave a tombstone for what it deletes
+
+    The user's changeseq doubles as the version of all of their data (see
+    conditional), so changes to the user row itself (theme color) bump it too.
+    """
+    changed: dict[int | User, list] = {}
+    deleted: dict[int | User, list] = {}
+    with session.no_autoflush:
+        for obj in session.dirty:
+            if isinstance(obj, User) and session.is_modified(obj):
+                changed.setdefault(obj.id, [])
+        for obj in session.new:
+            if type(obj) in TOMBSTONE_KINDS:
+                changed.setdefault(changeowner(obj), []).append(obj)
+        for obj in session.dirty:
+            if type(obj) in TOMBSTONE_KINDS and session.is_modified(obj):
+                changed.setdefault(changeowner(obj), []).append(obj)
+        for obj in session.deleted:
+            if type(obj) in TOMBSTONE_KINDS:
+                deleted.setdefault(changeowner(obj), []).append(obj)
+
+    now = datetime.utcnow()
+    for owner in changed.keys() | deleted.keys():
+        if isinstance(owner, User):
+            # brand new user -> nobody can have synced their data yet
+            owner.changeseq = seq = (owner.changeseq or 0) + 1
+        else:
+            seq = nextchangeseq(owner)
+        for obj in changed.get(owner, []):
+            obj.changeseq = seq
+            obj.updated_at = now
+        for obj in deleted.get(owner, []):
+            session.add(
+                Tombstone(
+                    userid=owner if isinstance(owner, int) else owner.id,
+                    kind=TOMBSTONE_KINDS[type(obj)],
+                    objectid=obj.id,
+                    changeseq=seq,
+                    deleted_at=now,
+                )
+            )
+
+
+def conditional(view):
+    """Give a read endpoint's response a strong ETag and answer 304 Not Modified
+    when the client already has the current version
+
+    The ETag is derived from the user's data version (changeseq, which every
+    mutation bumps through stampchanges) and the request URL, so the check
+    happens before the view runs a single query for the body.
+    """
+
+    @wraps(view)
+    def conditionalview(*args, **kwargs):
+        # current_user is cached (see load_user), so read the live value
+        changeseq = (
+            db.session.query(User.changeseq).filter_by(id=current_user.id).scalar()
+        )
+        version = f"{current_user.id}:{changeseq}:{request.full_path}"
+        etag = hashlib.sha1(version.encode("utf-8")).hexdigest()
+        if etag in request.if_none_match:
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        # the browser may keep a copy but has to revalidate it every time
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    return conditionalview
+
+
+def requestmemo(provider):
+    """Remember what provider() returns in flask.g for the rest of the request, so
+    a form's choices are queried once however many times they are asked for"""
+    key = f"memo_{provider.__name__}"
+
+    @wraps(provider)
+    def memoized():
+        if key not in g:
+            setattr(g, key, provider())
+        return getattr(g, key)
+
+    return memoized
+
+
+# =================================================================================
+
+
+def serializetasks(tasks, withsubtasks: bool = False) -> list[dict]:
+    """Serialize tasks in a constant number of queries
+
+    tasks is either a task query or a list of already loaded tasks (a page).
+    One query loads the names of the lists those tasks belong to and, if
+    withsubtasks, one more loads their subtasks. A query is reused as a subquery
+    for those lookups, so this works the same for 10 tasks as for 50k.
+    """
+    if isinstance(tasks, list):
+        taskids = [task.id for task in tasks]
+    else:
+        taskids = db.select(tasks.with_entities(Task.id).subquery().c.id)
+        tasks = tasks.all()
+    if not tasks:
+        return []
+
+    tasklistnames: dict[int, list[str]] = {task.id: [] for task in tasks}
+    memberships = (
+        db.session.query(TasksToTaskLists.c.taskid, TaskList.name)
+        .join(TaskList, TaskList.id == TasksToTaskLists.c.tlid)
+        .filter(TasksToTaskLists.c.taskid.in_(taskids))
+    )
+    for taskid, tlname in memberships:
+        tasklistnames[taskid].append(tlname)
+
+    subtasks: dict[int, list[Subtask]] | None = None
+    if withsubtasks:
+        subtasks = {task.id: [] for task in tasks}
+        for subtask in Subtask.query.filter(Subtask.taskid.in_(taskids)).order_by(
+            Subtask.id
+        ):
+            subtasks[subtask.taskid].append(subtask)
+
+    return [
+        task.to_json(
+            tasklistnames[task.id], subtasks[task.id] if subtasks is not None else None
+        )
+        for task in tasks
+    ]
+
+
+# =================================================================================
+
+# fill a brand new database with a few demo users, tasks, and task lists
+def seeddemodata():
     nk = User("natekuhns", "swink123")
     ce = User("calebeinolf", "boink123")
     dlr = User("david", "pass123456")
 
     db.session.add_all((nk, ce, dlr))
+    # some of the tasks below refer to their user by id
+    db.session.commit()
 
     nktask1 = Task(
         name="W project checkpoint",
@@ -298,11 +783,13 @@ with app.app_context():
     nktask4 = Task(name="Christmas!", duedate=1735102800000, user=nk, starred=True)
     nktask5 = Task(name="Christmas Eve", duedate=1735016400000, user=nk, starred=False)
 
-    dtask1 = Task(name="Run Laundry", duedate=date(2024, 11, 2), userid=3)
+    # 11/2/2024, 12/10/2024, 12/24/2024, and 12/25/2024 (local midnight, like the
+    # dates the client sends)
+    dtask1 = Task(name="Run Laundry", duedate=1730520000000, userid=3)
 
-    ctask1 = Task(name="Run Laundry", duedate=date(2024, 12, 10), userid=2)
-    ctask2 = Task(name="Christmas Eve", duedate=date(2024, 12, 24), userid=2)
-    ctask3 = Task(name="Christmas", duedate=date(2024, 12, 25), userid=2)
+    ctask1 = Task(name="Run Laundry", duedate=1733806800000, userid=2)
+    ctask2 = Task(name="Christmas Eve", duedate=1735016400000, userid=2)
+    ctask3 = Task(name="Christmas", duedate=1735102800000, userid=2)
 
     db.session.add_all(
         (nktask1, nktask2, nktask3, nktask4, nktask5, dtask1, ctask1, ctask2, ctask3)
@@ -322,12 +809,162 @@ with app.app_context():
 
     db.session.commit()
 
+
+# remember that all database operations must occur within an app context
+# upgrade the existing database in place (see migrations.py) and only fill in the
+# demo data when the database was just created
+with app.app_context():
+    if migrations.upgrade(db.engine, db.metadata.create_all):
+        seeddemodata()
+
+
+# =================================================================================
+# Server Side Sessions
+# =================================================================================
+
+# the session (anonymous tasks, flow state, login) stays on the server and the
+# cookie only holds its id, see serversession.py. TODO_SESSION_STORE picks where:
+# sqlite (default, shared by every process using the database), memory (this
+# process only) or cookie (Flask's signed cookie with all the data in it)
+sessionstore = os.environ.get("TODO_SESSION_STORE", "sqlite")
+if sessionstore == "sqlite":
+    with app.app_context():
+        app.session_interface = ServerSessionInterface(SQLiteStore(db.engine))
+elif sessionstore == "memory":
+    app.session_interface = ServerSessionInterface(MemoryStore())
+elif sessionstore != "cookie":
+    raise ValueError(
+        f"unknown session store {sessionstore} (choose from sqlite, memory, cookie)"
+    )
+
+
+def regeneratesession() -> None:
+    """Give the session a new id (see ServerSessionInterface.regenerate), at
+    every login and logout"""
+    if isinstance(app.session_interface, ServerSessionInterface):
+        app.session_interface.regenerate(session)
+
+
+def setsessionvalue(key: str, value) -> None:
+    """session[key] = value, unless the session already holds that value: any
+    assignment marks the session modified, and a modified session is written
+    back to the store"""
+    if key not in session or session[key] != value:
+        session[key] = value
+
+
+# =================================================================================
+# Maintenance Commands
+# =================================================================================
+
+
+def taskcounts(owner, complete: bool):
+    """Real number of open (complete=False) or completed tasks of a User or
+    TaskList row, as a correlated subquery"""
+    done = db.true() if complete else db.false()
+    if owner is User:
+        return (
+            db.select(db.func.count())
+            .where(Task.userid == User.id, Task.complete == done)
+            .scalar_subquery()
+        )
+    return (
+        db.select(db.func.count())
+        .select_from(TasksToTaskLists)
+        .join(Task, Task.id == TasksToTaskLists.c.taskid)
+        .where(TasksToTaskLists.c.tlid == TaskList.id, Task.complete == done)
+        .scalar_subquery()
+    )
+
+
+@app.cli.command("calibrate-hasher")
+@click.option(
+    "--target-ms", default=250.0, help="How long verifying a password should take."
+)
+@click.option(
+    "--memory-kib", default=65536, help="Most memory one hash may use, in KiB."
+)
+@click.option("--parallelism", default=4, help="Argon2 lanes per hash.")
+def calibratehasher(target_ms: float, memory_kib: int, parallelism: int) -> None:
+    """Pick argon2 parameters for this machine and save them to the hash
+    parameters file (run with `flask --app app calibrate-hasher`). Passwords are
+    rehashed with them the next time each user logs in."""
+    params = calibrate(target_ms, memory_kib, parallelism)
+    save_params(hashparamsfile, params)
+    print(f"saved {params} to {hashparamsfile}, restart the app to use them")
+
+
+@app.cli.command("check-counters")
+@click.option("--repair", is_flag=True, help="Overwrite wrong counters with the real counts.")
+def checkcounters(repair: bool) -> None:
+    """Compare every user's and task list's task counters with the real counts
+    (run with `flask --app app check-counters [--repair]`)"""
+    wrong = 0
+    for owner in (User, TaskList):
+        actualopen, actualdone = taskcounts(owner, False), taskcounts(owner, True)
+        rows = db.session.execute(
+            db.select(
+                owner.id,
+                owner.opentasks,
+                owner.completedtasks,
+                actualopen,
+                actualdone,
+            ).where(
+                db.or_(owner.opentasks != actualopen, owner.completedtasks != actualdone)
+            )
+        ).all()
+        for ownerid, opentasks, completedtasks, realopen, realdone in rows:
+            print(
+                f"{owner.__tablename__} {ownerid}: counters say {opentasks} open/"
+                f"{completedtasks} completed, actually {realopen}/{realdone}"
+            )
+            if repair:
+                db.session.execute(
+                    db.update(owner)
+                    .where(owner.id == ownerid)
+                    .values(opentasks=realopen, completedtasks=realdone)
+                )
+        wrong += len(rows)
+    db.session.commit()
+    if not wrong:
+        print("all task counters are correct")
+    elif repair:
+        print(f"repaired {wrong} counters")
+    else:
+        print(f"{wrong} counters are wrong, run again with --repair to fix them")
+
+
+@app.cli.command("prune-tombstones")
+@click.option(
+    "--days",
+    default=TOMBSTONE_RETENTION_DAYS,
+    help="Keep the tombstones of deletions from the last this many days.",
+)
+def prunetombstonescommand(days: int) -> None:
+    """Delete the tombstones of deletions older than --days days (run with `flask
+    --app app prune-tombstones`, e.g. daily from cron). Clients that last synced
+    before them get a 410 and sync from scratch"""
+    pruned = prunetombstones(datetime.utcnow() - timedelta(days=days))
+    db.session.commit()
+    print(f"pruned {pruned} tombstones")
+
+
+@app.cli.command("cleanup-sessions")
+def cleanupsessions() -> None:
+    """Delete expired server side sessions (run with `flask --app app
+    cleanup-sessions`). Requests also sweep them out about once an hour"""
+    if not isinstance(app.session_interface, ServerSessionInterface):
+        print("sessions are kept in cookies, nothing to clean up")
+        return
+    print(f"deleted {app.session_interface.store.cleanup()} expired sessions")
+
 # thought it would eliminate a lot of headache to just put these forms
 # in app.py so that we can more easily validate things with the database
 # =================================================================================
 # SERVER SIDE VALIDATION FORMS FOR TASK, TASK LIST, AND SUBTASK CREATION AND DELETION
 # =================================================================================
 from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
 from wtforms.fields import (
     SubmitField,
     StringField,
@@ -370,12 +1007,17 @@ class TaskListCreationForm(FlaskForm):
 
     # tasks, subtasks, and task lists should be uniquely named
     def validate_name(form, field):
-        tasklists = TaskList.query.filter_by(user=current_user).all()
-        for tl in tasklists:
-            if tl.name == form.name.data:
-                raise ValidationError(
-                    f"Cannot have multiple task lists with the same name. There is already a task list named {tl.name}."
+        # one probe of the unique (userid, name) index
+        if db.session.scalar(
+            db.select(
+                db.exists().where(
+                    TaskList.userid == current_user.id, TaskList.name == field.data
                 )
+            )
+        ):
+            raise ValidationError(
+                f"Cannot have multiple task lists with the same name. There is already a task list named {field.data}."
+            )
 
 
 # =================================================================================
@@ -481,12 +1123,18 @@ class SubtaskCreationForm(FlaskForm):
 
     def validate_name(form, field):
         # TODO: NEED TO SET currenttaskid IN THE session WHEN WE GO TO ADD SUBTASKS TO A CERTAIN TASK
-        subtasks = Subtask.query.filter_by(taskid=session.get("currenttaskid")).all()
-        for st in subtasks:
-            if st.name == form.name.data:
-                raise ValidationError(
-                    f"Error, cannot have multiple subtasks with the same name for a given task. There's already a {st.name} subtask for this task."
+        # one probe of the unique (taskid, name) index
+        if db.session.scalar(
+            db.select(
+                db.exists().where(
+                    Subtask.taskid == session.get("currenttaskid"),
+                    Subtask.name == field.data,
                 )
+            )
+        ):
+            raise ValidationError(
+                f"Error, cannot have multiple subtasks with the same name for a given task. There's already a {field.data} subtask for this task."
+            )
 
 
 # =================================================================================
@@ -541,6 +1189,25 @@ class TaskListDeletionForm(FlaskForm):
 # =================================================================================
 
 
+# the password hashing pool is full -> ask the client to come back shortly rather
+# than holding this worker until a slot frees up
+def hashingbusy():
+    return (
+        "Too many people are signing in right now, please try again in a moment.",
+        503,
+        {"Retry-After": "1"},
+    )
+
+
+# a rate limiter turned this attempt away -> tell the client when to come back
+def toomanyattempts(wait: float):
+    return (
+        "Too many attempts, please try again later.",
+        429,
+        {"Retry-After": str(math.ceil(wait))},
+    )
+
+
 # =================================================================================
 # Register
 @app.get("/register/")
@@ -551,6 +1218,9 @@ def get_register():
 
 @app.post("/register/")
 def post_register():
+    # before anything else, so a flood of registrations costs next to nothing
+    if wait := registerlimiter.acquire(f"ip:{request.remote_addr}"):
+        return toomanyattempts(wait)
     form = RegisterForm()
     if form.validate():
         # check if there is already a user with this username
@@ -560,7 +1230,10 @@ def post_register():
             # user = User(
             # username=form.username.data, email=form.email.data, password=form.password.data
             # )  # type:ignore
-            user = User(form.username.data, form.password.data)
+            try:
+                user = User(form.username.data, form.password.data)
+            except HashPoolBusy:
+                return hashingbusy()
             db.session.add(user)
             db.session.commit()
             return redirect(url_for("get_login"))
@@ -587,12 +1260,30 @@ def get_login():
 
 @app.post("/login/")
 def post_login():
+    # turn away guessing before it costs a database lookup or a password hash
+    limitkeys = (
+        f"user:{request.form.get('username', '').lower()}",
+        f"ip:{request.remote_addr}",
+    )
+    if wait := loginlimiter.acquire(*limitkeys):
+        return toomanyattempts(wait)
     form = LoginForm()
     if form.validate():
         # try to get the user associated with this username
         user = User.query.filter_by(username=form.username.data).first()
+        try:
+            verified = user is not None and user.verify_password(form.password.data)
+        except HashPoolBusy:
+            return hashingbusy()
         # if this user exists and the password matches
-        if user is not None and user.verify_password(form.password.data):
+        if verified:
+            # only the username's failures are forgiven, one good password
+            # shouldn't unlock an address that is guessing at other accounts
+            loginlimiter.success(limitkeys[0])
+            # save the new hash if verify_password rehashed the password
+            db.session.commit()
+            # a session id from before the login must not get the logged in user
+            regeneratesession()
             # log this user in through the login_manager
             login_user(user)
             print(f"current_user:{current_user}")
@@ -606,6 +1297,7 @@ def post_login():
         else:
             # if the user does not exist or the password is incorrect
             # flash an error message and redirect to login form
+            loginlimiter.failure(*limitkeys)
             flash("Invalid username or password")
             return redirect(url_for("get_login"))
     else:
@@ -619,7 +1311,9 @@ def post_login():
 @app.get("/logout/")
 @login_required
 def get_logout():
+    usercache.invalidate(current_user.id)
     logout_user()
+    regeneratesession()
     flash("You have been logged out")
     return redirect(url_for("getanonymoususerpage"))
 
@@ -631,30 +1325,16 @@ def get_logout():
 def index():
     # reset current task id and tasks for which subtask deletions are happening
     # in case they have values
-    session["deletesubtasksfor"] = []
-    session["currenttaskid"] = None
-    username: str = str(session.get("username"))
-    # check if the user is logged in using the session
-    user_usernames = User.query.with_entities(User.username).all()
-    user_usernames_list = [username[0] for username in user_usernames]
-    print(user_usernames_list)
-
-    if username in user_usernames_list:
-        print("USERNAME: " + username)
-        tasks = Task.query.join(User).filter(User.username == username).all()
-
-        for task in tasks:
-            print(task.duedate)
-        print(date.today())
-        return render_template(
-            "index.html",
-            current_user=current_user,
-            tasks=tasks,
-            current_date=date.today(),
-        )
-    else:
-        flash("Please login")
-        return redirect(url_for("get_login"))
+    setsessionvalue("deletesubtasksfor", [])
+    setsessionvalue("currenttaskid", None)
+    # login_required already checked who this is (current_user comes from the user
+    # cache), and the page loads its tasks itself through /getUserTasks/, so
+    # rendering it doesn't need to touch the database
+    return render_template(
+        "index.html",
+        current_user=current_user,
+        current_date=date.today(),
+    )
 
 
 @app.get("/viewalltasks/")
@@ -718,40 +1398,58 @@ def addtaskforanonymoususer(name: str, duedate: date, complete: bool):
     session["nextanonymoustaskid"] = session.get("nextanonymoustaskid", 0) + 1
 
 
+# =================================================================================
+# Attaching Tasks and Task Lists
+def ownedrows(model, ids) -> list:
+    """The current user's Task or TaskList rows with these (form field) ids,
+    loaded with one IN query, in the order given and without repeats. Empty ids
+    are skipped. Raises ValueError if an id isn't one of the user's rows.
+
+    Assigning the result to a new row's tasks/tasklists collection lets the flush
+    write all of the join rows with a single executemany.
+    """
+    wanted = list(dict.fromkeys(int(rowid) for rowid in ids if rowid))
+    if not wanted:
+        return []
+    if not all(isint64(rowid) for rowid in wanted):
+        raise ValueError("ids must fit in a 64 bit integer")
+    rows = {
+        row.id: row
+        for row in db.session.scalars(
+            db.select(model).where(
+                model.userid == current_user.id, model.id.in_(wanted)
+            )
+        )
+    }
+    if missing := [rowid for rowid in wanted if rowid not in rows]:
+        kind = "task list" if model is TaskList else "task"
+        raise ValueError(f"there is no {kind} {', '.join(map(str, missing))}")
+    return [rows[rowid] for rowid in wanted]
+
+
 # =================================================================================
 # Create Task Via Form
+@requestmemo
 def alltlchoices():
-    # get all of the current user's task lists
-    tasklists = TaskList.query.filter_by(userid=current_user.id).all()
-    # tl is both identified by and labeled by name attribute
-    return [(tl.id, tl.name) for tl in tasklists]
+    # (id, name) of each of the current user's task lists, without loading the rows
+    return db.session.execute(
+        db.select(TaskList.id, TaskList.name).where(TaskList.userid == current_user.id)
+    ).all()
 
 
-@app.get("/api/v0/getcsrftok/<string:mode>/<string:formtype>")
-@login_required
-def getcsrftok(mode: str, formtype: str):
-    # taskform will last outside of if scope
-    if mode == "create" and formtype == "task":
-        form = TaskCreationForm()
-        form.tasklistids.choices = alltlchoices()
-    elif mode == "delete" and formtype == "task":
-        form = TaskDeletionForm()
-        form.taskids.choices = alltaskchoices()
-
-    elif mode == "create" and formtype == "tasklist":
-        form = TaskListCreationForm()
-        form.taskids.choices = alltaskchoices()
-    elif mode == "delete" and formtype == "tasklist":
-        form = TaskListDeletionForm()
-        form.tasklistids.choices = alltlchoices
-
-    elif mode == "create" and formtype == "subtask":
-        form = SubtaskCreationForm()
-    elif mode == "delete" and formtype == "subtask":
-        form = SubtaskDeletionForm()
-        form.subtaskids.choices = subtaskdeletionchoices()
-    # return csrf token html element
-    return form.csrf_token()
+@app.get("/api/v1/csrf/")
+def getCSRFToken():
+    """The CSRF token for the form posts, as JSON: {"token", "expiresin"}
+
+    No form is built and nothing is queried. generate_csrf keeps one raw token
+    in the session and hands out a signed, timestamped copy of it, so a client can
+    reuse the token for expiresin seconds (or until the session changes).
+    """
+    # None -> tokens never expire
+    timelimit = app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    response = jsonify({"token": generate_csrf(), "expiresin": timelimit})
+    response.headers["Cache-Control"] = "private, no-store"
+    return response
 
 
 @app.get("/api/v0/getflashedmessages/")
@@ -787,7 +1485,7 @@ def deleteaut(id: int):
 @login_required
 def gettaskform():
     form = TaskCreationForm()
-    form.tasklistids = alltlchoices()
+    form.tasklistids.choices = alltlchoices()
     return render_template("genericform.html", form=form)
 
 
@@ -806,16 +1504,15 @@ def posttaskform():
             duetime=form.duetime.data,
             priority=form.priority.data,
             notes=form.generalnotes.data,
-            user=current_user,
+            userid=current_user.id,
         )
 
-        # add a db tasklist to the task for each of the names in tasklistids
-        # each task added must belong to the current user
-        for tasklistid in form.tasklistids.data:
-            # print(f"attempting to add {TaskList.query.filter_by(user=current_user,id=tasklistid).first()} (filter by current user and task list name)")
-            newtask.tasklists.append(
-                TaskList.query.filter_by(userid=current_user.id, id=tasklistid).first()
-            )
+        # put the task in each of the (current user's) task lists in tasklistids
+        try:
+            newtask.tasklists = ownedrows(TaskList, form.tasklistids.data)
+        except ValueError as e:
+            flash(f"Error in tasklistids: {e}")
+            return redirect(url_for("gettaskform"))
         # add and commit to the database, then we ask if the user would like to add subtasks
         db.session.add(newtask)
         db.session.commit()
@@ -864,7 +1561,12 @@ def postsubtaskform():
         )
 
         db.session.add(newst)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another request took the name after validate_name checked it
+            db.session.rollback()
+            flash(f"Error in name: there is already a {newst.name} subtask for this task.")
         return redirect(url_for("getsubtaskform"))
     for field, em in form.errors.items():
         flash(f"Error in {field}: {em}")
@@ -873,11 +1575,12 @@ def postsubtaskform():
 
 # =================================================================================
 # Creating Task Lists Via Form
+@requestmemo
 def alltaskchoices():
-    # current_user is of type User -> sweet
-    # get the tasks for the current user
-    tasks = Task.query.filter_by(userid=current_user.id).all()
-    return [(task.id, task.name) for task in tasks]
+    # (id, name) of each of the current user's tasks, without loading the rows
+    return db.session.execute(
+        db.select(Task.id, Task.name).where(Task.userid == current_user.id)
+    ).all()
 
 
 # when the user clicks the button to add task list, a post request will be sent to
@@ -898,15 +1601,20 @@ def posttasklistform():
 
         newtl = TaskList(name=form.name.data, userid=current_user.id)
 
-        # add a db task to the task list for each of the ids in taskids
-        # each task added must belong to the current user
-        for taskid in form.taskids.data:
-            # print(f"attempting to add {Task.query.filter_by(user=current_user,id=taskid).first()} (filter by current user and task list id)")
-            newtl.appendtask(
-                Task.query.filter_by(userid=current_user.id, id=taskid).first()
-            )
+        # put each of the (current user's) tasks in taskids in the new list
+        try:
+            newtl.tasks = ownedrows(Task, form.taskids.data)
+        except ValueError as e:
+            flash(f"Error in taskids: {e}")
+            return redirect(url_for("gettasklistform"))
         db.session.add(newtl)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another request took the name after validate_name checked it
+            db.session.rollback()
+            flash(f"Error in name: there is already a task list named {newtl.name}.")
+            return redirect(url_for("gettasklistform"))
         return redirect(url_for("index"))
     for field, em in form.errors.items():
         flash(f"Error in {field}: {em}")
@@ -918,146 +1626,282 @@ def posttasklistform():
 # =================================================================================
 
 import chat_gpt
-import assemblyai as aai
 from config import assemblyAIKey
+from aijobs import AIJobQueue, AIQueueFull, AssemblyAITranscriber, FakeLLM
+from aijobs import FakeTranscriber, MemoryJobStore, OpenAILLM, SQLiteJobStore
 
 
-@app.post("/speech_for_gpt/")
-@login_required
-def talkToGPT():
-    file = request.files["file"]
-    file.save("client_side_audio.webm")
-
-    aai.settings.api_key = assemblyAIKey
-    transcriber = aai.Transcriber()
-
-    transcript = transcriber.transcribe("client_side_audio.webm")
-    # transcript = transcriber.transcribe("./my-local-audio-file.wav")
-
-    question = transcript.text
-
-    print(question)
-
-    allTaskLists: list[TaskList] = TaskList.query.filter_by(
-        userid=current_user.id
-    ).all()
-    allTaskListNames: list[str] = [taskList.name for taskList in allTaskLists]
-    allTasks: list[Task] = Task.query.filter_by(userid=current_user.id).all()
-    allTaskNames: list[str] = [task.name for task in allTasks]
-
-    chatGpt = chat_gpt.Chat_GPT()
-    response: chat_gpt.Chat_GPT_Response = chatGpt.newAsk(
-        question, allTaskListNames, allTaskNames
-    )
-    if response.error_message == "None":
-        addGPTResponse(response)
-
-        for tasklist in response.tasklists:
-            dbTasklist: TaskList = TaskList.query.filter_by(
-                name=tasklist.name, userid=current_user.id
-            ).first()
-            tasklist.id = dbTasklist.id
-
-        for subtask in response.subtasks:
-            dbParentTask: Task = Task.query.filter_by(
-                name=subtask.parenttaskname, userid=current_user.id
-            ).first()
-            dbSubtask: Subtask = Subtask.query.filter_by(
-                name=subtask.name, taskid=dbParentTask.id
-            )
-            subtask.id = dbSubtask.id
-
-        for task in response.tasks:
-            dbTask: Task = Task.query.filter_by(
-                name=task.name, userid=current_user.id
-            ).first()
-            task.id = dbTask.id
-
-        return jsonify({"status": "success", "GPTResponse": response.toDict()})
-    else:
-        flash(f"ChatGPT Error: {response.error_message}")
-        return jsonify({"status": "error", "GPTResponse": response.toDict()})
-
-@app.get("/askChatGPT/")
-@login_required
-def askGPT():
-    question: str = request.args.get("question")
-
-    allTaskLists: list[TaskList] = TaskList.query.filter_by(
-        userid=current_user.id
-    ).all()
-    allTaskListNames: list[str] = [taskList.name for taskList in allTaskLists]
-    allTasks: list[Task] = Task.query.filter_by(userid=current_user.id).all()
-    allTaskNames: list[str] = [task.name for task in allTasks]
-
-    chatGpt = chat_gpt.Chat_GPT()
-    response: chat_gpt.Chat_GPT_Response = chatGpt.newAsk(
-        question, allTaskListNames, allTaskNames
+def boundednames(query, budget: int) -> list[str]:
+    """The names query returns, as many as fit in the prompt's budget bytes (see
+    chat_gpt.takebounded). Rows are streamed, and the ones after the budget is
+    full are never read"""
+    # a name takes at least 2 bytes with its comma -> never more rows than this
+    result = db.session.scalars(
+        query.limit(budget // 2).execution_options(yield_per=256)
+    )
+    try:
+        return chat_gpt.takebounded(result, budget)
+    finally:
+        result.close()
+
+
+def gptcontextnames(userid: int) -> chat_gpt.PromptNames:
+    """The user's task list names and task names for the prompt, the most
+    recently changed first, as many as the prompt has room for (see
+    chat_gpt.PromptTemplate). Both come off the (userid, changeseq) indexes, so
+    this reads about the same few rows for 100 tasks as for 100k"""
+    budget = chat_gpt.TEMPLATE.maxcontextbytes
+    taskListNames = boundednames(
+        db.select(TaskList.name)
+        .where(TaskList.userid == userid)
+        .order_by(TaskList.changeseq.desc()),
+        budget,
+    )
+    taskNames = boundednames(
+        db.select(Task.name)
+        .where(Task.userid == userid)
+        .order_by(Task.changeseq.desc()),
+        budget - sum(len(name.encode("utf-8")) + 1 for name in taskListNames),
+    )
+    # the totals come from the task counters and the task list index
+    tasklistcount = db.session.scalar(
+        db.select(db.func.count()).where(TaskList.userid == userid)
+    )
+    opentasks, completedtasks = (
+        db.session.query(User.opentasks, User.completedtasks)
+        .filter(User.id == userid)
+        .one()
+    )
+    return chat_gpt.PromptNames(
+        taskListNames, taskNames, tasklistcount, opentasks + completedtasks
     )
 
-    if response.error_message == "None":
-
-        addGPTResponse(response)
-
-        for tasklist in response.tasklists:
-            dbTasklist: TaskList = TaskList.query.filter_by(
-                name=tasklist.name, userid=current_user.id
-            ).first()
-            tasklist.id = dbTasklist.id
-
-        for subtask in response.subtasks:
-            dbParentTask: Task = Task.query.filter_by(
-                name=subtask.parenttaskname, userid=current_user.id
-            ).first()
-            dbSubtask: Subtask = Subtask.query.filter_by(
-                name=subtask.name, taskid=dbParentTask.id
-            )
-            subtask.id = dbSubtask.id
-
-        for task in response.tasks:
-            dbTask: Task = Task.query.filter_by(
-                name=task.name, userid=current_user.id
-            ).first()
-            task.id = dbTask.id
-            # task.duedate = dbTask.duedate
-
-        return jsonify({"status": "success", "GPTResponse": response.toDict()})
-    else:
-        flash(f"ChatGPT Error: {response.error_message}")
-        return jsonify({"status": "error", "GPTResponse": response.toDict()})
-
-
-def addGPTResponse(response: chat_gpt.Chat_GPT_Response):
 
+def addGPTResponse(response: chat_gpt.Chat_GPT_Response, userid: int) -> None:
+    """Save what the LLM came up with for the user in one transaction, filling in
+    the id of every task list, task, and subtask on the response. Task lists and
+    subtasks the user already has (names are unique) are reused, not added again"""
+    listnames = {tasklist.name for tasklist in response.tasklists}
+    listnames.update(name for task in response.tasks for name in task.tasklistnames)
+    tasklists: dict[str, TaskList] = {
+        tasklist.name: tasklist
+        for tasklist in TaskList.query.filter(
+            TaskList.userid == userid, TaskList.name.in_(listnames)
+        )
+    }
     for tasklist in response.tasklists:
-        t: TaskList = TaskList(name=tasklist.name, userid=current_user.id)
-        db.session.add(t)
-    db.session.commit()
+        if tasklist.name not in tasklists:
+            tasklists[tasklist.name] = TaskList(name=tasklist.name, userid=userid)
+            db.session.add(tasklists[tasklist.name])
 
+    newtasks: list[Task] = []
     for task in response.tasks:
-        taskLists: list[TaskList] = TaskList.query.filter(
-            TaskList.name.in_(task.tasklistnames), TaskList.userid == current_user.id
-        ).all()
-        db.session.add(
+        newtasks.append(
             Task(
                 name=task.name,
                 starred=task.starred,
                 duedate=task.duedate,
                 priority=task.priority,
-                userid=current_user.id,
-                tasklists=taskLists,
+                userid=userid,
+                tasklists=[
+                    tasklists[name]
+                    for name in dict.fromkeys(task.tasklistnames)
+                    if name in tasklists
+                ],
             )
         )
-    db.session.commit()
+    db.session.add_all(newtasks)
+    # -> ids for everything so far
+    db.session.flush()
+
+    # a subtask goes to the task of that name in this response, or else to the
+    # user's newest task of that name (and is dropped if there is none)
+    parentids: dict[str, int] = {task.name: task.id for task in newtasks}
+    missing = {subtask.parenttaskname for subtask in response.subtasks}
+    missing -= parentids.keys()
+    parentids.update(
+        db.session.execute(
+            db.select(Task.name, db.func.max(Task.id))
+            .where(Task.userid == userid, Task.name.in_(missing))
+            .group_by(Task.name)
+        ).all()
+    )
+    # (parent task id, name) -> the subtask, subtask names are unique per task
+    subtasks: dict[tuple[int, str], Subtask | int] = {
+        (taskid, name): subtaskid
+        for taskid, name, subtaskid in db.session.execute(
+            db.select(Subtask.taskid, Subtask.name, Subtask.id).where(
+                Subtask.taskid.in_(parentids.values()),
+                Subtask.name.in_({subtask.name for subtask in response.subtasks}),
+            )
+        ).tuples()
+    }
+    for subtask in response.subtasks:
+        taskid = parentids.get(subtask.parenttaskname)
+        if taskid is not None and (taskid, subtask.name) not in subtasks:
+            subtasks[taskid, subtask.name] = Subtask(
+                name=subtask.name, priority=subtask.priority, taskid=taskid
+            )
+            db.session.add(subtasks[taskid, subtask.name])
+    db.session.flush()
 
+    for tasklist in response.tasklists:
+        tasklist.id = tasklists[tasklist.name].id
+    for task, dbTask in zip(response.tasks, newtasks):
+        task.id = dbTask.id
     for subtask in response.subtasks:
-        taskid = Task.query.filter(Task.name == subtask.parenttaskname).first().id
-        db.session.add(
-            Subtask(name=subtask.name, priority=subtask.priority, taskid=taskid)
-        )
+        taskid = parentids.get(subtask.parenttaskname)
+        dbSubtask = subtasks.get((taskid, subtask.name))
+        if dbSubtask is not None:
+            subtask.id = dbSubtask if isinstance(dbSubtask, int) else dbSubtask.id
     db.session.commit()
 
 
+def gptresult(response: chat_gpt.Chat_GPT_Response, userid: int) -> dict:
+    """Save what the LLM came up with for the user and give it back with the
+    rows' ids filled in"""
+    addGPTResponse(response, userid)
+    return {"status": "success", "GPTResponse": response.toDict()}
+
+
+# the AI jobs run on worker threads of their own -> each step gets its own app
+# context (and with it its own database session)
+def jobcontext(userid: int) -> chat_gpt.PromptNames:
+    with app.app_context():
+        return gptcontextnames(userid)
+
+
+def jobresult(userid: int, response: chat_gpt.Chat_GPT_Response) -> dict:
+    with app.app_context():
+        return gptresult(response, userid)
+
+
+# questions and recordings are answered by a bounded pool of AI workers (see
+# aijobs.py): TODO_AI_WORKERS at a time, with up to TODO_AI_QUEUE more waiting.
+# TODO_AI_BACKEND=fake answers locally without calling OpenAI or AssemblyAI.
+# TODO_AI_JOB_STORE picks where the jobs' state lives: sqlite (default, so every
+# process using the database can answer a poll) or memory (this process only)
+aiworkers = int(os.environ.get("TODO_AI_WORKERS", 4))
+if os.environ.get("TODO_AI_BACKEND", "openai") == "fake":
+    llm, transcriber = FakeLLM(), FakeTranscriber()
+else:
+    llm, transcriber = OpenAILLM(), AssemblyAITranscriber(assemblyAIKey)
+aijobstore = os.environ.get("TODO_AI_JOB_STORE", "sqlite")
+if aijobstore == "sqlite":
+    with app.app_context():
+        jobstore = SQLiteJobStore(db.engine)
+elif aijobstore == "memory":
+    jobstore = MemoryJobStore()
+else:
+    raise ValueError(f"unknown AI job store {aijobstore} (choose from sqlite, memory)")
+aiqueue = AIJobQueue(
+    llm,
+    transcriber,
+    jobcontext,
+    jobresult,
+    workers=aiworkers,
+    queuelimit=int(os.environ.get("TODO_AI_QUEUE", 4 * aiworkers)),
+    store=jobstore,
+)
+# longest a poll waits for its job to finish, in seconds
+AI_MAX_WAIT = 25.0
+# longest the old blocking endpoints wait for the answer before giving up with a
+# 504 (the job still finishes and saves its tasks)
+AI_REQUEST_TIMEOUT = float(os.environ.get("TODO_AI_REQUEST_TIMEOUT", 120.0))
+
+
+def submitaijob():
+    """Queue the request's question (form field or query parameter) or recording
+    (file "file") as an AI job -> (job, None) or (None, error response)"""
+    audiopath = None
+    if "file" in request.files:
+        # every recording gets a file of its own, the job deletes it when done
+        fd, audiopath = tempfile.mkstemp(prefix="todo-audio-", suffix=".webm")
+        os.close(fd)
+        request.files["file"].save(audiopath)
+        question = None
+    else:
+        question = request.values.get("question", "").strip()
+        if not question:
+            return None, (jsonify({"message": "question is required"}), 400)
+    try:
+        return aiqueue.submit(current_user.id, question, audiopath), None
+    except AIQueueFull:
+        if audiopath is not None:
+            os.remove(audiopath)
+        return None, (
+            jsonify({"message": "Too many AI requests, please try again shortly."}),
+            503,
+            {"Retry-After": "5"},
+        )
+
+
+@app.post("/api/v1/ai/jobs/")
+@login_required
+def postAIJob():
+    job, error = submitaijob()
+    if error is not None:
+        return error
+    response = jsonify(job.to_json())
+    response.headers["Location"] = url_for("getAIJob", jobid=job.id)
+    return response, 202
+
+
+@app.get("/api/v1/ai/jobs/<string:jobid>/")
+@login_required
+def getAIJob(jobid: str):
+    """The job's status and, once done, its result. With ?wait=<seconds> (at most
+    AI_MAX_WAIT) the request waits for an unfinished job before answering, which
+    saves round trips but holds a server thread while it waits"""
+    wait = min(request.args.get("wait", 0.0, type=float), AI_MAX_WAIT)
+    job = aiqueue.wait(jobid, current_user.id, wait)
+    if job is None:
+        return jsonify({"message": f"there is no AI job {jobid}"}), 404
+    if aiqueue.claimerror(job):
+        # shown by the page's flashed messages like before the jobs, once
+        flash(f"ChatGPT Error: {job.error}")
+    return jsonify(job.to_json())
+
+
+@app.get("/api/v1/ai/promptstats/")
+@login_required
+def getPromptStats():
+    # prompt sizes in bytes across every request this process has sent
+    return jsonify(chat_gpt.promptmetrics.snapshot())
+
+
+# the old blocking endpoints, now a job and a wait of at most AI_REQUEST_TIMEOUT
+# for it (so they are bounded by the AI workers too)
+def waitforaijob():
+    job, error = submitaijob()
+    if error is not None:
+        return error
+    if not job.settled.wait(AI_REQUEST_TIMEOUT):
+        # the tasks still show up once it answers
+        return (
+            jsonify({"message": "ChatGPT is taking too long to answer."}),
+            504,
+            {"Location": url_for("getAIJob", jobid=job.id)},
+        )
+    if aiqueue.claimerror(job):
+        flash(f"ChatGPT Error: {job.error}")
+    if job.status == "failed":
+        return jsonify(job.result or {"status": "error"})
+    return jsonify(job.result)
+
+
+@app.post("/speech_for_gpt/")
+@login_required
+def talkToGPT():
+    return waitforaijob()
+
+
+@app.get("/askChatGPT/")
+@login_required
+def askGPT():
+    return waitforaijob()
+
+
 # =================================================================================
 # Deleting Tasks, Subtasks, and Task Lists
 # =================================================================================
@@ -1079,7 +1923,8 @@ def gettaskdeletion():
 def deleteSingleTask():
     try:
         taskid = request.args.get("taskid")
-        deletetask(taskid)
+        deletetasks([int(taskid)], current_user.id)
+        db.session.commit()
         return {"taskid": taskid}
     except:
         return 400
@@ -1090,8 +1935,8 @@ def deleteSingleTask():
 def posttaskdeletion():
     if (form := TaskDeletionForm()).validate():
 
-        for taskid in form.taskids.data:
-            deletetask(taskid)
+        deletetasks([int(taskid) for taskid in form.taskids.data], current_user.id)
+        db.session.commit()
 
         return redirect(url_for("index"))
     for field, em in form.errors.items():
@@ -1128,20 +1973,25 @@ def posttasksforsubtaskdeletion():
     return redirect(url_for("gettasksforsubtaskdeletion"))
 
 
+@requestmemo
 def subtaskdeletionchoices():
     if not session.get("deletesubtasksfor"):
         raise ValueError(
             "deletesubtasksfor must be set in the session in order to delete subtasks correctly"
         )
-    choices = []
-    for taskid in session.get("deletesubtasksfor"):
-        # append all subtasks for each of the tasks we're deleting subtasks for
-        task = Task.query.filter_by(id=taskid).first()
-        choices += [
-            (subtask.id, f"{task.name} subtask: {subtask.name}")
-            for subtask in task.subtasks
-        ]
-    return choices
+    # all subtasks of the (current user's) tasks we're deleting subtasks for, with
+    # their task's name, in one query
+    taskids = [int(taskid) for taskid in session.get("deletesubtasksfor")]
+    rows = db.session.execute(
+        db.select(Subtask.id, Task.name, Subtask.name)
+        .join(Task, Task.id == Subtask.taskid)
+        .where(Task.id.in_(taskids), Task.userid == current_user.id)
+        .order_by(Subtask.taskid, Subtask.id)
+    ).all()
+    return [
+        (subtaskid, f"{taskname} subtask: {name}")
+        for subtaskid, taskname, name in rows
+    ]
 
 
 @app.get("/subtaskdeleteform/")
@@ -1156,8 +2006,10 @@ def getsubtaskdeletion():
 @login_required
 def postsubtaskdeletion():
     if (form := SubtaskDeletionForm()).validate():
-        for subtaskid in form.subtaskids.data:
-            deletesubtask(subtaskid)
+        deletesubtasks(
+            [int(subtaskid) for subtaskid in form.subtaskids.data], current_user.id
+        )
+        db.session.commit()
         return redirect(url_for("index"))
     for field, em in form.errors.items():
         flash(f"Error in {field}: {em}")
@@ -1179,8 +2031,10 @@ def gettasklistdeletion():
 def posttasklistdeletion():
     if (form := TaskListDeletionForm()).validate():
 
-        for tasklistid in form.tasklistids.data:
-            deletetasklist(tasklistid)
+        deletetasklists(
+            [int(tasklistid) for tasklistid in form.tasklistids.data], current_user.id
+        )
+        db.session.commit()
 
         return redirect(url_for("index"))
     for field, em in form.errors.items():
@@ -1190,52 +2044,133 @@ def posttasklistdeletion():
 
 # =================================================================================
 # Deletion Helper Functions
-def deletetask(taskid):
-    # checking for current_user should be unnecessary here (we'll be getting ids from a form
-    # and that form will be populated with the users tasks, not anyone elses... so yeah)
-    # delete all subtasks of the task
-    for subtask in Subtask.query.filter_by(taskid=taskid).all():
-        deletesubtask(subtask.id)
-
-    # delete the task itself
-    db.session.delete(Task.query.filter_by(id=taskid).first())
-    db.session.commit()
-
-
-def deletesubtask(stid):
-    db.session.delete(Subtask.query.filter_by(id=stid).first())
-    db.session.commit()
-
+# these delete with one statement per table instead of loading and deleting rows
+# one at a time: subtasks and list memberships go with their task (and memberships
+# with their task list) through ON DELETE CASCADE. They only ever touch rows owned
+# by userid, leave tombstones for /api/v1/sync/, and don't commit, so a caller can
+# delete any number of things in a single transaction.
+
+
+def tombstonerows(userid: int, kind: str, ids, seq: int, now: datetime) -> None:
+    """Insert a tombstone for every id that ids (a SELECT of ids) produces"""
+    db.session.execute(
+        db.insert(Tombstone).from_select(
+            ["userid", "kind", "objectid", "changeseq", "deleted_at"],
+            db.select(
+                db.literal(userid), db.literal(kind), ids.c.id, db.literal(seq), db.literal(now)
+            ),
+        )
+    )
 
-def deletetasklist(tlid):
-    tl = TaskList.query.filter_by(userid=current_user.id, id=tlid).first()
-    # if a task belongs to the current user, is in the specified task list, and
-    # the task list being deleted is the only task list that it belongs to ->
-    # delete the task
-    tasks = Task.query.filter_by(userid=current_user.id).all()
-    for task in tasks:
-        if tl in task.tasklists and len(task.tasklists) < 2:
-            deletetask(task.id)
 
-    db.session.delete(tl)
-    db.session.commit()
+def prunetombstones(cutoff: datetime) -> int:
+    """Delete the tombstones left before cutoff (UTC), remembering in each user's
+    prunedseq how far back their tombstones are gone. Returns how many were
+    deleted (the caller commits)"""
+    old = Tombstone.deleted_at < cutoff
+    newestpruned = (
+        db.select(db.func.max(Tombstone.changeseq))
+        .where(Tombstone.userid == User.id, old)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        db.update(User)
+        .where(User.id.in_(db.select(Tombstone.userid).where(old)))
+        .values(prunedseq=db.func.max(User.prunedseq, newestpruned)),
+        execution_options={"synchronize_session": False},
+    )
+    return db.session.execute(
+        db.delete(Tombstone).where(old),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+
+def deletetasks(taskids, userid: int) -> int:
+    """Delete the user's tasks whose ids are in taskids (a list or a SELECT of ids)
+    along with their subtasks. Returns the number of tasks deleted."""
+    owned = db.select(Task.id).where(Task.userid == userid, Task.id.in_(taskids))
+    seq, now = nextchangeseq(userid), datetime.utcnow()
+    tombstonerows(
+        userid,
+        "subtask",
+        db.select(Subtask.id).where(Subtask.taskid.in_(owned)).subquery(),
+        seq,
+        now,
+    )
+    tombstonerows(userid, "task", owned.subquery(), seq, now)
+    return db.session.execute(
+        db.delete(Task).where(Task.id.in_(owned)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+
+def deletesubtasks(stids, userid: int) -> int:
+    """Delete the user's subtasks whose ids are in stids"""
+    owned = db.select(Subtask.id).where(
+        Subtask.id.in_(stids),
+        Subtask.taskid.in_(db.select(Task.id).where(Task.userid == userid)),
+    )
+    tombstonerows(userid, "subtask", owned.subquery(), nextchangeseq(userid), datetime.utcnow())
+    return db.session.execute(
+        db.delete(Subtask).where(Subtask.id.in_(owned)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
+
+
+def deletetasklists(tlids, userid: int) -> int:
+    """Delete the user's task lists whose ids are in tlids, along with every task
+    that doesn't belong to any other list (tasks in several lists survive and just
+    lose their membership in the deleted ones)"""
+    owned = db.select(TaskList.id).where(
+        TaskList.userid == userid, TaskList.id.in_(tlids)
+    )
+    orphaned = db.except_(
+        db.select(TasksToTaskLists.c.taskid).where(TasksToTaskLists.c.tlid.in_(owned)),
+        db.select(TasksToTaskLists.c.taskid).where(
+            TasksToTaskLists.c.tlid.not_in(owned)
+        ),
+    )
+    deletetasks(orphaned, userid)
+    seq, now = nextchangeseq(userid), datetime.utcnow()
+    # the tasks left only lose their membership (through the cascade) -> stamp
+    # them so synced clients drop these lists from their tasklistnames
+    db.session.execute(
+        db.update(Task)
+        .where(
+            Task.userid == userid,
+            Task.id.in_(
+                db.select(TasksToTaskLists.c.taskid).where(
+                    TasksToTaskLists.c.tlid.in_(owned)
+                )
+            ),
+        )
+        .values(changeseq=seq, updated_at=now),
+        execution_options={"synchronize_session": False},
+    )
+    tombstonerows(userid, "tasklist", owned.subquery(), seq, now)
+    return db.session.execute(
+        db.delete(TaskList).where(TaskList.id.in_(owned)),
+        execution_options={"synchronize_session": False},
+    ).rowcount
 
 
 @app.get("/getListTasks/<int:listId>/")
 @login_required
+@conditional
 def getTasksFromList(listId):
-    tasks: list[Task] = (
+    tasks = (
         Task.query.join(TasksToTaskLists)
         .filter(TasksToTaskLists.c.tlid == listId)
         .filter(Task.userid == current_user.id)
-        .all()
     )
+    withsubtasks = request.args.get("subtasks", type=int) == 1
 
-    return jsonify({"tasks": [task.to_json() for task in tasks]})
+    return jsonify({"tasks": serializetasks(tasks, withsubtasks)})
 
 
 @app.get("/getUserTaskLists/")
 @login_required
+@conditional
 def getUserTaskLists():
     tasklists: list[TaskList] = TaskList.query.filter_by(userid=current_user.id).all()
 
@@ -1247,26 +2182,20 @@ def getUserTaskLists():
 # @cross_origin(supports_credentials=True)
 @app.get("/getUserTasks/")
 @login_required
+@conditional
 def getTasks():
     username = session.get("username")
     tasks = (
         Task.query.join(User)
         .filter(User.username == username)
         .order_by(Task.duedate)
-        .all()
     )
+    withsubtasks = request.args.get("subtasks", type=int) == 1
+    taskjson = serializetasks(tasks, withsubtasks)
 
-    print("get tasks:")
-    for task in tasks:
-        print(task.to_json())
+    print(f"get tasks: {len(taskjson)} tasks")
 
-    return jsonify(
-        {
-            "retrieved": datetime.now().isoformat(),
-            "count": len(tasks),
-            "tasks": [task.to_json() for task in tasks],
-        }
-    )
+    return jsonify({"count": len(taskjson), "tasks": taskjson})
 
 
 @app.post("/postUserTask/")
@@ -1286,18 +2215,15 @@ def postTask():
             duetime=form.duetime.data,
             priority=form.priority.data,
             notes=form.generalnotes.data,
-            user=current_user,
+            userid=current_user.id,
         )
 
-        # add a db tasklist to the task for each of the names in tasklistids
-        # each task added must belong to the current user
-        #print(f"{form.tasklistids.data = }")
-        for tasklistid in form.tasklistids.data:
-            # print(f"attempting to add {TaskList.query.filter_by(user=current_user,id=tasklistid).first()} (filter by current user and task list name)")
-            if tasklistid:
-                newtask.tasklists.append(
-                    TaskList.query.filter_by(user=current_user, id=tasklistid).first()
-                )
+        # put the task in each of the (current user's) task lists in tasklistids
+        # (the client sends an empty id when no list is picked)
+        try:
+            newtask.tasklists = ownedrows(TaskList, form.tasklistids.data)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
         # add and commit to the database, then we ask if the user would like to add subtasks
         db.session.add(newtask)  # like before
         db.session.commit()  # like before
@@ -1327,8 +2253,11 @@ def updateTask():
     taskId = response["id"]
     task = Task.query.get_or_404(taskId)
 
+    try:
+        task.duedate = response["duedate"]
+    except ValueError as e:
+        return jsonify({"message": f"Cannot update the task: {e}"}), 400
     task.name = response["name"]
-    task.duedate = response["duedate"]
     task.notes = response["notes"]
 
     db.session.commit()
@@ -1388,21 +2317,954 @@ def markStarred(taskId, starred):
 
 @app.get("/getUserColor/")
 @login_required
+@conditional
 def getColor():
-    username = session.get("username")
-    userColor = User.query.filter_by(username=username).first().themecolor
-    return jsonify(
-        {
-            "retrieved": datetime.now().isoformat(),
-            "userColor": userColor,
-        }
-    )
+    # read the row rather than the cached current_user, so the color always
+    # matches the ETag
+    userColor = db.session.query(User.themecolor).filter_by(id=current_user.id).scalar()
+    return jsonify({"userColor": userColor})
 
 
 @app.post("/postUserColor/")
 @login_required
 def postColor():
     newColor = request.json
-    current_user.themecolor = newColor
+    db.session.get(User, current_user.id).themecolor = newColor
     db.session.commit()
+    usercache.invalidate(current_user.id)
     return jsonify(newColor), 201
+
+
+# =================================================================================
+# Paginated Task Listing
+# =================================================================================
+
+# sort keys the paginated listing accepts -> each one is backed by a
+# (userid, <column>) index so a page is a short index range scan
+TASK_SORT_COLUMNS = {"duedate": Task.duedate, "priority": Task.priority}
+TASK_PAGE_SIZE = 50
+TASK_PAGE_MAX = 200
+# SQLite integers are 64 bit, bigger numbers overflow before the query even runs
+INT64_MIN, INT64_MAX = -(2**63), 2**63 - 1
+
+
+def isint64(value) -> bool:
+    # JSON true/false come back as bools, which Python also counts as ints
+    return (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and INT64_MIN <= value <= INT64_MAX
+    )
+
+
+def int64args(args, *names: str) -> list[int | None]:
+    """The integer query params names (None when left out or not a number),
+    ValueError when one doesn't fit in a SQLite integer"""
+    values = [args.get(name, type=int) for name in names]
+    for name, value in zip(names, values):
+        if value is not None and not isint64(value):
+            raise ValueError(f"{name} is out of range")
+    return values
+
+
+def encodecursor(sort: str, order: str, lastvalue, lastid: int) -> str:
+    raw = json.dumps([sort, order, lastvalue, lastid]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decodecursor(cursor: str) -> tuple:
+    """(sort, order, lastvalue, lastid) of a nextcursor, ValueError unless it is
+    one this server could have handed out"""
+    try:
+        sort, order, lastvalue, lastid = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    if sort == "archive":
+        # the archive pages by completion time, an ISO string
+        validvalue = isinstance(lastvalue, str)
+    else:
+        # the listing's sort keys, due for /api/v1/tasks/due/ and the smart lists
+        sorts = {*TASK_SORT_COLUMNS, "due", *SMART_LISTS}
+        validvalue = isinstance(sort, str) and sort in sorts
+        validvalue = validvalue and (lastvalue is None or isint64(lastvalue))
+    if not validvalue or order not in ("asc", "desc") or not isint64(lastid):
+        raise ValueError("invalid cursor")
+    return sort, order, lastvalue, lastid
+
+
+def keysetpage(tasks, column, descending: bool, after: tuple | None, limit: int):
+    """Up to limit + 1 of tasks after the cursor position after = (lastvalue,
+    lastid), in (column, Task.id) order with the tasks whose column is NULL last
+    either way (tasks without a due date or priority are common)
+
+    Two queries, each a range scan of a (userid, <column>) index in index order,
+    where ORDER BY ... NULLS LAST would sort every matching row instead.
+    """
+    idorder = Task.id.desc() if descending else Task.id.asc()
+    page: list[Task] = []
+    if after is None or after[0] is not None:
+        known = tasks.filter(column.isnot(None))
+        if after is not None:
+            lastvalue, lastid = after
+            if descending:
+                known = known.filter(
+                    db.or_(
+                        column < lastvalue,
+                        db.and_(column == lastvalue, Task.id < lastid),
+                    )
+                )
+            else:
+                known = known.filter(
+                    db.or_(
+                        column > lastvalue,
+                        db.and_(column == lastvalue, Task.id > lastid),
+                    )
+                )
+        columnorder = column.desc() if descending else column.asc()
+        page = known.order_by(columnorder, idorder).limit(limit + 1).all()
+    if len(page) <= limit:
+        missing = tasks.filter(column.is_(None))
+        if after is not None and after[0] is None:
+            lastid = after[1]
+            missing = missing.filter(
+                Task.id < lastid if descending else Task.id > lastid
+            )
+        page += missing.order_by(idorder).limit(limit + 1 - len(page)).all()
+    return page
+
+
+@app.get("/api/v1/tasks/")
+@login_required
+@conditional
+def getTaskPage():
+    """One page of the current user's tasks
+
+    query params (all optional):
+    complete=0|1, starred=0|1, list=<task list id>, duefrom/dueto=<epoch ms>,
+    priority=<1-10>, sort=duedate|priority, order=asc|desc, limit=<1-200>,
+    cursor=<nextcursor from the previous page>
+
+    tasks without a due date (or priority) come after the rest in either order
+    """
+    args = request.args
+    sort = args.get("sort", "duedate")
+    order = args.get("order", "asc")
+    limit = args.get("limit", TASK_PAGE_SIZE, type=int)
+    if sort not in TASK_SORT_COLUMNS or order not in ("asc", "desc"):
+        return jsonify({"message": f"Cannot sort tasks by {sort} {order}"}), 400
+    if not 1 <= limit <= TASK_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {TASK_PAGE_MAX}"}), 400
+    try:
+        priority, duefrom, dueto, listid = int64args(
+            args, "priority", "duefrom", "dueto", "list"
+        )
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    column = TASK_SORT_COLUMNS[sort]
+    descending = order == "desc"
+
+    tasks = Task.query.filter(Task.userid == current_user.id)
+    if (complete := args.get("complete", type=int)) is not None:
+        tasks = tasks.filter(Task.complete == bool(complete))
+    if (starred := args.get("starred", type=int)) is not None:
+        tasks = tasks.filter(Task.starred == bool(starred))
+    if priority is not None:
+        tasks = tasks.filter(Task.priority == priority)
+    if duefrom is not None:
+        tasks = tasks.filter(Task.duedate >= duefrom)
+    if dueto is not None:
+        tasks = tasks.filter(Task.duedate < dueto)
+    if listid is not None:
+        # a membership probe (rather than a join) keeps the scan in sort order
+        tasks = tasks.filter(
+            db.exists().where(
+                TasksToTaskLists.c.tlid == listid,
+                TasksToTaskLists.c.taskid == Task.id,
+            )
+        )
+
+    after = None
+    if cursor := args.get("cursor"):
+        try:
+            cursorsort, cursororder, lastvalue, lastid = decodecursor(cursor)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if (cursorsort, cursororder) != (sort, order):
+            return jsonify({"message": "cursor belongs to a different sort"}), 400
+        after = (lastvalue, lastid)
+
+    # one extra row tells whether there is another page
+    page = keysetpage(tasks, column, descending, after, limit)
+    nextcursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        nextcursor = encodecursor(sort, order, getattr(page[-1], sort), page[-1].id)
+    taskjson = serializetasks(page, args.get("subtasks", type=int) == 1)
+
+    return jsonify({"count": len(taskjson), "tasks": taskjson, "nextcursor": nextcursor})
+
+
+@app.get("/api/v1/tasks/due/")
+@login_required
+@conditional
+def getTasksDue():
+    """The current user's tasks due in [from, to), soonest first, for calendar
+    and agenda views
+
+    query params: from=<epoch ms>, to=<epoch ms> (required), complete=0|1,
+    limit=<1-200>, cursor=<nextcursor from the previous page>
+    """
+    args = request.args
+    try:
+        duefrom, dueto = int64args(args, "from", "to")
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    limit = args.get("limit", TASK_PAGE_MAX, type=int)
+    if duefrom is None or dueto is None or duefrom >= dueto:
+        return jsonify({"message": "from and to must be epoch ms with from < to"}), 400
+    if not 1 <= limit <= TASK_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {TASK_PAGE_MAX}"}), 400
+
+    # a range scan of (userid, duedate), already in the order we return
+    tasks = Task.query.filter(
+        Task.userid == current_user.id, Task.duedate >= duefrom, Task.duedate < dueto
+    )
+    if (complete := args.get("complete", type=int)) is not None:
+        tasks = tasks.filter(Task.complete == bool(complete))
+    after = None
+    if cursor := args.get("cursor"):
+        try:
+            cursorsort, _, lastvalue, lastid = decodecursor(cursor)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if cursorsort != "due" or lastvalue is None:
+            return jsonify({"message": "cursor belongs to a different listing"}), 400
+        after = (lastvalue, lastid)
+
+    page = keysetpage(tasks, Task.duedate, False, after, limit)
+    nextcursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        nextcursor = encodecursor("due", "asc", page[-1].duedate, page[-1].id)
+    taskjson = serializetasks(page, args.get("subtasks", type=int) == 1)
+
+    return jsonify({"count": len(taskjson), "tasks": taskjson, "nextcursor": nextcursor})
+
+
+# =================================================================================
+# Smart Lists and Counts
+# =================================================================================
+
+SMART_LISTS = ("starred", "today", "overdue", "planned")
+
+
+# getTimezoneOffset() is within a day of UTC either way
+TZOFFSET_MAX = 24 * 60
+
+
+def tzoffsetarg() -> int:
+    """The request's tzoffset query param (0 if left out), ValueError unless it
+    is within a day"""
+    tzoffset = request.args.get("tzoffset", 0, type=int)
+    if not -TZOFFSET_MAX <= tzoffset <= TZOFFSET_MAX:
+        raise ValueError(f"tzoffset must be between -{TZOFFSET_MAX} and {TZOFFSET_MAX}")
+    return tzoffset
+
+
+def daybounds(tzoffset: int) -> tuple[int, int]:
+    """(start of today, start of tomorrow) in epoch ms for a client whose clock
+    is tzoffset minutes behind UTC (what JS getTimezoneOffset() returns)"""
+    local = datetime.now(timezone.utc) - timedelta(minutes=tzoffset)
+    start = datetime(local.year, local.month, local.day, tzinfo=timezone.utc) + timedelta(
+        minutes=tzoffset
+    )
+    return (
+        int(start.timestamp() * 1000),
+        int((start + timedelta(days=1)).timestamp() * 1000),
+    )
+
+
+def smartlistfilter(name: str, tzoffset: int):
+    """The condition a task has to meet to show up in a smart list (whether it's
+    complete aside). Due dates without a time are stored at the day's midnight, so
+    overdue means due before today (like the client counts it), not before now"""
+    start, end = daybounds(tzoffset)
+    # true()/false() are rendered as literals, which is what lets SQLite match the
+    # conditions up with the partial index
+    return {
+        "starred": Task.starred == db.true(),
+        "today": db.and_(Task.duedate >= start, Task.duedate < end),
+        "overdue": Task.duedate < start,
+        "planned": Task.duedate.isnot(None),
+    }[name]
+
+
+@app.get("/api/v1/smartlists/<name>/")
+@login_required
+def getSmartList(name):
+    """One page of a smart list (starred, today, overdue, or planned), soonest
+    due first
+
+    query params (all optional): tzoffset=<minutes, as from getTimezoneOffset()>,
+    complete=0|1 (default 0), limit=<1-200>, cursor=<nextcursor from the
+    previous page>
+    """
+    # no ETag here: what is due today or overdue changes without any write
+    if name not in SMART_LISTS:
+        return jsonify({"message": f"There is no smart list called {name}"}), 404
+    args = request.args
+    try:
+        tzoffset = tzoffsetarg()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    limit = args.get("limit", TASK_PAGE_SIZE, type=int)
+    if not 1 <= limit <= TASK_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {TASK_PAGE_MAX}"}), 400
+    complete = db.true() if args.get("complete", 0, type=int) else db.false()
+
+    tasks = Task.query.filter(
+        Task.userid == current_user.id,
+        Task.complete == complete,
+        smartlistfilter(name, tzoffset),
+    )
+    after = None
+    if cursor := args.get("cursor"):
+        try:
+            cursorsort, _, lastvalue, lastid = decodecursor(cursor)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        if cursorsort != name:
+            return jsonify({"message": "cursor belongs to a different listing"}), 400
+        after = (lastvalue, lastid)
+
+    page = keysetpage(tasks, Task.duedate, False, after, limit)
+    nextcursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        nextcursor = encodecursor(name, "asc", page[-1].duedate, page[-1].id)
+    taskjson = serializetasks(page, args.get("subtasks", type=int) == 1)
+
+    return jsonify({"count": len(taskjson), "tasks": taskjson, "nextcursor": nextcursor})
+
+
+@app.get("/api/v1/counts/")
+@login_required
+def getCounts():
+    """Open and completed task counts for every task list, every smart list, and
+    all of the user's tasks, for the sidebar badges
+
+    query params: tzoffset=<minutes, as from getTimezoneOffset()>
+    """
+    try:
+        tzoffset = tzoffsetarg()
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    smartlists = {name: {"open": 0, "completed": 0} for name in SMART_LISTS}
+
+    # what is due today or overdue depends on the clock, so the smart lists can't
+    # keep counters -> one pass over the user's part of the covering index, split
+    # by complete
+    rows = db.session.query(
+        Task.complete,
+        *[
+            db.func.count(db.case((smartlistfilter(name, tzoffset), 1)))
+            for name in SMART_LISTS
+        ],
+    ).filter(Task.userid == current_user.id).group_by(Task.complete)
+    for complete, *smartcounts in rows:
+        key = "completed" if complete else "open"
+        for name, count in zip(SMART_LISTS, smartcounts):
+            smartlists[name][key] = count
+
+    # the per-list and per-user numbers are counters the triggers keep exact
+    opentasks, completedtasks = (
+        db.session.query(User.opentasks, User.completedtasks)
+        .filter(User.id == current_user.id)
+        .one()
+    )
+    tasklists = TaskList.query.filter(TaskList.userid == current_user.id)
+
+    return jsonify(
+        {
+            "all": {"open": opentasks, "completed": completedtasks},
+            "smartlists": smartlists,
+            "lists": [tasklist.to_json() for tasklist in tasklists],
+        }
+    )
+
+
+# =================================================================================
+# Delta Sync
+# =================================================================================
+
+
+@app.get("/api/v1/sync/")
+@login_required
+@conditional
+def sync():
+    """Everything that changed for the current user after change number since
+
+    Clients start from since=0 (a full snapshot), keep the returned seq, and send
+    it back next time so they only download what changed (and what was deleted)
+    in between. Tombstones are only kept for TOMBSTONE_RETENTION_DAYS: a since
+    from before the oldest ones left gets a 410 Gone, and the client has to start
+    over from since=0.
+    """
+    since = request.args.get("since", 0, type=int)
+    # read seq before the rows -> anything committed in between is sent again
+    # next time rather than missed
+    seq, prunedseq = (
+        db.session.query(User.changeseq, User.prunedseq)
+        .filter_by(id=current_user.id)
+        .one()
+    )
+    if 0 < since < prunedseq:
+        return (
+            jsonify(
+                {
+                    "message": "deletions since then are no longer known, "
+                    "sync again from since=0",
+                    "seq": seq,
+                }
+            ),
+            410,
+        )
+
+    tasks = Task.query.filter(Task.userid == current_user.id, Task.changeseq > since)
+    tasklists = TaskList.query.filter(
+        TaskList.userid == current_user.id, TaskList.changeseq > since
+    )
+    subtasks = Subtask.query.filter(
+        Subtask.userid == current_user.id, Subtask.changeseq > since
+    )
+    deleted = Tombstone.query.filter(
+        Tombstone.userid == current_user.id, Tombstone.changeseq > since
+    )
+
+    return jsonify(
+        {
+            "since": since,
+            "seq": seq,
+            "tasks": serializetasks(tasks),
+            "tasklists": [tasklist.to_json() for tasklist in tasklists],
+            "subtasks": [subtask.to_json() for subtask in subtasks],
+            "deleted": [tombstone.to_json() for tombstone in deleted],
+        }
+    )
+
+
+# =================================================================================
+# Batch Mutations
+# =================================================================================
+
+BATCH_MAX_OPERATIONS = 1000
+# fields a create/update operation may set, with the type each must have
+BATCH_TASK_FIELDS = {
+    "name": str,
+    "duedate": int,
+    "complete": bool,
+    "starred": bool,
+    "priority": int,
+    "notes": str,
+    "progressnotes": str,
+}
+
+
+class BatchError(Exception):
+    pass
+
+
+def isbatchtype(value, fieldtype: type) -> bool:
+    # JSON true/false come back as bools, which Python also counts as ints
+    if isinstance(value, bool):
+        return fieldtype is bool
+    return isinstance(value, fieldtype)
+
+
+def batchid(operation: dict, key: str) -> int:
+    """The id (or ref) the operation gives under key"""
+    value = operation.get(key)
+    if not isbatchtype(value, int):
+        raise BatchError(f"{key} must be an integer")
+    return value
+
+
+def batchflag(operation: dict, key: str) -> bool:
+    """The true/false value of a complete/star operation (true if left out)"""
+    value = operation.get(key, True)
+    if not isinstance(value, bool):
+        raise BatchError(f"{key} must be true or false")
+    return value
+
+
+def batchtasklistids(operation: dict) -> list[int]:
+    """The task list ids of a create operation, without repeats"""
+    tlids = operation.get("tasklistids")
+    if tlids is None:
+        return []
+    if not isinstance(tlids, list) or not all(isbatchtype(tlid, int) for tlid in tlids):
+        raise BatchError("tasklistids must be an array of task list ids")
+    return list(dict.fromkeys(tlids))
+
+
+def batchtaskfields(operation: dict) -> dict:
+    """Validate the task fields of a create/update operation (same rules as
+    TaskCreationForm)"""
+    fields = {}
+    for field, fieldtype in BATCH_TASK_FIELDS.items():
+        if field not in operation:
+            continue
+        value = operation[field]
+        if value is not None and not isbatchtype(value, fieldtype):
+            raise BatchError(f"{field} must be a {fieldtype.__name__}")
+        fields[field] = value
+    if "name" in fields and not 1 <= len(fields["name"] or "") <= 80:
+        raise BatchError("name must be between 1 and 80 characters")
+    if fields.get("priority") is not None and not 1 <= fields["priority"] <= 10:
+        raise BatchError("priority must be between 1 and 10")
+    for field in ("notes", "progressnotes"):
+        if len(fields.get(field) or "") > 400:
+            raise BatchError(f"{field} can be at most 400 characters")
+    return fields
+
+
+@app.post("/api/v1/batch/")
+@login_required
+def batch():
+    """Apply an ordered array of task operations in one transaction
+
+    Each operation is an object with an "op" of create, update, complete, star,
+    or delete. create takes the task fields (and optional tasklistids), update
+    takes an "id" plus the fields to change, complete/star take an "id" plus
+    "complete"/"starred", and delete takes an "id". Instead of an "id", an
+    operation can use "ref": <index> to point at a task created earlier in the
+    same batch.
+
+    Everything is loaded up front with one query per table and written with a
+    single flush (plus one set-based delete) and commit. If any operation fails,
+    none of them are applied.
+    """
+    operations = request.json
+    if not isinstance(operations, list) or len(operations) > BATCH_MAX_OPERATIONS:
+        return (
+            jsonify(
+                {"message": f"Expected an array of at most {BATCH_MAX_OPERATIONS} operations"}
+            ),
+            400,
+        )
+
+    # load every task and task list the batch refers to in one query each
+    # (anything malformed is skipped here and reported by its operation below)
+    taskids = {
+        op.get("id")
+        for op in operations
+        if isinstance(op, dict) and isbatchtype(op.get("id"), int)
+    }
+    tasks: dict[int, Task] = {
+        task.id: task
+        for task in Task.query.filter(
+            Task.userid == current_user.id, Task.id.in_(taskids)
+        )
+    }
+    tasklistids = {
+        tlid
+        for op in operations
+        if isinstance(op, dict)
+        and op.get("op") == "create"
+        and isinstance(op.get("tasklistids"), list)
+        for tlid in op["tasklistids"]
+        if isbatchtype(tlid, int)
+    }
+    tasklists: dict[int, TaskList] = {
+        tl.id: tl
+        for tl in TaskList.query.filter(
+            TaskList.userid == current_user.id, TaskList.id.in_(tasklistids)
+        )
+    }
+
+    # index of the operation -> the task it created or touched
+    results: list[dict] = []
+    touched: dict[int, Task] = {}
+    # tasks are deleted set-based after everything else is flushed
+    deletedids: list[int] = []
+    # id() of every task object deleted so far, so later operations can't use them
+    deleted: set[int] = set()
+    failed = False
+    for index, operation in enumerate(operations):
+        result = {"index": index}
+        try:
+            if not isinstance(operation, dict):
+                raise BatchError("operation must be an object")
+            op = result["op"] = operation.get("op")
+            if op == "create":
+                fields = batchtaskfields(operation)
+                if "name" not in fields:
+                    raise BatchError("name is required")
+                task = Task(**fields, userid=current_user.id)
+                for tlid in batchtasklistids(operation):
+                    if tlid not in tasklists:
+                        raise BatchError(f"there is no task list {tlid}")
+                    task.tasklists.append(tasklists[tlid])
+                db.session.add(task)
+            else:
+                if "ref" in operation:
+                    ref = batchid(operation, "ref")
+                    task = touched.get(ref)
+                    if task is None or operations[ref].get("op") != "create":
+                        raise BatchError(f"ref {ref} is not a created task")
+                else:
+                    taskid = batchid(operation, "id")
+                    task = tasks.get(taskid)
+                    if task is None:
+                        raise BatchError(f"there is no task {taskid}")
+                if id(task) in deleted:
+                    raise BatchError("that task was already deleted in this batch")
+
+                if op == "update":
+                    for field, value in batchtaskfields(operation).items():
+                        setattr(task, field, value)
+                elif op == "complete":
+                    task.complete = batchflag(operation, "complete")
+                elif op == "star":
+                    task.starred = batchflag(operation, "starred")
+                elif op == "delete":
+                    if task in db.session.new:
+                        db.session.expunge(task)
+                    else:
+                        deletedids.append(task.id)
+                    deleted.add(id(task))
+                else:
+                    raise BatchError(f"unknown op {op}")
+            touched[index] = task
+            result["status"] = "ok"
+        except BatchError as e:
+            failed = True
+            result["status"] = "error"
+            result["message"] = str(e)
+        results.append(result)
+
+    if failed:
+        db.session.rollback()
+        return jsonify({"applied": False, "results": results}), 400
+
+    # read the new ids before committing (commit expires every object, and reading
+    # them afterwards would cost a query per task)
+    db.session.flush()
+    for result in results:
+        task = touched[result["index"]]
+        if task.id is not None:
+            result["id"] = task.id
+    if deletedids:
+        deletetasks(deletedids, current_user.id)
+    db.session.commit()
+    return jsonify({"applied": True, "results": results})
+
+
+# =================================================================================
+# Search
+# =================================================================================
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+# bm25 weight of each TaskSearch/ArchiveSearch column (name, notes, progressnotes, subtasks,
+# owner) -> a hit in the name counts most, the owner token not at all
+SEARCH_WEIGHTS = "10.0, 2.0, 2.0, 5.0, 0.0"
+
+
+def searchexpression(q: str, userid: int) -> str | None:
+    """Turn what the user typed into an FTS5 query scoped to their own tasks
+
+    Every word must appear (as a word or the start of one) in one of the text
+    columns. Words are quoted, so FTS5 operators and punctuation in the input are
+    just text. Returns None if there is nothing to search for.
+    """
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"*' for word in words)
+    return f"owner : u{int(userid)} AND {{name notes progressnotes subtasks}} : ({terms})"
+
+
+def rankedsearch(table: str, expression: str, limit: int, offset: int) -> list[int]:
+    """rowids of the best matches for expression in a search table (TaskSearch or
+    ArchiveSearch), best first"""
+    return db.session.scalars(
+        db.text(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH :expression "
+            f"ORDER BY bm25({table}, {SEARCH_WEIGHTS}), rowid LIMIT :limit OFFSET :offset"
+        ),
+        {"expression": expression, "limit": limit, "offset": offset},
+    ).all()
+
+
+@app.get("/api/v1/search/")
+@login_required
+@conditional
+def search():
+    """The current user's tasks matching q, best match first
+
+    query params: q=<words>, limit=<1-100>, offset=<nextoffset from the
+    previous page>, subtasks=1 to include each task's subtasks
+    """
+    args = request.args
+    limit = args.get("limit", SEARCH_PAGE_SIZE, type=int)
+    offset = args.get("offset", 0, type=int)
+    if not 1 <= limit <= SEARCH_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {SEARCH_PAGE_MAX}"}), 400
+    if offset < 0:
+        return jsonify({"message": "offset cannot be negative"}), 400
+    if offset > INT64_MAX:
+        return jsonify({"message": "offset is out of range"}), 400
+    expression = searchexpression(args.get("q", ""), current_user.id)
+    if expression is None:
+        return jsonify({"message": "Nothing to search for"}), 400
+
+    # fetch one extra row to find out whether there is another page
+    taskids = rankedsearch("TaskSearch", expression, limit + 1, offset)
+    nextoffset = None
+    if len(taskids) > limit:
+        taskids = taskids[:limit]
+        nextoffset = offset + limit
+
+    # keep the ranking order, and check ownership again on the real rows
+    tasksbyid = {
+        task.id: task
+        for task in Task.query.filter(
+            Task.id.in_(taskids), Task.userid == current_user.id
+        )
+    }
+    page = [tasksbyid[taskid] for taskid in taskids if taskid in tasksbyid]
+    taskjson = serializetasks(page, args.get("subtasks", type=int) == 1)
+
+    return jsonify({"count": len(taskjson), "tasks": taskjson, "nextoffset": nextoffset})
+
+
+# =================================================================================
+# Archive
+# =================================================================================
+
+# completed tasks are archived this many days after they were completed
+ARCHIVE_AFTER_DAYS = int(os.environ.get("TODO_ARCHIVE_AFTER_DAYS", 30))
+# tasks moved per transaction, so the job never holds the write lock for long
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAGE_SIZE = 50
+
+
+def archivetasks(completedbefore: datetime, batchsize: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move every task completed before completedbefore (UTC) from Tasks into
+    ArchivedTasks, batchsize tasks per transaction. Returns how many were moved.
+
+    The tasks are removed through deletetasks, so synced clients drop them and
+    the counters and search index follow along.
+    """
+    tasklistids = (
+        db.select(db.func.json_group_array(TasksToTaskLists.c.tlid))
+        .where(TasksToTaskLists.c.taskid == Task.id)
+        .scalar_subquery()
+    )
+    subtasks = (
+        db.select(
+            db.func.json_group_array(
+                db.func.json_object(
+                    "name",
+                    Subtask.name,
+                    "complete",
+                    Subtask.complete,
+                    "priority",
+                    Subtask.priority,
+                )
+            )
+        )
+        .where(Subtask.taskid == Task.id)
+        .scalar_subquery()
+    )
+    archived = 0
+    while True:
+        batch = db.session.execute(
+            db.select(Task.id, Task.userid)
+            .where(Task.complete == db.true(), Task.completedat < completedbefore)
+            .limit(batchsize)
+        ).all()
+        if not batch:
+            return archived
+        taskids = [taskid for taskid, _ in batch]
+        # the copied columns, in ArchivedTask and in Task
+        columns = {
+            "taskid": Task.id,
+            "userid": Task.userid,
+            "name": Task.name,
+            "starred": Task.starred,
+            "progressnotes": Task.progressnotes,
+            "duedate": Task.duedate,
+            "duetime": Task.duetime,
+            "priority": Task.priority,
+            "notes": Task.notes,
+            "completedat": Task.completedat,
+            "archivedat": db.literal(datetime.utcnow()),
+            "tasklistids": tasklistids,
+            "subtasks": subtasks,
+        }
+        db.session.execute(
+            db.insert(ArchivedTask).from_select(
+                list(columns),
+                db.select(*columns.values()).where(Task.id.in_(taskids)),
+            )
+        )
+        byuser: dict[int, list[int]] = {}
+        for taskid, userid in batch:
+            byuser.setdefault(userid, []).append(taskid)
+        for userid, usertaskids in byuser.items():
+            deletetasks(usertaskids, userid)
+        db.session.commit()
+        archived += len(taskids)
+
+
+@app.cli.command("archive-tasks")
+@click.option(
+    "--days",
+    default=ARCHIVE_AFTER_DAYS,
+    help="Archive tasks completed at least this many days ago.",
+)
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, help="Tasks moved per transaction.")
+def archivetaskscommand(days: int, batch_size: int) -> None:
+    """Move tasks completed more than --days days ago into the archive (run with
+    `flask --app app archive-tasks`, e.g. nightly from cron). This is the only
+    thing that archives: one scheduled job, however many app processes serve
+    requests"""
+    moved = archivetasks(datetime.utcnow() - timedelta(days=days), batch_size)
+    print(f"archived {moved} tasks")
+
+
+@app.get("/api/v1/archive/")
+@login_required
+@conditional
+def getArchive():
+    """One page of the current user's archived tasks, most recently completed
+    first
+
+    query params (all optional): limit=<1-200>, cursor=<nextcursor from the
+    previous page>
+    """
+    limit = request.args.get("limit", ARCHIVE_PAGE_SIZE, type=int)
+    if not 1 <= limit <= TASK_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {TASK_PAGE_MAX}"}), 400
+
+    archived = ArchivedTask.query.filter(ArchivedTask.userid == current_user.id)
+    if cursor := request.args.get("cursor"):
+        try:
+            cursorsort, _, lastvalue, lastid = decodecursor(cursor)
+            lastcompleted = datetime.fromisoformat(lastvalue)
+        except ValueError:
+            return jsonify({"message": "invalid cursor"}), 400
+        if cursorsort != "archive":
+            return jsonify({"message": "cursor belongs to a different listing"}), 400
+        archived = archived.filter(
+            db.or_(
+                ArchivedTask.completedat < lastcompleted,
+                db.and_(
+                    ArchivedTask.completedat == lastcompleted, ArchivedTask.id < lastid
+                ),
+            )
+        )
+
+    page: list[ArchivedTask] = (
+        archived.order_by(ArchivedTask.completedat.desc(), ArchivedTask.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    nextcursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        nextcursor = encodecursor(
+            "archive", "desc", page[-1].completedat.isoformat(), page[-1].id
+        )
+    return jsonify(
+        {
+            "count": len(page),
+            "tasks": [archivedtask.to_json() for archivedtask in page],
+            "nextcursor": nextcursor,
+        }
+    )
+
+
+@app.get("/api/v1/archive/search/")
+@login_required
+@conditional
+def searchArchive():
+    """The current user's archived tasks matching q, best match first
+
+    query params: q=<words>, limit=<1-100>, offset=<nextoffset from the
+    previous page>
+    """
+    args = request.args
+    limit = args.get("limit", SEARCH_PAGE_SIZE, type=int)
+    offset = args.get("offset", 0, type=int)
+    if not 1 <= limit <= SEARCH_PAGE_MAX:
+        return jsonify({"message": f"limit must be between 1 and {SEARCH_PAGE_MAX}"}), 400
+    if offset < 0:
+        return jsonify({"message": "offset cannot be negative"}), 400
+    if offset > INT64_MAX:
+        return jsonify({"message": "offset is out of range"}), 400
+    expression = searchexpression(args.get("q", ""), current_user.id)
+    if expression is None:
+        return jsonify({"message": "Nothing to search for"}), 400
+
+    archivedids = rankedsearch("ArchiveSearch", expression, limit + 1, offset)
+    nextoffset = None
+    if len(archivedids) > limit:
+        archivedids = archivedids[:limit]
+        nextoffset = offset + limit
+    byid = {
+        archivedtask.id: archivedtask
+        for archivedtask in ArchivedTask.query.filter(
+            ArchivedTask.id.in_(archivedids), ArchivedTask.userid == current_user.id
+        )
+    }
+    page = [byid[archivedid] for archivedid in archivedids if archivedid in byid]
+    return jsonify(
+        {
+            "count": len(page),
+            "tasks": [archivedtask.to_json() for archivedtask in page],
+            "nextoffset": nextoffset,
+        }
+    )
+
+
+@app.post("/api/v1/archive/<int:archivedid>/restore/")
+@login_required
+def restoreArchivedTask(archivedid):
+    """Move an archived task back into the user's tasks (and the lists it was in
+    that still exist). It stays complete, but counts as completed now, so it
+    isn't archived again straight away."""
+    archivedtask = ArchivedTask.query.filter_by(
+        id=archivedid, userid=current_user.id
+    ).first_or_404()
+
+    task = Task(
+        name=archivedtask.name,
+        complete=True,
+        starred=archivedtask.starred,
+        progressnotes=archivedtask.progressnotes,
+        duedate=archivedtask.duedate,
+        duetime=archivedtask.duetime,
+        priority=archivedtask.priority,
+        notes=archivedtask.notes,
+        userid=current_user.id,
+    )
+    tasklistids = json.loads(archivedtask.tasklistids)
+    if tasklistids:
+        task.tasklists = TaskList.query.filter(
+            TaskList.id.in_(tasklistids), TaskList.userid == current_user.id
+        ).all()
+    for subtask in json.loads(archivedtask.subtasks):
+        task.subtasks.append(
+            Subtask(
+                name=subtask["name"],
+                complete=bool(subtask["complete"]),
+                priority=subtask["priority"],
+            )
+        )
+    db.session.add(task)
+    db.session.delete(archivedtask)
+    db.session.commit()
+    return jsonify(task.to_json()), 201
@@ -0,0 +1,889 @@
+"""Latency benchmarks for the task API.
+
+Run with `python benchmarks.py`. The app is pointed at a throwaway database in a
+temporary directory (through TODO_DATABASE), so todo.sqlite3 is never touched.
+"""
+
+from __future__ import annotations
+import io
+import os
+import queue
+import random
+import re
+import sys
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+
+benchdir = tempfile.mkdtemp(prefix="todo-bench-")
+os.environ["TODO_DATABASE"] = os.path.join(benchdir, "bench.sqlite3")
+# the AI benchmarks never call OpenAI or AssemblyAI
+os.environ["TODO_AI_BACKEND"] = "fake"
+
+from sqlalchemy import create_engine, event, insert, text
+from sqlalchemy.exc import OperationalError
+
+from flask.sessions import SecureCookieSessionInterface
+
+import aijobs
+import chat_gpt
+import dbprofile
+from app import app, db, User, Task, TaskList, Subtask, TasksToTaskLists, archivetasks
+from app import gptcontextnames, hashpool, loginlimiter, pwd_hasher, usercache
+
+app.config["WTF_CSRF_ENABLED"] = False
+# every benchmark client logs in from the same address, over and over
+loginlimiter.enabled = False
+
+BENCH_PASSWORD = "benchpassword"
+
+
+def main():
+    bench_hotpath_indexes()
+    bench_serialization_queries()
+    bench_task_pages()
+    bench_sync_payload()
+    bench_delete_tasklist()
+    bench_engine_profiles()
+    bench_search()
+    bench_due_range()
+    bench_smart_lists()
+    bench_list_counters()
+    bench_archive()
+    bench_login_storm()
+    bench_user_cache()
+    bench_index_page()
+    bench_login_attack()
+    bench_session_size()
+    bench_form_choices()
+    bench_csrf_token()
+    bench_bulk_attach()
+    bench_prompt_size()
+    bench_ai_jobs()
+
+
+# =================================================================================
+# Helpers
+# =================================================================================
+
+
+def seedusers(count: int) -> list[int]:
+    """Bulk insert users that all share one password (hashing each one would take
+    longer than the benchmark itself)"""
+    password_hash = User("hashsource", BENCH_PASSWORD).password_hash
+    start = db.session.query(db.func.max(User.id)).scalar() or 0
+    db.session.execute(
+        insert(User),
+        [
+            {"username": f"benchuser{start + i}", "password_hash": password_hash}
+            for i in range(1, count + 1)
+        ],
+    )
+    db.session.commit()
+    return [start + i for i in range(1, count + 1)]
+
+
+def seedtasks(userids: list[int], taskcount: int) -> dict[int, int]:
+    """Spread taskcount tasks round robin over the users, with one task list per
+    user that every one of their tasks belongs to. Returns {userid: tasklistid}"""
+    db.session.execute(
+        insert(TaskList), [{"name": "Bench", "userid": uid} for uid in userids]
+    )
+    tlids = dict(
+        db.session.query(TaskList.userid, TaskList.id).filter(
+            TaskList.userid.in_(userids)
+        )
+    )
+    now = int(time.time() * 1000)
+    db.session.execute(
+        insert(Task),
+        [
+            {
+                "name": f"bench task {i}",
+                "userid": userids[i % len(userids)],
+                "duedate": now + (i * 7919 % 1000) * 3_600_000,
+                "complete": i % 3 == 0,
+                "starred": i % 7 == 0,
+            }
+            for i in range(taskcount)
+        ],
+    )
+    db.session.execute(
+        insert(TasksToTaskLists).from_select(
+            ["tlid", "taskid"],
+            db.select(TaskList.id, Task.id).join(
+                Task, Task.userid == TaskList.userid
+            ).where(TaskList.userid.in_(userids)),
+        )
+    )
+    db.session.commit()
+    print(f"seeded {taskcount} tasks for {len(userids)} users")
+    return tlids
+
+
+def seedsubtasks(userids: list[int]) -> None:
+    """Give every task of these users one subtask"""
+    db.session.execute(
+        insert(Subtask).from_select(
+            ["name", "taskid"],
+            db.select(Task.name + " subtask", Task.id).where(Task.userid.in_(userids)),
+        )
+    )
+    db.session.commit()
+
+
+def login(client, userid: int) -> None:
+    username = db.session.get(User, userid).username
+    client.post("/login/", data={"username": username, "password": BENCH_PASSWORD})
+
+
+def timeget(client, url: str, repeat: int = 50) -> list[float]:
+    """Milliseconds for each of repeat GET requests (route prints are swallowed)"""
+    timings: list[float] = []
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return timings
+
+
+@contextmanager
+def countqueries(pattern: str | None = None):
+    """Count the SQL statements run inside the with block: `with countqueries() as n`
+    then read n[0]. With a pattern only the statements it matches are counted (an
+    executemany counts once)"""
+    count = [0]
+
+    def counter(conn, cursor, statement, *args):
+        if pattern is None or re.match(pattern, statement):
+            count[0] += 1
+
+    event.listen(db.engine, "before_cursor_execute", counter)
+    try:
+        yield count
+    finally:
+        event.remove(db.engine, "before_cursor_execute", counter)
+
+
+def report(label: str, timings: list[float]) -> None:
+    p95 = statistics.quantiles(timings, n=20)[-1]
+    print(
+        f"  {label:<40} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms"
+    )
+
+
+def dropindexes() -> list[str]:
+    """Drop the ix_* indexes and return the DDL needed to put them back"""
+    rows = db.session.execute(
+        text(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND name LIKE 'ix_%' AND sql IS NOT NULL"
+        )
+    ).all()
+    for name, _ in rows:
+        db.session.execute(text(f"DROP INDEX {name}"))
+    db.session.commit()
+    return [sql for _, sql in rows]
+
+
+def restoreindexes(ddl: list[str]) -> None:
+    for sql in ddl:
+        db.session.execute(text(sql))
+    db.session.commit()
+
+
+# =================================================================================
+# Benchmarks
+# =================================================================================
+
+
+def bench_hotpath_indexes(users: int = 1000, tasks: int = 100_000) -> None:
+    """/getUserTasks/ and /getListTasks/<id>/ for one user, with every user's tasks
+    in the table, before and after the hot path indexes"""
+    print(f"\nhot path indexes ({tasks} tasks over {users} users)")
+    with app.app_context():
+        userids = seedusers(users)
+        tlids = seedtasks(userids, tasks)
+        userid = userids[len(userids) // 2]
+        urls = ["/getUserTasks/", f"/getListTasks/{tlids[userid]}/"]
+
+        client = app.test_client()
+        login(client, userid)
+
+        ddl = dropindexes()
+        print(" before (no indexes)")
+        for url in urls:
+            report(url, timeget(client, url))
+
+        restoreindexes(ddl)
+        print(" after")
+        for url in urls:
+            report(url, timeget(client, url))
+
+
+def bench_serialization_queries(small: int = 10, large: int = 5000) -> None:
+    """Serializing a user's tasks must take the same number of queries no matter
+    how many tasks they have (no lazy load per task)"""
+    print(f"\nqueries per request ({small} tasks vs {large} tasks)")
+    with app.app_context():
+        smalluser, largeuser = seedusers(2)
+        smalltl = seedtasks([smalluser], small)[smalluser]
+        largetl = seedtasks([largeuser], large)[largeuser]
+        seedsubtasks([smalluser, largeuser])
+
+        for url in ["/getUserTasks/?subtasks=1", "/getListTasks/{}/?subtasks=1"]:
+            counts = []
+            for userid, tlid in [(smalluser, smalltl), (largeuser, largetl)]:
+                client = app.test_client()
+                login(client, userid)
+                with countqueries() as n:
+                    timeget(client, url.format(tlid), repeat=1)
+                counts.append(n[0])
+            print(f"  {url:<40} {counts[0]} queries vs {counts[1]} queries")
+            assert counts[0] == counts[1], f"{url} issues a query per task"
+
+
+def bench_task_pages(small: int = 50, large: int = 50_000) -> None:
+    """The first page of /api/v1/tasks/ should cost the same for a user with 50
+    tasks as for a user with 50k, and so should walking a few pages in"""
+    print(f"\npaginated task listing ({small} tasks vs {large} tasks)")
+    with app.app_context():
+        for count in (small, large):
+            (userid,) = seedusers(1)
+            tlid = seedtasks([userid], count)[userid]
+            client = app.test_client()
+            login(client, userid)
+            for url in [
+                "/api/v1/tasks/",
+                "/api/v1/tasks/?complete=0&sort=priority&order=desc",
+                f"/api/v1/tasks/?list={tlid}&starred=1",
+            ]:
+                report(f"{count} tasks {url}", timeget(client, url))
+
+            cursor, pages, start = None, 0, time.perf_counter()
+            while pages < 20:
+                url = "/api/v1/tasks/" + (f"?cursor={cursor}" if cursor else "")
+                with redirect_stdout(io.StringIO()):
+                    cursor = client.get(url).json["nextcursor"]
+                pages += 1
+                if cursor is None:
+                    break
+            elapsed = (time.perf_counter() - start) * 1000 / pages
+            print(f"  {count} tasks: {pages} pages walked, {elapsed:.2f} ms per page")
+
+
+def bench_sync_payload(tasks: int = 5000, changes: int = 5) -> None:
+    """Bytes a reconnecting client downloads: a full /api/v1/sync/ versus a delta
+    after a handful of edits"""
+    print(f"\ndelta sync ({tasks} tasks, {changes} edits)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], tasks)
+        # bulk inserts skip change tracking, so stamp the seeded rows by hand
+        db.session.execute(
+            text("UPDATE Tasks SET changeseq = 1 WHERE userid = :u"), {"u": userid}
+        )
+        db.session.execute(
+            text("UPDATE Users SET changeseq = 1 WHERE id = :u"), {"u": userid}
+        )
+        db.session.commit()
+        client = app.test_client()
+        login(client, userid)
+
+        full = client.get("/api/v1/sync/?since=0")
+        seq = full.json["seq"]
+        taskids = [task["id"] for task in full.json["tasks"][:changes]]
+        for taskid in taskids:
+            client.post(f"/markComplete/{taskid}/1/")
+        delta = client.get(f"/api/v1/sync/?since={seq}")
+        print(f"  full sync   {len(full.data):>10} bytes")
+        print(f"  delta sync  {len(delta.data):>10} bytes ({len(delta.json['tasks'])} tasks)")
+
+
+def bench_delete_tasklist(tasks: int = 10_000) -> None:
+    """Deleting a task list with 10k tasks (each with a subtask) through the task
+    list deletion form"""
+    print(f"\ntask list deletion ({tasks} tasks, {tasks} subtasks)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        tlid = seedtasks([userid], tasks)[userid]
+        seedsubtasks([userid])
+        client = app.test_client()
+        login(client, userid)
+
+        with countqueries() as n, redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            client.post("/tasklistdeleteform/", data={"tasklistids": [str(tlid)]})
+            elapsed = (time.perf_counter() - start) * 1000
+        remaining = db.session.query(Task).filter_by(userid=userid).count()
+        print(f"  deleted in {elapsed:.2f} ms with {n[0]} statements")
+        assert remaining == 0, f"{remaining} tasks were left behind"
+
+
+def bench_engine_profiles(
+    readers: int = 12, writers: int = 4, seconds: float = 3.0, rows: int = 50_000
+) -> None:
+    """Read and write throughput of each engine profile with many threads hitting
+    one database file at once: readers page through a user's tasks while writers
+    flip completion flags one commit at a time, like a burst of markComplete"""
+    print(f"\nengine profiles ({readers} reader and {writers} writer threads, {seconds:.0f} s)")
+    for name in dbprofile.PROFILES:
+        profile = dbprofile.getprofile(name)
+        # each profile gets its own file, journal_mode=WAL sticks to the file
+        engine = create_engine(
+            f"sqlite:///{os.path.join(benchdir, f'profile-{name}.sqlite3')}",
+            **dbprofile.engineoptions(profile),
+        )
+        dbprofile.installpragmas(engine, profile["pragmas"])
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE Tasks (id INTEGER PRIMARY KEY, userid INTEGER NOT NULL, "
+                "name VARCHAR NOT NULL, complete BOOLEAN NOT NULL)"
+            )
+            conn.exec_driver_sql("CREATE INDEX ix_tasks_userid ON Tasks (userid)")
+            conn.execute(
+                text("INSERT INTO Tasks (userid, name, complete) VALUES (:u, :n, 0)"),
+                [{"u": i % 100, "n": f"task {i}"} for i in range(rows)],
+            )
+
+        counts = {"reads": 0, "writes": 0, "locked": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def work(write: bool, seed: int) -> None:
+            done = locked = 0
+            i = seed
+            while time.perf_counter() < deadline:
+                i += 7919
+                try:
+                    if write:
+                        with engine.begin() as conn:
+                            conn.execute(
+                                text("UPDATE Tasks SET complete = NOT complete WHERE id = :id"),
+                                {"id": i % rows + 1},
+                            )
+                    else:
+                        with engine.connect() as conn:
+                            conn.execute(
+                                text("SELECT id, name, complete FROM Tasks WHERE userid = :u"),
+                                {"u": i % 100},
+                            ).all()
+                    done += 1
+                except OperationalError:
+                    locked += 1
+            with lock:
+                counts["writes" if write else "reads"] += done
+                counts["locked"] += locked
+
+        threads = [threading.Thread(target=work, args=(False, i)) for i in range(readers)]
+        threads += [threading.Thread(target=work, args=(True, i)) for i in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+        print(
+            f"  {name:<12} {counts['reads'] / seconds:9.0f} reads/s "
+            f"{counts['writes'] / seconds:8.0f} writes/s   {counts['locked']} locked errors"
+        )
+
+
+def bench_search(users: int = 1000, tasks: int = 100_000) -> None:
+    """/api/v1/search/ for one user while the index holds every user's tasks:
+    a rare word, a common word, a prefix, and several words at once"""
+    print(f"\nsearch ({tasks} tasks over {users} users)")
+    rng = random.Random(0)
+    vocabulary = [f"{syllable}{n}" for syllable in ("ba", "ko", "mi", "tu") for n in range(500)]
+    with app.app_context():
+        userids = seedusers(users)
+        db.session.execute(
+            insert(Task),
+            [
+                {
+                    "name": " ".join(rng.choices(vocabulary, k=4))
+                    + (" groceries" if i % 10 == 0 else ""),
+                    "notes": " ".join(rng.choices(vocabulary, k=12)),
+                    "userid": userids[i % users],
+                }
+                for i in range(tasks)
+            ],
+        )
+        db.session.commit()
+        userid = userids[users // 2]
+        rare = db.session.query(Task.name).filter_by(userid=userid).first()[0].split()[0]
+        client = app.test_client()
+        login(client, userid)
+        for q in [rare, "groceries", "gro", f"groceries {rare[:3]}"]:
+            report(f"q={q}", timeget(client, f"/api/v1/search/?q={q}"))
+
+
+def bench_due_range(small: int = 500, large: int = 50_000) -> None:
+    """A week of /api/v1/tasks/due/ should be an index range scan, so it costs
+    about the same for a user with 50k tasks as for one with 500"""
+    print(f"\ndue date range ({small} tasks vs {large} tasks)")
+    week = 7 * 24 * 3_600_000
+    with app.app_context():
+        for count in (small, large):
+            (userid,) = seedusers(1)
+            seedtasks([userid], count)
+            start = int(time.time() * 1000)
+            client = app.test_client()
+            login(client, userid)
+            url = f"/api/v1/tasks/due/?from={start}&to={start + week}&limit=50"
+            report(f"{count} tasks, first 50 due this week", timeget(client, url))
+
+        plan = db.session.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT id FROM Tasks WHERE userid = 1 "
+                "AND duedate >= 0 AND duedate < 1 ORDER BY duedate, id"
+            )
+        ).all()
+        print(f"  plan: {'; '.join(row[-1] for row in plan)}")
+        assert "ix_tasks_userid_duedate" in plan[0][-1], "due range isn't using the index"
+
+
+def bench_smart_lists(tasks: int = 50_000) -> None:
+    """Sidebar badges from /api/v1/counts/ and the first page of each smart list,
+    against downloading every task to work them out on the client"""
+    print(f"\nsmart lists and counts ({tasks} tasks)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], tasks)
+        client = app.test_client()
+        login(client, userid)
+        report("/getUserTasks/ (client side counting)", timeget(client, "/getUserTasks/", 10))
+        report("/api/v1/counts/", timeget(client, "/api/v1/counts/?tzoffset=300"))
+        for name in ("starred", "today", "overdue", "planned"):
+            url = f"/api/v1/smartlists/{name}/?tzoffset=300"
+            report(url, timeget(client, url))
+
+
+def bench_list_counters(small: int = 50, large: int = 50_000) -> None:
+    """Task list badges (/getUserTaskLists/ carries each list's counters) should
+    cost the same however many tasks are in the lists"""
+    print(f"\ntask list counters ({small} tasks vs {large} tasks)")
+    with app.app_context():
+        for count in (small, large):
+            (userid,) = seedusers(1)
+            seedtasks([userid], count)
+            client = app.test_client()
+            login(client, userid)
+            report(f"{count} tasks /getUserTaskLists/", timeget(client, "/getUserTaskLists/"))
+
+
+def bench_archive(active: int = 2000, history: int = 100_000) -> None:
+    """Working set requests for a user with 2k open tasks and 100k tasks completed
+    long ago, before and after the archive job moves the history out"""
+    print(f"\narchive ({active} open tasks, {history} completed a year ago)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], active)
+        db.session.execute(
+            text("UPDATE Tasks SET complete = 0 WHERE userid = :u"), {"u": userid}
+        )
+        yearago = datetime.utcnow() - timedelta(days=365)
+        db.session.execute(
+            insert(Task),
+            [
+                {
+                    "name": f"old task {i}",
+                    "userid": userid,
+                    "complete": True,
+                    "completedat": yearago,
+                }
+                for i in range(history)
+            ],
+        )
+        db.session.commit()
+        client = app.test_client()
+        login(client, userid)
+        urls = ["/api/v1/counts/", "/api/v1/smartlists/planned/", "/api/v1/tasks/"]
+
+        print(" before")
+        for url in urls:
+            report(url, timeget(client, url, 20))
+        start = time.perf_counter()
+        moved = archivetasks(datetime.utcnow() - timedelta(days=30))
+        elapsed = time.perf_counter() - start
+        print(f"  archived {moved} tasks in {elapsed:.2f} s ({moved / elapsed:.0f} tasks/s)")
+        print(" after")
+        for url in urls:
+            report(url, timeget(client, url, 20))
+        report("/api/v1/archive/", timeget(client, "/api/v1/archive/", 20))
+
+
+def bench_login_storm(serverworkers: int = 8, logins: int = 40, calls: int = 200) -> None:
+    """Task API latency (queueing included) while a burst of logins hits a server
+    with serverworkers request threads, hashing on the request thread versus in
+    the bounded hashing pool"""
+    print(
+        f"\nlogin storm ({logins} logins and {calls} /api/v1/tasks/ calls, "
+        f"{serverworkers} server threads)"
+    )
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], 200)
+        username = db.session.get(User, userid).username
+    # logged in clients for the API calls, handed out one per request
+    clients: queue.Queue = queue.Queue()
+    for _ in range(serverworkers):
+        client = app.test_client()
+        with app.app_context():
+            login(client, userid)
+        clients.put(client)
+
+    def apicall(submitted: float) -> float:
+        client = clients.get()
+        try:
+            client.get("/api/v1/tasks/")
+        finally:
+            clients.put(client)
+        return (time.perf_counter() - submitted) * 1000
+
+    def storm() -> int:
+        client = app.test_client()
+        return client.post(
+            "/login/", data={"username": username, "password": BENCH_PASSWORD}
+        ).status_code
+
+    for mode, pool in [("inline hashing", None), ("hashing pool", hashpool)]:
+        if pool is not None and pool.executor is None:
+            pool.start()
+        pwd_hasher.pool = pool
+        with ThreadPoolExecutor(serverworkers) as server, redirect_stdout(io.StringIO()):
+            loginfutures, apifutures = [], []
+            for i in range(calls):
+                if i % (calls // logins) == 0:
+                    loginfutures.append(server.submit(storm))
+                apifutures.append(server.submit(apicall, time.perf_counter()))
+                time.sleep(0.002)
+            timings = [future.result() for future in apifutures]
+            statuses = [future.result() for future in loginfutures]
+        p99 = statistics.quantiles(timings, n=100)[-1]
+        print(
+            f"  {mode:<16} api median {statistics.median(timings):8.2f} ms   "
+            f"p99 {p99:8.2f} ms   logins {statuses.count(302)} ok, {statuses.count(503)} shed"
+        )
+    pwd_hasher.pool = hashpool if hashpool.executor is not None else None
+
+
+def bench_user_cache(repeat: int = 200) -> None:
+    """Statements and latency of an authenticated API call when current_user has
+    to be loaded from the database versus served from the user cache"""
+    print("\nuser cache (/getUserColor/)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        client = app.test_client()
+        login(client, userid)
+        for label, clear in [("cold (load_user queries)", True), ("cached", False)]:
+            timings, statements = [], 0
+            for _ in range(repeat):
+                if clear:
+                    usercache.clear()
+                # a fresh app context per request, like a real server (Flask-Login
+                # remembers current_user in g)
+                with app.app_context(), countqueries() as n:
+                    timings.extend(timeget(client, "/getUserColor/", repeat=1))
+                statements += n[0]
+            report(f"{label}, {statements / repeat:.0f} statements", timings)
+
+
+def bench_index_page(small: int = 1000, large: int = 1_000_000) -> None:
+    """/index/ for one user with 1k and then 1M users in the table"""
+    print(f"\nhome page ({small} users vs {large} users)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], 200)
+        client = app.test_client()
+        login(client, userid)
+        total = db.session.query(db.func.count(User.id)).scalar()
+        for count in (small, large):
+            # a recursive CTE adds the users without building them in Python
+            db.session.execute(
+                text(
+                    "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+                    "WHERE i < :count) "
+                    "INSERT INTO Users (username, password_hash, changeseq, opentasks, "
+                    "completedtasks) SELECT 'crowd' || :start || '-' || i, "
+                    "(SELECT password_hash FROM Users WHERE id = :userid), 0, 0, 0 FROM n"
+                ),
+                {"count": max(count - total, 1), "start": total, "userid": userid},
+            )
+            db.session.commit()
+            total = db.session.query(db.func.count(User.id)).scalar()
+            report(f"{total} users /index/", timeget(client, "/index/"))
+
+
+def bench_login_attack(attackers: int = 8, attempts: int = 200) -> None:
+    """CPU spent while attackers threads guess a user's password as fast as they
+    can, with and without the login rate limiter (hashing on the request thread,
+    so every guess that gets through costs a full verify)"""
+    print(f"\nlogin attack ({attempts} wrong passwords from {attackers} threads)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        username = db.session.get(User, userid).username
+    pool, pwd_hasher.pool = pwd_hasher.pool, None
+
+    def guess(i: int) -> int:
+        client = app.test_client()
+        return client.post(
+            "/login/", data={"username": username, "password": f"guess{i}"}
+        ).status_code
+
+    for mode, enabled in [("no limiter", False), ("rate limited", True)]:
+        loginlimiter.enabled = enabled
+        loginlimiter.buckets.clear()
+        cpu, wall = time.process_time(), time.perf_counter()
+        with ThreadPoolExecutor(attackers) as server, redirect_stdout(io.StringIO()):
+            statuses = list(server.map(guess, range(attempts)))
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+        print(
+            f"  {mode:<14} cpu {cpu:7.2f} s   wall {wall:7.2f} s   "
+            f"hashed {statuses.count(302):4d}   rejected {statuses.count(429):4d}"
+        )
+    loginlimiter.enabled = False
+    pwd_hasher.pool = pool
+
+
+def bench_session_size(counts: tuple[int, ...] = (10, 100, 1000)) -> None:
+    """Cookie header size and latency of /api/v0/getauts/ for an anonymous user
+    with more and more tasks, session data in the signed cookie versus on the
+    server"""
+    print("\nanonymous session size (/api/v0/getauts/)")
+    serverside = app.session_interface
+    for mode, interface in [
+        ("cookie", SecureCookieSessionInterface()),
+        ("server side", serverside),
+    ]:
+        app.session_interface = interface
+        for count in counts:
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session["anonymoustasks"] = {
+                    str(i): [f"anonymous task {i}", "10/20/2026", i % 2 == 0]
+                    for i in range(count)
+                }
+                session["nextanonymoustaskid"] = count
+            cookie = len(client.get_cookie(app.config["SESSION_COOKIE_NAME"]).value)
+            timings = timeget(client, "/api/v0/getauts/")
+            report(f"{mode}, {count} tasks, {cookie} byte cookie", timings)
+    app.session_interface = serverside
+
+
+def bench_form_choices(small: int = 50, large: int = 5000, repeat: int = 20) -> None:
+    """Statements and latency of rendering and validating the task, task list and
+    subtask forms for a user with few and with many tasks (each with a subtask)"""
+    print("\nform choices")
+    for count in (small, large):
+        with app.app_context():
+            (userid,) = seedusers(1)
+            seedtasks([userid], count)
+            seedsubtasks([userid])
+            taskids = [
+                str(taskid)
+                for (taskid,) in db.session.query(Task.id).filter_by(userid=userid)
+            ]
+            client = app.test_client()
+            login(client, userid)
+        with client.session_transaction() as session:
+            session["deletesubtasksfor"] = taskids
+        for method, url, data in [
+            ("GET", "/taskform/", None),
+            ("GET", "/tasklistform/", None),
+            ("GET", "/subtaskdeleteform/", None),
+            # a name the user already has -> fails validate_name
+            ("POST", "/tasklistform/", {"name": "Bench"}),
+        ]:
+            timings, statements = [], 0
+            for _ in range(repeat):
+                # a fresh app context per request (the choices are memoized in g)
+                with app.app_context(), countqueries() as n:
+                    start = time.perf_counter()
+                    with redirect_stdout(io.StringIO()):
+                        client.open(url, method=method, data=data)
+                    timings.append((time.perf_counter() - start) * 1000)
+                statements += n[0]
+            report(
+                f"{method} {url}, {count} tasks, {statements / repeat:.0f} statements",
+                timings,
+            )
+
+
+def bench_csrf_token(tasks: int = 5000, repeat: int = 50) -> None:
+    """Statements and latency of fetching the CSRF token for a user with many
+    tasks"""
+    print("\ncsrf token (/api/v1/csrf/)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], tasks)
+        client = app.test_client()
+        login(client, userid)
+    timings, statements = [], 0
+    for _ in range(repeat):
+        # a fresh app context per request, like a real server
+        with app.app_context(), countqueries() as n:
+            timings.extend(timeget(client, "/api/v1/csrf/", repeat=1))
+        statements += n[0]
+    report(f"{tasks} tasks, {statements / repeat:.0f} statements", timings)
+
+
+def bench_bulk_attach(tasks: int = 500, repeat: int = 10) -> None:
+    """Statements and latency of creating a task list that starts out with every
+    one of a user's tasks in it"""
+    print(f"\nbulk attach (POST /tasklistform/ with {tasks} tasks)")
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], tasks)
+        taskids = [
+            str(taskid)
+            for (taskid,) in db.session.query(Task.id).filter_by(userid=userid)
+        ]
+        client = app.test_client()
+        login(client, userid)
+    timings, statements, inserts = [], 0, 0
+    for i in range(repeat):
+        with app.app_context(), countqueries() as n:
+            with countqueries(r"INSERT INTO \"?TasksToTaskLists") as joins:
+                start = time.perf_counter()
+                with redirect_stdout(io.StringIO()):
+                    response = client.post(
+                        "/tasklistform/", data={"name": f"bulk {i}", "taskids": taskids}
+                    )
+                timings.append((time.perf_counter() - start) * 1000)
+        if response.location != "/index/":
+            raise RuntimeError("creating the task list failed")
+        statements += n[0]
+        inserts += joins[0]
+    report(
+        f"{statements / repeat:.0f} statements, {inserts / repeat:.0f} join inserts",
+        timings,
+    )
+
+
+def bench_prompt_size(counts: tuple[int, ...] = (100, 10_000, 100_000)) -> None:
+    """Size and render time of the AI prompt for users with more and more tasks,
+    next to what sending every task name would have cost, then the time and rows
+    it takes to read a user's names for the prompt"""
+    print("\nai prompt size")
+    tasklists = [f"list {i}" for i in range(20)]
+    for count in counts:
+        tasks = [f"bench task {i}" for i in range(count)]
+        timings = []
+        for _ in range(20):
+            start = time.perf_counter()
+            messages = chat_gpt.TEMPLATE.render(
+                "what's next?", chat_gpt.PromptNames.of(tasklists, tasks), datetime.now()
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+        unbounded = len(chat_gpt.TEMPLATE.instructions) + len(",".join(tasks + tasklists))
+        report(
+            f"{count} tasks, {chat_gpt.promptsize(messages)} bytes "
+            f"(unbounded {unbounded})",
+            timings,
+        )
+
+    print("\nai prompt names (gptcontextnames)")
+    for count in counts:
+        with app.app_context():
+            (userid,) = seedusers(1)
+            seedtasks([userid], count)
+            timings = []
+            for _ in range(20):
+                start = time.perf_counter()
+                names = gptcontextnames(userid)
+                timings.append((time.perf_counter() - start) * 1000)
+        report(f"{count} tasks, {len(names.tasks)} names read", timings)
+
+
+def bench_ai_jobs(
+    serverworkers: int = 8, asks: int = 40, calls: int = 200, delay: float = 0.5
+) -> None:
+    """Task API latency (queueing included) while a burst of AI questions, each
+    answered by a fake LLM after delay seconds, hits a server with serverworkers
+    request threads: waiting for the answer in the request (/askChatGPT/) versus
+    submitting a job and polling it"""
+    print(
+        f"\nai jobs ({asks} questions and {calls} /api/v1/tasks/ calls, "
+        f"{serverworkers} server threads, {delay:.1f} s per answer)"
+    )
+    todo = sys.modules["app"]
+    with app.app_context():
+        (userid,) = seedusers(1)
+        seedtasks([userid], 200)
+    # logged in clients, handed out one per request
+    clients: queue.Queue = queue.Queue()
+    for _ in range(serverworkers):
+        client = app.test_client()
+        with app.app_context():
+            login(client, userid)
+        clients.put(client)
+
+    def request(method: str, url: str, **kwargs):
+        client = clients.get()
+        try:
+            return client.open(url, method=method, **kwargs)
+        finally:
+            clients.put(client)
+
+    def apicall(submitted: float) -> float:
+        request("GET", "/api/v1/tasks/")
+        return (time.perf_counter() - submitted) * 1000
+
+    def blocking(i: int) -> str:
+        response = request("GET", "/askChatGPT/", query_string={"question": f"q{i}"})
+        return response.json["status"]
+
+    def submitjob(i: int) -> str:
+        return request("POST", "/api/v1/ai/jobs/", data={"question": f"q{i}"}).json[
+            "id"
+        ]
+
+    original = todo.aiqueue
+    for mode, ask in [("wait in request", blocking), ("job + polling", submitjob)]:
+        todo.aiqueue = aijobs.AIJobQueue(
+            aijobs.FakeLLM(delay),
+            aijobs.FakeTranscriber(),
+            todo.jobcontext,
+            todo.jobresult,
+            workers=original.workers,
+            queuelimit=asks,
+            store=original.store,
+        )
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(serverworkers) as server:
+                askfutures, apifutures = [], []
+                for i in range(calls):
+                    if i % (calls // asks) == 0:
+                        askfutures.append(server.submit(ask, i))
+                    apifutures.append(server.submit(apicall, time.perf_counter()))
+                    time.sleep(0.002)
+                timings = [future.result() for future in apifutures]
+                answers = [future.result() for future in askfutures]
+            if ask is submitjob:
+                # the questions are only answered once every job is done
+                answers = [
+                    request("GET", f"/api/v1/ai/jobs/{jobid}/?wait=25").json["status"]
+                    for jobid in answers
+                ]
+        elapsed = time.perf_counter() - start
+        todo.aiqueue.shutdown()
+        p99 = statistics.quantiles(timings, n=100)[-1]
+        print(
+            f"  {mode:<16} api median {statistics.median(timings):8.2f} ms   "
+            f"p99 {p99:8.2f} ms   answered {len(answers) - answers.count('failed')} "
+            f"in {elapsed:5.2f} s"
+        )
+    todo.aiqueue = original
+
+
+# run main after definitions when run directly as a script
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@
 from datetime import datetime
 import sys
 import json
+import os
+import threading
+from typing import Iterable, NamedTuple
 import openai
 
 from config import chatGPTSecretKey
@@ -63,7 +66,8 @@ class Task:
             "id": self.id,
             "name": self.name,
             "starred": self.starred,
-            "duedate": self.duedate.timestamp(),
+            # epoch milliseconds, like every other due date in the app
+            "duedate": int(self.duedate.timestamp() * 1000),
             "priority": self.priority,
             "tasklistnames": newTaskListNames
         }
@@ -186,24 +190,134 @@ class Chat_GPT_Response:
 def response_from_json(json_data):
     data = json.loads(json_data)
     return Chat_GPT_Response(**data)
-class Chat_GPT:
+# the instructions are read once, from next to this file (not the working directory)
+PROMPT_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "chatGPT_Content.txt"
+)
+# the existing task and task list names go into every prompt -> a user with
+# thousands of tasks gets the first ones that fit in this many bytes (app.py only
+# reads that many from the database)
+MAX_CONTEXT_BYTES = 16 * 1024
+# longer questions (or transcripts) are cut off
+MAX_QUESTION_CHARS = 4000
+
+
+def takebounded(names: Iterable[str], budget: int) -> list[str]:
+    """The first names that fit in budget bytes, counting a comma after each. Stops
+    reading names at the first one that doesn't fit"""
+    taken, used = [], 0
+    for name in names:
+        used += len(name.encode("utf-8")) + 1
+        if used > budget:
+            break
+        taken.append(name)
+    return taken
+
+
+def joinbounded(names: Iterable[str], budget: int) -> tuple[str, int]:
+    """names joined with commas, as many as fit in budget bytes -> (text, how many)"""
+    taken = takebounded(names, budget)
+    return ",".join(taken), len(taken)
+
+
+def omitted(count: int) -> str:
+    return f" (and {count} more)" if count else ""
+
+
+class PromptNames(NamedTuple):
+    """A user's task list names and task names for the prompt, along with how
+    many of each they have in all (the lists may only hold some of them)"""
+
+    taskLists: list[str]
+    tasks: list[str]
+    tasklistcount: int
+    taskcount: int
+
+    @staticmethod
+    def of(taskLists: list[str], tasks: list[str]) -> "PromptNames":
+        """Names that are all there is"""
+        return PromptNames(taskLists, tasks, len(taskLists), len(tasks))
+
+
+class PromptTemplate(NamedTuple):
+    """The system prompt's instructions, loaded once (see TEMPLATE). Immutable, so
+    every request renders its own messages from it and nothing carries over"""
+
+    instructions: str
+    maxcontextbytes: int = MAX_CONTEXT_BYTES
+    maxquestionchars: int = MAX_QUESTION_CHARS
+
+    @staticmethod
+    def load(path: str = PROMPT_FILE) -> "PromptTemplate":
+        with open(path, "r", encoding="utf-8") as file:
+            return PromptTemplate(file.read())
+
+    def render(self, question: str, names: PromptNames, now: datetime) -> list[dict]:
+        """The messages for one request: the instructions plus this user's task
+        list names, task names and the date (at most maxcontextbytes of names),
+        then the question"""
+        # task lists first, they are fewer and the model has to reuse their names
+        listText, listCount = joinbounded(names.taskLists, self.maxcontextbytes)
+        taskText, taskCount = joinbounded(
+            names.tasks, self.maxcontextbytes - len(listText.encode("utf-8"))
+        )
+        context = (
+            f"\nHere is a list of all the tasks already in the app:\n{taskText}"
+            f"{omitted(names.taskcount - taskCount)}"
+            f"\nHere is a list of all the task lists already in the app:\n{listText}"
+            f"{omitted(names.tasklistcount - listCount)}"
+            f"\nthe current date is: {now.strftime('%m/%d/%Y,%H:%M %A')}"
+        )
+        return [
+            {"role": "system", "content": self.instructions + context},
+            {"role": "user", "content": question[: self.maxquestionchars]},
+        ]
+
+
+def promptsize(messages: list[dict]) -> int:
+    return sum(len(message["content"].encode("utf-8")) for message in messages)
+
+
+class PromptMetrics:
+    """Sizes of the prompts sent so far (in bytes), for /api/v1/ai/promptstats/"""
+
     def __init__(self):
-        self.promptEngineering: str = ""
-        
-        file_path = 'chatGPT_Content.txt'
-        with open(file_path, 'r') as file:
-            file_content = file.read()
-        self.promptEngineering = file_content
+        self.requests: int = 0
+        self.totalbytes: int = 0
+        self.maxbytes: int = 0
+        self.lastbytes: int = 0
+        self.lock = threading.Lock()
+
+    def record(self, size: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.totalbytes += size
+            self.maxbytes = max(self.maxbytes, size)
+            self.lastbytes = size
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "meanbytes": self.totalbytes // self.requests if self.requests else 0,
+                "maxbytes": self.maxbytes,
+                "lastbytes": self.lastbytes,
+            }
+
+
+TEMPLATE: PromptTemplate = PromptTemplate.load()
+promptmetrics = PromptMetrics()
+
+
+class Chat_GPT:
+    def __init__(self, template: PromptTemplate = TEMPLATE):
+        self.template: PromptTemplate = template
         
         self.openai = openai
         self.openai.api_key = chatGPTSecretKey
-        self.messages = [{
-            "role": "system", 
-            "content": self.promptEngineering
-            }]
         
     def ask(self, question: str, types: list[str]) -> Old_Chat_GPT_Response:
-        response: Chat_GPT_Response = self.newAsk(question, types, [])
+        response: Chat_GPT_Response = self.newAsk(question, PromptNames.of(types, []))
         
         task: Task = response.tasks[0]
         
@@ -217,26 +331,13 @@ class Chat_GPT:
         reply: Old_Chat_GPT_Response = Old_Chat_GPT_Response(task.starred, task.name, "", due_date, due_time, due_time_included, task.tasklistnames[0])
         return reply
         
-    def newAsk (self, question: str, taskLists: list[str], tasks: list[str]) -> Chat_GPT_Response:
-        
-        self.promptEngineering += f"\nHere is a list of all the tasks already in the app:\n{','.join(tasks)}"
-        self.promptEngineering += f"\nHere is a list of all the task lists already in the app:\n{','.join(taskLists)}"
-        
-        currentDate: datetime = datetime.now()
-        self.promptEngineering += f"\nthe current date is: {currentDate.strftime("%m/%d/%Y,%H:%M %A")}"
-        
-        print(f"Current date: {currentDate.strftime("%m/%d/%Y,%H:%M %A")}")
+    def newAsk (self, question: str, names: PromptNames) -> Chat_GPT_Response:
+        # a fresh set of messages every time, the template itself never changes
+        messages = self.template.render(question, names, datetime.now())
+        promptmetrics.record(promptsize(messages))
         
-        self.messages = [{
-            "role": "system", 
-            "content": self.promptEngineering
-            }]
-        self.messages.append({
-            "role": "user",
-                "content": question
-        })
         chat = openai.chat.completions.create(
-            model="gpt-4o-mini", messages=self.messages
+            model="gpt-4o-mini", messages=messages
         )
         reply = chat.choices[0].message.content
         if "json" in reply:
@@ -0,0 +1,81 @@
+"""SQLite engine profiles.
+
+A profile is the set of PRAGMAs every new connection runs plus the connection
+pool settings for the engine. The app picks one by name through the
+TODO_DB_PROFILE environment variable (see app.py).
+"""
+
+from __future__ import annotations
+from copy import deepcopy
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILES: dict[str, dict] = {
+    # what a bare sqlite:/// URI gives you (plus foreign keys, which the cascading
+    # deletes rely on): a rollback journal, so readers and the writer block each
+    # other, and a short wait before "database is locked"
+    "legacy": {
+        "pragmas": {
+            "journal_mode": "DELETE",
+            "synchronous": "FULL",
+            "foreign_keys": "ON",
+            "busy_timeout": 5000,
+        },
+        "pool_size": 5,
+        "max_overflow": 10,
+        "pool_timeout": 30,
+    },
+    # for several Flask workers/threads sharing the database: with WAL readers
+    # never wait for the writer, NORMAL only syncs at checkpoints (still safe in
+    # WAL mode, only the last transactions can be lost on power failure), reads go
+    # through a memory map and a bigger page cache, and writers queue for up to
+    # busy_timeout ms instead of failing during a burst
+    "concurrent": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "foreign_keys": "ON",
+            "busy_timeout": 10000,
+            "mmap_size": 256 * 1024 * 1024,
+            # negative -> KiB rather than pages
+            "cache_size": -64 * 1024,
+            "temp_store": "MEMORY",
+        },
+        "pool_size": 16,
+        "max_overflow": 16,
+        "pool_timeout": 30,
+    },
+}
+
+
+def getprofile(name: str) -> dict:
+    if name not in PROFILES:
+        raise ValueError(
+            f"unknown database profile {name} (choose from {', '.join(PROFILES)})"
+        )
+    return deepcopy(PROFILES[name])
+
+
+def engineoptions(profile: dict) -> dict:
+    """Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS)"""
+    return {
+        "pool_size": profile["pool_size"],
+        "max_overflow": profile["max_overflow"],
+        "pool_timeout": profile["pool_timeout"],
+        # the driver's own lock timeout is in seconds
+        "connect_args": {"timeout": profile["pragmas"]["busy_timeout"] / 1000},
+    }
+
+
+def installpragmas(engine: Engine, pragmas: dict) -> None:
+    """Run the pragmas on every connection the engine opens"""
+
+    def setpragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            # pragmas can't take bound parameters
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    event.listen(engine, "connect", setpragmas)
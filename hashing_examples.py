@@ -1,6 +1,16 @@
+import json
+import os
+import statistics
+import time
 from cryptography.fernet import Fernet
 from passlib.hash import argon2
 
+# what every hash used before the parameters could be tuned (rounds=10 plus
+# passlib's defaults). Each argon2 hash string records the parameters it was made
+# with ($argon2id$v=19$m=65536,t=10,p=4$...), so hashes made with other ones can
+# be recognized and redone (see UpdatedHasher.needs_rehash)
+DEFAULT_PARAMS: dict = {"time_cost": 10, "memory_cost": 65536, "parallelism": 4}
+
 def main():
     pepper_key: bytes = UpdatedHasher.random_pepper()
     hasher: UpdatedHasher = UpdatedHasher(pepper_key)
@@ -15,14 +25,30 @@ def main():
     else:
         print("YAY")
 
+# the argon2 work itself, kept at module level so it can run in a worker process
+def argon2hash(pwd: str, params: dict) -> str:
+    return argon2.using(**params).hash(pwd)
+
+def argon2verify(pwd: str, hash: str) -> bool:
+    return argon2.verify(pwd, hash)
+
 class UpdatedHasher:
     """Upgrades the Dropbox for modern systems using Argon2"""
-    def __init__(self, pepper_key: bytes):
+    def __init__(self, pepper_key: bytes, pool=None, params: dict | None = None):
         self.pepper = Fernet(pepper_key)
+        # a hashpool.HashPool to run argon2 in, or None to run it right here
+        self.pool = pool
+        # argon2 time_cost/memory_cost/parallelism for new hashes
+        self.params: dict = dict(params or DEFAULT_PARAMS)
+
+    def argon2(self, fn, *args):
+        if self.pool is None:
+            return fn(*args)
+        return self.pool.run(fn, *args)
 
     def hash(self, pwd: str) -> bytes:
         # hash with argon2
-        hash: str = argon2.using(rounds=10).hash(pwd)
+        hash: str = self.argon2(argon2hash, pwd, self.params)
         # convert this unicode hash string into bytes before encryption
         hashb: bytes = hash.encode('utf-8')
         # encrypt this hash using the global pepper
@@ -35,11 +61,53 @@ class UpdatedHasher:
         # convert this hash back into a unicode string
         hash: str = hashb.decode('utf-8')
         # check if the given password matches this hash
-        return argon2.verify(pwd, hash)
+        return self.argon2(argon2verify, pwd, hash)
+
+    def needs_rehash(self, pep_hash: bytes) -> bool:
+        """Whether this hash was made with other parameters than the current ones
+        (cheap, the parameters are read from the hash string)"""
+        hash: str = self.pepper.decrypt(pep_hash).decode('utf-8')
+        return argon2.using(**self.params).needs_update(hash)
 
     @staticmethod
     def random_pepper() -> bytes:
         return Fernet.generate_key()
 
+# parameters are tuned per machine -> they live in a small JSON file next to the
+# app rather than in the code
+def load_params(path: str) -> dict:
+    if not os.path.exists(path):
+        return dict(DEFAULT_PARAMS)
+    with open(path) as fin:
+        return {**DEFAULT_PARAMS, **json.load(fin)}
+
+def save_params(path: str, params: dict) -> None:
+    with open(path, 'w') as fout:
+        json.dump(params, fout, indent=2)
+
+def time_verify(params: dict, repeat: int = 3) -> float:
+    """Median milliseconds to verify a password hashed with params"""
+    hash: str = argon2hash('calibration password', params)
+    timings: list[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        argon2verify('calibration password', hash)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def calibrate(target_ms: float, memory_cost: int, parallelism: int) -> dict:
+    """Find the most expensive parameters whose verify stays within target_ms on
+    this machine: memory_cost (KiB) is halved until one pass fits, then time_cost
+    is raised as far as the target allows"""
+    params: dict = {'time_cost': 1, 'memory_cost': memory_cost, 'parallelism': parallelism}
+    while time_verify(params) > target_ms and params['memory_cost'] > 8 * 1024:
+        params['memory_cost'] //= 2
+    # verify time grows about linearly with time_cost
+    onepass: float = time_verify(params)
+    params['time_cost'] = max(1, int(target_ms // onepass))
+    while params['time_cost'] > 1 and time_verify(params) > target_ms:
+        params['time_cost'] -= 1
+    return params
+
 # run main after definitions when run directly as a script
 if __name__=='__main__': main()
\ No newline at end of file
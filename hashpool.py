@@ -0,0 +1,71 @@
+"""A bounded process pool for password hashing.
+
+Argon2 is slow on purpose, so hashing on the request thread lets a handful of
+logins occupy every worker the server has. HashPool runs the hashing in worker
+processes instead and bounds how much of it can be waiting: once every process
+is busy and the queue is full, run() fails right away with HashPoolBusy (the
+login routes answer 503) rather than tying up another request thread.
+"""
+
+from __future__ import annotations
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers: int, queuelimit: int, timeout: float):
+        self.workers: int = workers
+        self.queuelimit: int = queuelimit
+        # seconds a caller waits for its result (queueing included)
+        self.timeout: float = timeout
+        # one slot per job that is running or queued -> a slot is only given back
+        # when the job finishes, even if its caller already gave up on it
+        self.slots = threading.BoundedSemaphore(workers + queuelimit)
+        self.executor: ProcessPoolExecutor | None = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start the worker processes now rather than on the first login.
+
+        Workers are forked, so this is best done at startup before the server
+        starts its threads.
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                )
+        # with fork every worker process is started on the first submit
+        self.executor.submit(int).result()
+
+    def run(self, fn: Callable[..., Any], *args) -> Any:
+        """fn(*args) in a worker process (fn must be a module level function)"""
+        if not self.slots.acquire(blocking=False):
+            raise HashPoolBusy("every password hashing worker is busy")
+        try:
+            if self.executor is None:
+                self.start()
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashPoolBusy(f"password hashing took over {self.timeout} s")
+
+    def shutdown(self) -> None:
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,605 @@
+"""Versioned schema migrations for the todo database.
+
+The schema version lives in SQLite's user_version pragma. A brand new database is
+built straight from the models with create_all() and stamped with the latest
+version, while an existing database is upgraded in place one migration at a time
+so that nobody's tasks get dropped on restart.
+
+Each migration (and the initial create) runs in one SQLite transaction together
+with its user_version bump. The driver's own transaction handling leaves DDL
+outside of the transaction, so these connections run in autocommit mode and
+issue BEGIN/COMMIT themselves: a migration that fails halfway leaves no trace and
+the next upgrade() simply runs it again.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+
+class Migration:
+    def __init__(
+        self,
+        version: int,
+        description: str,
+        upgrade: Callable[[Connection], None],
+        oncreate: bool,
+    ):
+        self.version: int = version
+        self.description: str = description
+        self.upgrade: Callable[[Connection], None] = upgrade
+        # some schema objects (triggers, virtual tables, ...) are not described by
+        # the models, so create_all() won't build them -> these migrations also
+        # have to run on freshly created databases
+        self.oncreate: bool = oncreate
+
+    def __str__(self):
+        return f"migration {self.version}: {self.description}"
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str, oncreate: bool = False):
+    """Register the decorated function as the upgrade step to the given version"""
+
+    def register(upgrade: Callable[[Connection], None]):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"there is already a migration to version {version}")
+        MIGRATIONS.append(Migration(version, description, upgrade, oncreate))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+
+    return register
+
+
+def getversion(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def setversion(conn: Connection, version: int) -> None:
+    # pragmas can't take bound parameters
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def headversion() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+@contextmanager
+def transaction(engine: Engine) -> Iterator[Connection]:
+    """A connection whose statements, DDL included, all commit or all roll back.
+    BEGIN IMMEDIATE takes the write lock up front, so processes starting at the
+    same time migrate one after the other."""
+    with engine.connect() as conn:
+        # pysqlite would only wrap DML in its transactions -> hand control to us
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            # some errors (disk full, ...) already rolled SQLite back
+            if conn.connection.dbapi_connection.in_transaction:
+                conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+
+def upgrade(engine: Engine, create_all: Callable[[Connection], None]) -> bool:
+    """Bring the database up to the latest version. create_all builds the
+    models' tables on the connection it is given.
+
+    Returns True if the database did not exist yet and was created from scratch.
+    """
+    with transaction(engine) as conn:
+        if not inspect(conn).get_table_names():
+            create_all(conn)
+            for m in MIGRATIONS:
+                if m.oncreate:
+                    m.upgrade(conn)
+            setversion(conn, headversion())
+            return True
+
+    for m in MIGRATIONS:
+        # each migration gets its own transaction so a failure leaves the database
+        # at the last version that fully applied
+        with transaction(engine) as conn:
+            # (another process may have applied it in the meantime)
+            if getversion(conn) >= m.version:
+                continue
+            print(f"applying {m}")
+            m.upgrade(conn)
+            setversion(conn, m.version)
+    return False
+
+
+# =================================================================================
+# Migrations
+# =================================================================================
+
+
+@migration(1, "indexes for the per-user task and task list access paths")
+def addhotpathindexes(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_userid_duedate ON Tasks (userid, duedate)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_userid_complete_starred "
+        "ON Tasks (userid, complete, starred)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasklists_userid ON TaskLists (userid)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_taskstotasklists_tlid_taskid "
+        "ON TasksToTaskLists (tlid, taskid)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_subtasks_taskid ON Subtasks (taskid)"
+    )
+
+
+@migration(2, "indexes for paginated task listing")
+def addpaginationindexes(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_userid_priority ON Tasks (userid, priority)"
+    )
+    # serializing a page looks up the lists of just those tasks
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_taskstotasklists_taskid ON TasksToTaskLists (taskid)"
+    )
+
+
+@migration(3, "change tracking columns and tombstones for delta sync")
+def addchangetracking(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "ALTER TABLE Users ADD COLUMN changeseq INTEGER NOT NULL DEFAULT 0"
+    )
+    for table in ("Tasks", "TaskLists", "Subtasks"):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME")
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN changeseq INTEGER NOT NULL DEFAULT 0"
+        )
+    conn.exec_driver_sql(
+        "ALTER TABLE Subtasks ADD COLUMN userid INTEGER REFERENCES Users (id)"
+    )
+    conn.exec_driver_sql(
+        "UPDATE Subtasks SET userid = "
+        "(SELECT Tasks.userid FROM Tasks WHERE Tasks.id = Subtasks.taskid)"
+    )
+
+    # everything that already exists counts as change 1, so a client syncing
+    # from 0 gets all of it
+    for table in ("Tasks", "TaskLists", "Subtasks"):
+        conn.exec_driver_sql(
+            f"UPDATE {table} SET changeseq = 1, updated_at = CURRENT_TIMESTAMP"
+        )
+    conn.exec_driver_sql("UPDATE Users SET changeseq = 1")
+
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS Tombstones ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "userid INTEGER NOT NULL REFERENCES Users (id), "
+        "kind VARCHAR NOT NULL, "
+        "objectid INTEGER NOT NULL, "
+        "changeseq INTEGER NOT NULL, "
+        "deleted_at DATETIME NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_userid_changeseq ON Tasks (userid, changeseq)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasklists_userid_changeseq "
+        "ON TaskLists (userid, changeseq)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_subtasks_userid_changeseq "
+        "ON Subtasks (userid, changeseq)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tombstones_userid_changeseq "
+        "ON Tombstones (userid, changeseq)"
+    )
+
+
+def rebuildtable(
+    conn: Connection, table: str, create: str, columns: str, select: str
+) -> None:
+    """Recreate table from the CREATE TABLE statement create (written for a table
+    named <table>_new), copying the rows select produces into columns. SQLite
+    can't ALTER constraints or column types, so this is how they change.
+    Indexes have to be recreated afterwards."""
+    conn.exec_driver_sql(create)
+    conn.exec_driver_sql(f"INSERT INTO {table}_new ({columns}) {select}")
+    conn.exec_driver_sql(f"DROP TABLE {table}")
+    conn.exec_driver_sql(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+@migration(4, "cascade deletes from tasks and task lists to their dependents")
+def addcascadingdeletes(conn: Connection) -> None:
+    subtaskcolumns = "id, name, complete, taskid, priority, userid, updated_at, changeseq"
+    # rows whose task is already gone would violate the foreign key -> drop them
+    rebuildtable(
+        conn,
+        "Subtasks",
+        "CREATE TABLE Subtasks_new ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "name VARCHAR NOT NULL, "
+        "complete BOOLEAN NOT NULL, "
+        "taskid INTEGER NOT NULL REFERENCES Tasks (id) ON DELETE CASCADE, "
+        "priority INTEGER, "
+        "userid INTEGER REFERENCES Users (id), "
+        "updated_at DATETIME, "
+        "changeseq INTEGER NOT NULL DEFAULT 0)",
+        subtaskcolumns,
+        f"SELECT {subtaskcolumns} FROM Subtasks "
+        "WHERE taskid IN (SELECT id FROM Tasks)",
+    )
+    conn.exec_driver_sql("CREATE INDEX ix_subtasks_taskid ON Subtasks (taskid)")
+    conn.exec_driver_sql(
+        "CREATE INDEX ix_subtasks_userid_changeseq ON Subtasks (userid, changeseq)"
+    )
+
+    rebuildtable(
+        conn,
+        "TasksToTaskLists",
+        "CREATE TABLE TasksToTaskLists_new ("
+        "tlid VARCHAR NOT NULL REFERENCES TaskLists (id) ON DELETE CASCADE, "
+        "taskid INTEGER NOT NULL REFERENCES Tasks (id) ON DELETE CASCADE)",
+        "tlid, taskid",
+        "SELECT tlid, taskid FROM TasksToTaskLists "
+        "WHERE tlid IN (SELECT id FROM TaskLists) AND taskid IN (SELECT id FROM Tasks)",
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX ix_taskstotasklists_tlid_taskid ON TasksToTaskLists (tlid, taskid)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX ix_taskstotasklists_taskid ON TasksToTaskLists (taskid)"
+    )
+
+
+@migration(5, "integer task list ids and a composite primary key for TasksToTaskLists")
+def compacttasklistmemberships(conn: Connection) -> None:
+    # tlid used to be text that held a task list id -> cast it back, dropping any
+    # duplicate memberships the old table allowed
+    rebuildtable(
+        conn,
+        "TasksToTaskLists",
+        "CREATE TABLE TasksToTaskLists_new ("
+        "tlid INTEGER NOT NULL REFERENCES TaskLists (id) ON DELETE CASCADE, "
+        "taskid INTEGER NOT NULL REFERENCES Tasks (id) ON DELETE CASCADE, "
+        "PRIMARY KEY (tlid, taskid)) WITHOUT ROWID",
+        "tlid, taskid",
+        "SELECT DISTINCT CAST(tlid AS INTEGER), taskid FROM TasksToTaskLists "
+        "WHERE CAST(tlid AS INTEGER) IN (SELECT id FROM TaskLists)",
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX ix_taskstotasklists_taskid ON TasksToTaskLists (taskid)"
+    )
+
+
+@migration(6, "full text search index over tasks and their subtasks", oncreate=True)
+def addtasksearch(conn: Connection) -> None:
+    # one row per task (rowid = task id). owner holds a "u<userid>" token so a
+    # search only walks the current user's part of the index, and subtasks holds
+    # the task's subtask names joined together
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS TaskSearch USING fts5("
+        "name, notes, progressnotes, subtasks, owner, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+
+    # the triggers keep the index in step with every write, ORM or not (including
+    # the bulk deletes and ON DELETE CASCADE). Rebuilding Tasks or Subtasks in a
+    # later migration drops them, so they'd have to be created again there
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_task_insert AFTER INSERT ON Tasks BEGIN "
+        "INSERT INTO TaskSearch (rowid, name, notes, progressnotes, subtasks, owner) "
+        "VALUES (new.id, new.name, new.notes, new.progressnotes, '', 'u' || new.userid); "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_task_update "
+        "AFTER UPDATE OF name, notes, progressnotes, userid ON Tasks BEGIN "
+        "UPDATE TaskSearch SET name = new.name, notes = new.notes, "
+        "progressnotes = new.progressnotes, owner = 'u' || new.userid "
+        "WHERE rowid = new.id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_task_delete AFTER DELETE ON Tasks BEGIN "
+        "DELETE FROM TaskSearch WHERE rowid = old.id; "
+        "END"
+    )
+    subtasknames = (
+        "UPDATE TaskSearch SET subtasks = coalesce("
+        "(SELECT group_concat(name, ' ') FROM Subtasks WHERE taskid = {0}.taskid), '') "
+        "WHERE rowid = {0}.taskid; "
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_subtask_insert "
+        "AFTER INSERT ON Subtasks BEGIN " + subtasknames.format("new") + "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_subtask_update "
+        "AFTER UPDATE OF name, taskid ON Subtasks BEGIN "
+        + subtasknames.format("old")
+        + subtasknames.format("new")
+        + "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS tasksearch_subtask_delete "
+        "AFTER DELETE ON Subtasks BEGIN " + subtasknames.format("old") + "END"
+    )
+
+    conn.exec_driver_sql(
+        "INSERT INTO TaskSearch (rowid, name, notes, progressnotes, subtasks, owner) "
+        "SELECT id, name, notes, progressnotes, coalesce("
+        "(SELECT group_concat(Subtasks.name, ' ') FROM Subtasks "
+        "WHERE Subtasks.taskid = Tasks.id), ''), 'u' || userid FROM Tasks"
+    )
+
+
+@migration(7, "store every due date as UTC epoch milliseconds")
+def normalizeduedates(conn: Connection) -> None:
+    # the old seed wrote dates ('2024-12-24', taken as midnight UTC) and chat_gpt
+    # wrote epoch seconds. Text that isn't a date can't be sorted or compared, so
+    # it is cleared. Changed tasks get a new change number so clients resync them
+    conn.exec_driver_sql(
+        "UPDATE Tasks SET "
+        "duedate = CASE "
+        "WHEN typeof(duedate) = 'text' THEN CAST(strftime('%s', duedate) AS INTEGER) * 1000 "
+        "WHEN abs(duedate) < 100000000000 THEN CAST(round(duedate * 1000) AS INTEGER) "
+        "ELSE CAST(round(duedate) AS INTEGER) END, "
+        "changeseq = (SELECT Users.changeseq + 1 FROM Users WHERE Users.id = Tasks.userid), "
+        "updated_at = CURRENT_TIMESTAMP "
+        "WHERE typeof(duedate) IN ('text', 'real') "
+        "OR (typeof(duedate) = 'integer' AND abs(duedate) < 100000000000)"
+    )
+    # a task's change number is never ahead of its owner's, except for the ones
+    # just stamped above
+    conn.exec_driver_sql(
+        "UPDATE Users SET changeseq = changeseq + 1 WHERE EXISTS ("
+        "SELECT 1 FROM Tasks WHERE Tasks.userid = Users.id "
+        "AND Tasks.changeseq > Users.changeseq)"
+    )
+
+
+@migration(8, "indexes for the smart lists and their counts")
+def addsmartlistindexes(conn: Connection) -> None:
+    # the new index starts with the same columns, so it takes over every query the
+    # old one served
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_tasks_userid_complete_starred")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_userid_complete_starred_duedate "
+        "ON Tasks (userid, complete, starred, duedate)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_open_userid_duedate "
+        "ON Tasks (userid, duedate) WHERE complete = 0"
+    )
+
+
+@migration(9, "open and completed task counters on users and task lists")
+def addtaskcounters(conn: Connection) -> None:
+    for table in ("Users", "TaskLists"):
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN opentasks INTEGER NOT NULL DEFAULT 0"
+        )
+        conn.exec_driver_sql(
+            f"ALTER TABLE {table} ADD COLUMN completedtasks INTEGER NOT NULL DEFAULT 0"
+        )
+    conn.exec_driver_sql(
+        "UPDATE Users SET "
+        "opentasks = (SELECT count(*) FROM Tasks "
+        "WHERE Tasks.userid = Users.id AND Tasks.complete = 0), "
+        "completedtasks = (SELECT count(*) FROM Tasks "
+        "WHERE Tasks.userid = Users.id AND Tasks.complete <> 0)"
+    )
+    conn.exec_driver_sql(
+        "UPDATE TaskLists SET "
+        "opentasks = (SELECT count(*) FROM TasksToTaskLists "
+        "JOIN Tasks ON Tasks.id = TasksToTaskLists.taskid "
+        "WHERE TasksToTaskLists.tlid = TaskLists.id AND Tasks.complete = 0), "
+        "completedtasks = (SELECT count(*) FROM TasksToTaskLists "
+        "JOIN Tasks ON Tasks.id = TasksToTaskLists.taskid "
+        "WHERE TasksToTaskLists.tlid = TaskLists.id AND Tasks.complete <> 0)"
+    )
+
+
+@migration(10, "triggers that keep the task counters exact", oncreate=True)
+def addtaskcountertriggers(conn: Connection) -> None:
+    # triggers run inside the statement that changes the rows, so the counters
+    # move in the same transaction no matter which code path wrote (ORM flushes,
+    # bulk inserts, set-based deletes, ON DELETE CASCADE)
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_task_insert AFTER INSERT ON Tasks BEGIN "
+        "UPDATE Users SET opentasks = opentasks + (new.complete = 0), "
+        "completedtasks = completedtasks + (new.complete <> 0) WHERE id = new.userid; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_task_update "
+        "AFTER UPDATE OF complete, userid ON Tasks "
+        "WHEN old.complete IS NOT new.complete OR old.userid IS NOT new.userid BEGIN "
+        "UPDATE Users SET opentasks = opentasks - (old.complete = 0), "
+        "completedtasks = completedtasks - (old.complete <> 0) WHERE id = old.userid; "
+        "UPDATE Users SET opentasks = opentasks + (new.complete = 0), "
+        "completedtasks = completedtasks + (new.complete <> 0) WHERE id = new.userid; "
+        "UPDATE TaskLists SET "
+        "opentasks = opentasks - (old.complete = 0) + (new.complete = 0), "
+        "completedtasks = completedtasks - (old.complete <> 0) + (new.complete <> 0) "
+        "WHERE id IN (SELECT tlid FROM TasksToTaskLists WHERE taskid = new.id); "
+        "END"
+    )
+    # take the task out of its lists while it still exists, so the membership
+    # trigger below can see whether it was complete (ON DELETE CASCADE would only
+    # remove the memberships after the task is gone)
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_task_delete_memberships "
+        "BEFORE DELETE ON Tasks BEGIN "
+        "DELETE FROM TasksToTaskLists WHERE taskid = old.id; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_task_delete AFTER DELETE ON Tasks BEGIN "
+        "UPDATE Users SET opentasks = opentasks - (old.complete = 0), "
+        "completedtasks = completedtasks - (old.complete <> 0) WHERE id = old.userid; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_membership_insert "
+        "AFTER INSERT ON TasksToTaskLists BEGIN "
+        "UPDATE TaskLists SET opentasks = opentasks + task.open, "
+        "completedtasks = completedtasks + task.done "
+        "FROM (SELECT complete = 0 AS open, complete <> 0 AS done FROM Tasks "
+        "WHERE id = new.taskid) AS task "
+        "WHERE TaskLists.id = new.tlid; "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS taskcounters_membership_delete "
+        "AFTER DELETE ON TasksToTaskLists BEGIN "
+        "UPDATE TaskLists SET opentasks = opentasks - task.open, "
+        "completedtasks = completedtasks - task.done "
+        "FROM (SELECT complete = 0 AS open, complete <> 0 AS done FROM Tasks "
+        "WHERE id = old.taskid) AS task "
+        "WHERE TaskLists.id = old.tlid; "
+        "END"
+    )
+
+
+@migration(11, "completion times and the archive table")
+def addarchive(conn: Connection) -> None:
+    conn.exec_driver_sql("ALTER TABLE Tasks ADD COLUMN completedat DATETIME")
+    # nobody recorded when these were finished -> count from their last change
+    conn.exec_driver_sql(
+        "UPDATE Tasks SET completedat = coalesce(updated_at, CURRENT_TIMESTAMP) "
+        "WHERE complete = 1"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_done_completedat "
+        "ON Tasks (completedat) WHERE complete = 1"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS ArchivedTasks ("
+        "id INTEGER NOT NULL PRIMARY KEY, "
+        "taskid INTEGER NOT NULL, "
+        "userid INTEGER NOT NULL REFERENCES Users (id), "
+        "name VARCHAR NOT NULL, "
+        "starred BOOLEAN NOT NULL, "
+        "progressnotes VARCHAR, "
+        "duedate INTEGER, "
+        "duetime TIME, "
+        "priority INTEGER, "
+        "notes VARCHAR, "
+        "completedat DATETIME NOT NULL, "
+        "archivedat DATETIME NOT NULL, "
+        "tasklistids VARCHAR NOT NULL, "
+        "subtasks VARCHAR NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_archivedtasks_userid_completedat "
+        "ON ArchivedTasks (userid, completedat)"
+    )
+
+
+@migration(12, "full text search index over archived tasks", oncreate=True)
+def addarchivesearch(conn: Connection) -> None:
+    # same columns as TaskSearch so the same queries work on both
+    # (rowid = ArchivedTasks.id). Archived rows never change, only come and go
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ArchiveSearch USING fts5("
+        "name, notes, progressnotes, subtasks, owner, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS archivesearch_insert "
+        "AFTER INSERT ON ArchivedTasks BEGIN "
+        "INSERT INTO ArchiveSearch (rowid, name, notes, progressnotes, subtasks, owner) "
+        "VALUES (new.id, new.name, new.notes, new.progressnotes, "
+        "(SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each(new.subtasks)), "
+        "'u' || new.userid); "
+        "END"
+    )
+    conn.exec_driver_sql(
+        "CREATE TRIGGER IF NOT EXISTS archivesearch_delete "
+        "AFTER DELETE ON ArchivedTasks BEGIN "
+        "DELETE FROM ArchiveSearch WHERE rowid = old.id; "
+        "END"
+    )
+
+
+@migration(13, "server side session table", oncreate=True)
+def addsessions(conn: Connection) -> None:
+    # session id -> the serialized session and when it expires (epoch seconds),
+    # see serversession.py
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS Sessions ("
+        "id VARCHAR NOT NULL PRIMARY KEY, "
+        "data VARCHAR NOT NULL, "
+        "expires FLOAT NOT NULL)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sessions_expires ON Sessions (expires)"
+    )
+
+
+@migration(14, "unique task list names per user and subtask names per task")
+def adduniquenames(conn: Connection) -> None:
+    # names used to only be checked by the forms -> keep the first of each set of
+    # duplicates as it is and tell the others apart by their id. Renamed rows get
+    # a new change number so clients resync them
+    for table, owner in (("TaskLists", "userid"), ("Subtasks", "taskid")):
+        conn.exec_driver_sql(
+            f"UPDATE {table} SET "
+            f"name = name || ' (' || id || ')', "
+            f"changeseq = (SELECT Users.changeseq + 1 FROM Users "
+            f"WHERE Users.id = {table}.userid), "
+            f"updated_at = CURRENT_TIMESTAMP "
+            f"WHERE id NOT IN (SELECT min(id) FROM {table} GROUP BY {owner}, name)"
+        )
+        conn.exec_driver_sql(
+            f"UPDATE Users SET changeseq = changeseq + 1 WHERE EXISTS ("
+            f"SELECT 1 FROM {table} WHERE {table}.userid = Users.id "
+            f"AND {table}.changeseq > Users.changeseq)"
+        )
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_tasklists_userid_name "
+        "ON TaskLists (userid, name)"
+    )
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_subtasks_taskid_name "
+        "ON Subtasks (taskid, name)"
+    )
+
+
+@migration(15, "tombstone retention")
+def addtombstoneretention(conn: Connection) -> None:
+    conn.exec_driver_sql(
+        "ALTER TABLE Users ADD COLUMN prunedseq INTEGER NOT NULL DEFAULT 0"
+    )
+    # prune-tombstones deletes by age
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_tombstones_deleted_at ON Tombstones (deleted_at)"
+    )
+
+
+@migration(16, "AI job table", oncreate=True)
+def addaijobs(conn: Connection) -> None:
+    # AI job id -> its owner, state and result (JSON), see aijobs.py. Times are
+    # epoch seconds, reported is set once a failed job's error was shown
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS AIJobs ("
+        "id VARCHAR NOT NULL PRIMARY KEY, "
+        "userid INTEGER NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "result VARCHAR, "
+        "error VARCHAR, "
+        "created FLOAT NOT NULL, "
+        "finished FLOAT, "
+        "reported BOOLEAN NOT NULL DEFAULT 0)"
+    )
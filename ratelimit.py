@@ -0,0 +1,108 @@
+"""In-memory admission control for the login and registration forms.
+
+Every login attempt that gets as far as the password check costs a full argon2
+verify, so a burst of guesses is a CPU denial of service. RateLimiter keeps a
+token bucket per key (a username or a client address): each attempt takes a
+token, tokens come back at a steady rate, and once a key runs dry it is
+rejected before any hashing happens. Repeated failures on a key also lock it
+out for a time that doubles with every further failure.
+"""
+
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+
+
+class Bucket:
+    def __init__(self, tokens: float, now: float):
+        self.tokens: float = tokens
+        self.updated: float = now
+        self.failures: int = 0
+        self.lockeduntil: float = 0.0
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        burst: int,
+        rate: float,
+        lockoutafter: int = 5,
+        lockoutbase: float = 1.0,
+        lockoutmax: float = 900.0,
+        maxkeys: int = 100_000,
+    ):
+        # a bucket that can't hold a whole token lets nothing through, and the wait
+        # for the next token is divided by rate
+        if burst < 1:
+            raise ValueError(f"burst must be at least 1, not {burst}")
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, not {rate}")
+        # a key can make burst attempts at once, then rate attempts per second
+        self.burst: int = burst
+        self.rate: float = rate
+        # after lockoutafter failures in a row a key is locked out for
+        # lockoutbase seconds, doubling with each further failure up to lockoutmax
+        self.lockoutafter: int = lockoutafter
+        self.lockoutbase: float = lockoutbase
+        self.lockoutmax: float = lockoutmax
+        # least recently seen keys are forgotten first, so a flood of made up
+        # usernames can't grow this without bound
+        self.maxkeys: int = maxkeys
+        self.enabled: bool = True
+        self.buckets: OrderedDict[str, Bucket] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def bucket(self, key: str, now: float) -> Bucket:
+        """The key's bucket with its tokens refilled up to now (lock held)"""
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(self.burst, now)
+            while len(self.buckets) > self.maxkeys:
+                self.buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(
+                self.burst, bucket.tokens + (now - bucket.updated) * self.rate
+            )
+            bucket.updated = now
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, *keys: str) -> float:
+        """Take a token from every key's bucket. Returns 0 if the attempt may go
+        ahead, otherwise the number of seconds to wait (and nothing is taken)."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            buckets = [self.bucket(key, now) for key in keys]
+            wait = 0.0
+            for bucket in buckets:
+                if bucket.lockeduntil > now:
+                    wait = max(wait, bucket.lockeduntil - now)
+                elif bucket.tokens < 1:
+                    wait = max(wait, (1 - bucket.tokens) / self.rate)
+            if wait:
+                return wait
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return 0.0
+
+    def failure(self, *keys: str) -> None:
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                bucket = self.bucket(key, now)
+                bucket.failures += 1
+                over = bucket.failures - self.lockoutafter
+                if over >= 0:
+                    bucket.lockeduntil = now + min(
+                        self.lockoutbase * 2 ** min(over, 32), self.lockoutmax
+                    )
+
+    def success(self, *keys: str) -> None:
+        with self.lock:
+            for key in keys:
+                if (bucket := self.buckets.get(key)) is not None:
+                    bucket.failures = 0
+                    bucket.lockeduntil = 0.0
@@ -0,0 +1,211 @@
+"""Server side sessions.
+
+Flask's default session is the whole session dict, serialized and signed into a
+cookie. The anonymous user's tasks live in the session, so that cookie grows with
+every task and is sent (and its signature checked) on every request. With
+ServerSessionInterface the cookie only holds a random session id and the data
+lives in a SessionStore on the server:
+
+- MemoryStore keeps sessions in this process (one process only, lost on restart)
+- SQLiteStore keeps them in the Sessions table of the app's database
+
+Sessions expire permanent_session_lifetime after they were last saved. Requests
+for static files never open a session. Logging in or out should call
+regenerate(), so a session id somebody learned or planted beforehand is useless
+afterwards.
+"""
+
+from __future__ import annotations
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from flask import Flask, Request, Response
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+class ServerSession(SecureCookieSession):
+    """The session dict (with the same accessed/modified tracking as the cookie
+    session) plus the id it is stored under"""
+
+    def __init__(self, sid: str, data: dict | None = None, expires: float = 0.0):
+        super().__init__(data)
+        self.sid: str = sid
+        # when the stored copy runs out (0 -> nothing stored yet)
+        self.expires: float = expires
+
+
+class SessionStore(ABC):
+    """Where the session data lives, keyed by session id. Data is a string, the
+    interface takes care of serializing the session"""
+
+    @abstractmethod
+    def load(self, sid: str) -> tuple[str, float] | None:
+        """The session's data and expiry time, None if missing or expired"""
+
+    @abstractmethod
+    def save(self, sid: str, data: str, expires: float) -> None: ...
+
+    @abstractmethod
+    def delete(self, sid: str) -> None: ...
+
+    @abstractmethod
+    def cleanup(self) -> int:
+        """Delete every expired session, returns how many there were"""
+
+
+class MemoryStore(SessionStore):
+    def __init__(self):
+        self.sessions: dict[str, tuple[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def load(self, sid: str) -> tuple[str, float] | None:
+        with self.lock:
+            entry = self.sessions.get(sid)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry
+
+    def save(self, sid: str, data: str, expires: float) -> None:
+        with self.lock:
+            self.sessions[sid] = (data, expires)
+
+    def delete(self, sid: str) -> None:
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def cleanup(self) -> int:
+        now = time.time()
+        with self.lock:
+            expired = [
+                sid for sid, (_, expires) in self.sessions.items() if expires <= now
+            ]
+            for sid in expired:
+                del self.sessions[sid]
+        return len(expired)
+
+
+class SQLiteStore(SessionStore):
+    """Sessions in the Sessions table (created by migrations.py), so every worker
+    process sharing the database sees the same sessions"""
+
+    def __init__(self, engine: Engine):
+        self.engine: Engine = engine
+
+    def load(self, sid: str) -> tuple[str, float] | None:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT data, expires FROM Sessions "
+                    "WHERE id = :id AND expires > :now"
+                ),
+                {"id": sid, "now": time.time()},
+            ).first()
+        return None if row is None else (row.data, row.expires)
+
+    def save(self, sid: str, data: str, expires: float) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO Sessions (id, data, expires) "
+                    "VALUES (:id, :data, :expires) "
+                    "ON CONFLICT (id) DO UPDATE SET data = excluded.data, "
+                    "expires = excluded.expires"
+                ),
+                {"id": sid, "data": data, "expires": expires},
+            )
+
+    def delete(self, sid: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM Sessions WHERE id = :id"), {"id": sid})
+
+    def cleanup(self) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(
+                text("DELETE FROM Sessions WHERE expires <= :now"),
+                {"now": time.time()},
+            ).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store: SessionStore, cleanupinterval: float = 3600.0):
+        self.store: SessionStore = store
+        # same serializer as the cookie session, so tuples, dates, ... survive
+        self.serializer = TaggedJSONSerializer()
+        # expired sessions are swept out every cleanupinterval seconds, by
+        # whichever request happens to save a session then
+        self.cleanupinterval: float = cleanupinterval
+        self.nextcleanup: float = time.time() + cleanupinterval
+
+    def lifetime(self, app: Flask) -> float:
+        return app.permanent_session_lifetime.total_seconds()
+
+    def regenerate(self, session: ServerSession) -> None:
+        """Move the session's data to a new id and forget the old one (it is saved
+        and the new id sent to the client at the end of the request)"""
+        if session.expires:
+            self.store.delete(session.sid)
+        session.sid = secrets.token_urlsafe(32)
+        session.expires = 0.0
+        session.modified = True
+
+    def open_session(self, app: Flask, request: Request) -> ServerSession | None:
+        static = app.static_url_path
+        if static and request.path.startswith(f"{static}/"):
+            # -> a null session, static files never touch the session
+            return None
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and (stored := self.store.load(sid)) is not None:
+            data, expires = stored
+            return ServerSession(sid, self.serializer.loads(data), expires)
+        # unknown or expired ids are never reused, the client gets a new one
+        return ServerSession(secrets.token_urlsafe(32))
+
+    def save_session(
+        self, app: Flask, session: ServerSession, response: Response
+    ) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # an emptied session is deleted, an empty new one is never stored
+        if not session:
+            if session.modified:
+                if session.expires:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        lifetime = self.lifetime(app)
+        # unchanged sessions are only written again once half their lifetime is
+        # gone, so an active session keeps getting extended without a write on
+        # every request
+        if session.modified or session.expires - now < lifetime / 2:
+            self.store.save(
+                session.sid, self.serializer.dumps(dict(session)), now + lifetime
+            )
+            if now >= self.nextcleanup:
+                self.nextcleanup = now + self.cleanupinterval
+                self.store.cleanup()
+
+        # the id never changes -> the cookie only has to be sent for a new session
+        # (or to move a permanent cookie's expiry along)
+        if session.expires and not session.permanent:
+            return
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
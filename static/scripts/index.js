@@ -368,11 +368,7 @@ async function sendAudioToFlask(audioBlob) {
     try {
         const formData = new FormData();
         formData.append("file", audioBlob, "audio.webm");
-        const response = await fetch("/speech_for_gpt", {
-            method: "POST",
-            body: formData,
-        });
-        const data = await validatejson(response);
+        const data = await runAIJob(formData);
         if (data.status === "error") {
             reloadflashedmessages();
         }
@@ -385,7 +381,7 @@ async function sendAudioToFlask(audioBlob) {
                     id: task.id,
                     name: task.name,
                     complete: false,
-                    duedate: task.duedate * 1000,
+                    duedate: task.duedate,
                     starred: task.starred,
                     notes: "",
                     tasklistnames: task.tasklistnames.split(","),
@@ -472,6 +468,18 @@ async function saveTaskFromDetailsPanel() {
     oldTaskCard.parentNode.removeChild(oldTaskCard);
     appendTask(updatedTask);
 }
+let csrfToken = null;
+let csrfTokenExpires = 0;
+async function getCSRFToken() {
+    if (csrfToken === null || Date.now() > csrfTokenExpires - 60000) {
+        const response = await fetch("/api/v1/csrf/");
+        const token = (await validatejson(response));
+        csrfToken = token.token;
+        csrfTokenExpires =
+            token.expiresin === null ? Infinity : Date.now() + token.expiresin * 1000;
+    }
+    return csrfToken;
+}
 async function postTask() {
     const taskTitleInput = (document.getElementById("task-title-input"));
     if (taskTitleInput.value !== "") {
@@ -487,10 +495,7 @@ async function postTask() {
         urlsps.append("duedate", `${taskDuedate ? taskDuedate : new Date().getTime()}`);
         urlsps.append("complete", "false");
         urlsps.append("starred", "false");
-        const csrfinpele = document.createElement("div");
-        csrfinpele.innerHTML = await (await fetch("/api/v0/getcsrftok/create/task")).text();
-        console.log(csrfinpele.innerHTML);
-        urlsps.append("csrf_token", csrfinpele.firstElementChild.getAttribute("value"));
+        urlsps.append("csrf_token", await getCSRFToken());
         urlsps.append("tasklistids", taskListInput.value);
         taskTitleInput.value = "";
         taskDuedateInput.value = "";
@@ -510,6 +515,7 @@ async function postTask() {
             appendTask(servertask);
         }
         catch (error) {
+            csrfToken = null;
             reloadflashedmessages();
             console.error(error);
         }
@@ -965,7 +971,7 @@ async function askChatGPT() {
                     id: task.id,
                     name: task.name,
                     complete: false,
-                    duedate: task.duedate * 1000,
+                    duedate: task.duedate,
                     starred: task.starred,
                     notes: "",
                     tasklistnames: task.tasklistnames.split(","),
@@ -980,23 +986,28 @@ async function askChatGPT() {
 }
 async function getChatGPTResponse(question) {
     console.log("Trying ChatGPT");
-    const params = new URLSearchParams({
-        question: question,
-    });
+    const formData = new FormData();
+    formData.append("question", question);
     try {
-        const response = await fetch(`/askChatGPT?${params.toString()}`, {
-            method: "GET",
-            headers: {
-                "Content-Type": "application/json",
-            },
-        });
-        const data = await validatejson(response);
-        return data;
+        return await runAIJob(formData);
     }
     catch (error) {
         console.error("Error fetching data:", error);
     }
 }
+async function runAIJob(body) {
+    const submitted = await fetch("/api/v1/ai/jobs/", {
+        method: "POST",
+        body: body,
+    });
+    let job = await validatejson(submitted);
+    while (job.status !== "done" && job.status !== "failed") {
+        await new Promise((resolve) => setTimeout(resolve, 500));
+        const polled = await fetch(`/api/v1/ai/jobs/${job.id}/`);
+        job = await validatejson(polled);
+    }
+    return job.result ?? { status: "error", GPTResponse: null };
+}
 function validatejson(response) {
     if (response.ok) {
         return response.json();
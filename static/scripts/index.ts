@@ -38,6 +38,13 @@ namespace gpt {
     status: string;
     GPTResponse: ChatGPTResponse;
   }
+
+  export interface Job {
+    id: string;
+    status: string;
+    result: ServerResponse | null;
+    error: string | null;
+  }
 }
 
 interface Task {
@@ -579,11 +586,7 @@ async function sendAudioToFlask(audioBlob: Blob) {
     const formData: FormData = new FormData();
     formData.append("file", audioBlob, "audio.webm");
 
-    const response = await fetch("/speech_for_gpt", {
-      method: "POST",
-      body: formData,
-    });
-    const data = <gpt.ServerResponse>await validatejson(response);
+    const data = await runAIJob(formData);
 
     if (data.status === "error") {
       reloadflashedmessages();
@@ -596,7 +599,7 @@ async function sendAudioToFlask(audioBlob: Blob) {
           id: task.id,
           name: task.name,
           complete: false,
-          duedate: task.duedate * 1000,
+          duedate: task.duedate,
           starred: task.starred,
           notes: "",
           tasklistnames: task.tasklistnames.split(","),
@@ -712,6 +715,24 @@ async function saveTaskFromDetailsPanel() {
   appendTask(updatedTask);
 }
 
+// the CSRF token for form posts, reused until it is about to expire
+let csrfToken: string | null = null;
+let csrfTokenExpires: number = 0;
+
+async function getCSRFToken(): Promise<string> {
+  // fetch a new one a minute early so it can't expire on the way to the server
+  if (csrfToken === null || Date.now() > csrfTokenExpires - 60000) {
+    const response = await fetch("/api/v1/csrf/");
+    const token = <{ token: string; expiresin: number | null }>(
+      await validatejson(response)
+    );
+    csrfToken = token.token;
+    csrfTokenExpires =
+      token.expiresin === null ? Infinity : Date.now() + token.expiresin * 1000;
+  }
+  return csrfToken;
+}
+
 async function postTask() {
   const taskTitleInput = <HTMLInputElement>(
     document.getElementById("task-title-input")
@@ -745,15 +766,7 @@ async function postTask() {
     );
     urlsps.append("complete", "false");
     urlsps.append("starred", "false");
-    const csrfinpele: HTMLDivElement = document.createElement("div");
-    csrfinpele.innerHTML = await (
-      await fetch("/api/v0/getcsrftok/create/task")
-    ).text();
-    console.log(csrfinpele.innerHTML);
-    urlsps.append(
-      "csrf_token",
-      csrfinpele.firstElementChild.getAttribute("value")
-    );
+    urlsps.append("csrf_token", await getCSRFToken());
     urlsps.append("tasklistids", taskListInput.value);
 
     taskTitleInput.value = "";
@@ -776,6 +789,8 @@ async function postTask() {
       console.log("task created: " + JSON.stringify(response));
       appendTask(servertask);
     } catch (error) {
+      // the token may have been rotated with the session -> get a new one next time
+      csrfToken = null;
       reloadflashedmessages();
       console.error(error);
     }
@@ -1415,7 +1430,7 @@ async function askChatGPT() {
           id: task.id,
           name: task.name,
           complete: false,
-          duedate: task.duedate * 1000,
+          duedate: task.duedate,
           starred: task.starred,
           notes: "",
           tasklistnames: task.tasklistnames.split(","),
@@ -1433,25 +1448,32 @@ async function askChatGPT() {
 async function getChatGPTResponse(question: string) {
   console.log("Trying ChatGPT");
 
-  const params = new URLSearchParams({
-    question: question,
-  });
+  const formData: FormData = new FormData();
+  formData.append("question", question);
 
   try {
-    const response = await fetch(`/askChatGPT?${params.toString()}`, {
-      method: "GET",
-      headers: {
-        "Content-Type": "application/json",
-      },
-    });
-
-    const data = <gpt.ServerResponse>await validatejson(response);
-    return data;
+    return await runAIJob(formData);
   } catch (error) {
     console.error("Error fetching data:", error);
   }
 }
 
+// submit an AI job (a question or a recording) and poll it until it is done or
+// failed, so the AI round trip doesn't hold up a server thread
+async function runAIJob(body: FormData): Promise<gpt.ServerResponse> {
+  const submitted = await fetch("/api/v1/ai/jobs/", {
+    method: "POST",
+    body: body,
+  });
+  let job = <gpt.Job>await validatejson(submitted);
+  while (job.status !== "done" && job.status !== "failed") {
+    await new Promise((resolve) => setTimeout(resolve, 500));
+    const polled = await fetch(`/api/v1/ai/jobs/${job.id}/`);
+    job = <gpt.Job>await validatejson(polled);
+  }
+  return job.result ?? { status: "error", GPTResponse: null };
+}
+
 function validatejson(response: Response) {
   if (response.ok) {
     return response.json();
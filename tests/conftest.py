@@ -0,0 +1,52 @@
+import itertools
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the app's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py configures itself from the environment when it is imported -> point it
+# at a throwaway database and keep everything in this process
+testdir = tempfile.mkdtemp(prefix="todo-tests-")
+os.environ.setdefault("TODO_DATABASE", os.path.join(testdir, "todo.sqlite3"))
+# the cheapest argon2 parameters there are, every test user hashes a password
+hashparams = os.path.join(testdir, "hashparams.json")
+with open(hashparams, "w") as fout:
+    json.dump({"time_cost": 1, "memory_cost": 8, "parallelism": 1}, fout)
+os.environ.setdefault("TODO_HASH_PARAMS", hashparams)
+os.environ.setdefault("TODO_HASH_WORKERS", "0")
+os.environ.setdefault("TODO_AI_BACKEND", "fake")
+# every test client logs in from the same address
+os.environ.setdefault("TODO_LOGIN_BURST", "1000")
+
+usernumbers = itertools.count()
+
+
+@pytest.fixture
+def user():
+    """A fresh user -> (id, username, password)"""
+    from app import app, db, User
+
+    username, password = f"testuser{next(usernumbers)}", "testpassword"
+    with app.app_context():
+        row = User(username, password)
+        db.session.add(row)
+        db.session.commit()
+        return row.id, username, password
+
+
+@pytest.fixture
+def client(user):
+    """A test client logged in as user"""
+    from app import app
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    client = app.test_client()
+    _, username, password = user
+    response = client.post("/login/", data={"username": username, "password": password})
+    assert response.status_code == 302
+    return client
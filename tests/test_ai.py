@@ -0,0 +1,186 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+import aijobs
+import chat_gpt
+from app import app, db, Task, Subtask, TaskList, addGPTResponse, gptcontextnames
+from app import jobcontext, jobresult
+
+
+def response(*subtasks: str) -> chat_gpt.Chat_GPT_Response:
+    """One list with one task, and subtasks of that task by name"""
+    return chat_gpt.Chat_GPT_Response(
+        tasklists=[chat_gpt.TaskList(name="groceries")],
+        numtasklists=1,
+        tasks=[
+            chat_gpt.Task(
+                name="shopping",
+                starred=False,
+                duedate="01/01/2030,09:00",
+                priority=3,
+                tasklistnames=["groceries"],
+            )
+        ],
+        numtasks=1,
+        subtasks=[
+            chat_gpt.SubTask(name=name, priority=1, parenttaskname="shopping")
+            for name in subtasks
+        ],
+        numsubtasks=len(subtasks),
+        error_message="None",
+    )
+
+
+def subtasknames(taskid: int) -> list[str]:
+    return sorted(subtask.name for subtask in Subtask.query.filter_by(taskid=taskid))
+
+
+def test_repeated_responses_reuse_lists_and_skip_duplicate_subtasks(user):
+    userid, _, _ = user
+    with app.app_context():
+        first = response("milk", "eggs", "milk")
+        addGPTResponse(first, userid)
+        second = response("milk", "bread", "ghost")
+        second.subtasks[2].parenttaskname = "no such task"
+        addGPTResponse(second, userid)
+
+        assert db.session.query(TaskList).filter_by(userid=userid).count() == 1
+        assert first.tasklists[0].id == second.tasklists[0].id
+        # the second response's task is a task of its own, with its own subtasks
+        assert first.tasks[0].id != second.tasks[0].id
+        assert subtasknames(first.tasks[0].id) == ["eggs", "milk"]
+        assert subtasknames(second.tasks[0].id) == ["bread", "milk"]
+        # a subtask of a task that doesn't exist is dropped
+        assert second.subtasks[2].id == -1
+        assert db.session.get(Subtask, second.subtasks[0].id).taskid == (
+            second.tasks[0].id
+        )
+
+
+def test_a_subtask_of_an_existing_task_is_not_added_twice(user):
+    userid, _, _ = user
+    with app.app_context():
+        addGPTResponse(response("milk"), userid)
+        again = response("milk")
+        again.tasks = []
+        addGPTResponse(again, userid)
+        (task,) = Task.query.filter_by(userid=userid)
+        assert [subtask.name for subtask in task.subtasks] == ["milk"]
+        assert again.subtasks[0].id == task.subtasks[0].id
+
+
+def test_prompt_names_stop_at_the_byte_budget(user):
+    userid, _, _ = user
+    with app.app_context():
+        db.session.add(TaskList(name="errands", userid=userid))
+        db.session.add_all(
+            Task(name=f"{i:03d} " + "x" * 96, userid=userid) for i in range(299)
+        )
+        db.session.commit()
+        # the most recently changed task comes first
+        db.session.add(Task(name="newest", userid=userid))
+        db.session.commit()
+        names = gptcontextnames(userid)
+
+    assert names.taskLists == ["errands"]
+    assert (names.tasklistcount, names.taskcount) == (1, 300)
+    # 101 bytes a task with its comma, after the list name
+    budget = chat_gpt.TEMPLATE.maxcontextbytes - len("errands,")
+    assert names.tasks[0] == "newest"
+    assert len(names.tasks) == 1 + (budget - len("newest,")) // 101
+    messages = chat_gpt.TEMPLATE.render("hi", names, datetime.now())
+    assert f"(and {300 - len(names.tasks)} more)" in messages[0]["content"]
+
+
+class BrokenLLM(aijobs.LLMBackend):
+    def ask(self, question, names):
+        raise RuntimeError("no network")
+
+
+class StalledLLM(aijobs.FakeLLM):
+    """Answers once released"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def ask(self, question, names):
+        self.release.wait(10)
+        return super().ask(question, names)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Swaps the app's AI job queue for one asking the given LLM (with the app's
+    job store), shut down after the test"""
+    queues: list[aijobs.AIJobQueue] = []
+
+    def make(llm: aijobs.LLMBackend) -> aijobs.AIJobQueue:
+        with app.app_context():
+            store = aijobs.SQLiteJobStore(db.engine)
+        jobqueue = aijobs.AIJobQueue(
+            llm,
+            aijobs.FakeTranscriber(),
+            jobcontext,
+            jobresult,
+            workers=1,
+            queuelimit=1,
+            store=store,
+            pollinterval=0.01,
+        )
+        monkeypatch.setattr("app.aiqueue", jobqueue)
+        queues.append(jobqueue)
+        return jobqueue
+
+    yield make
+    for jobqueue in queues:
+        jobqueue.shutdown()
+
+
+def test_a_job_can_be_polled_from_another_process(user, queue):
+    userid, _, _ = user
+    llm = StalledLLM()
+    running = queue(llm)
+    # a second queue on the same database stands in for another worker process
+    other = aijobs.AIJobQueue(
+        aijobs.FakeLLM(),
+        aijobs.FakeTranscriber(),
+        jobcontext,
+        jobresult,
+        workers=1,
+        queuelimit=0,
+        store=running.store,
+        pollinterval=0.01,
+    )
+    job = running.submit(userid, "water the plants")
+    assert other.get(job.id, userid + 1) is None
+    assert other.wait(job.id, userid, 0.05).status in ("queued", "asking")
+    llm.release.set()
+    done = other.wait(job.id, userid, 5)
+    assert done.status == "done"
+    assert done.result["GPTResponse"]["tasks"][0]["name"] == "water the plants"
+    other.shutdown()
+
+
+def test_a_failed_job_flashes_its_error_once(client, queue):
+    queue(BrokenLLM())
+    jobid = client.post("/api/v1/ai/jobs/", data={"question": "hi"}).json["id"]
+    for _ in range(3):
+        job = client.get(f"/api/v1/ai/jobs/{jobid}/?wait=5").json
+        assert job["status"] == "failed"
+    flashed = client.get("/api/v0/getflashedmessages/").json
+    assert flashed == [f"ChatGPT Error: {job['error']}"]
+
+
+def test_the_blocking_endpoint_gives_up_with_a_504(client, queue, monkeypatch):
+    llm = StalledLLM()
+    queue(llm)
+    monkeypatch.setattr("app.AI_REQUEST_TIMEOUT", 0.05)
+    response = client.get("/askChatGPT/", query_string={"question": "slow"})
+    assert response.status_code == 504
+    # the job carries on and can still be fetched
+    llm.release.set()
+    job = client.get(response.headers["Location"] + "?wait=5").json
+    assert job["status"] == "done"
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db, ArchivedTask, Subtask, Task, TaskList, User, archivetasks
+
+
+def addfinishedtask(userid: int, name: str, *tasklistnames: str) -> int:
+    """A task completed two days ago, with two subtasks -> its id"""
+    task = Task(name=name, userid=userid, complete=True, priority=3)
+    task.tasklists = TaskList.query.filter(
+        TaskList.userid == userid, TaskList.name.in_(tasklistnames)
+    ).all()
+    task.subtasks = [
+        Subtask(name=f"{name} step {i}", complete=i == 0, priority=i) for i in range(2)
+    ]
+    db.session.add(task)
+    db.session.flush()
+    task.completedat = datetime.utcnow() - timedelta(days=2)
+    db.session.commit()
+    return task.id
+
+
+@pytest.fixture
+def archived(user) -> int:
+    """user's finished task in two lists, archived -> the archived task's id"""
+    userid, _, _ = user
+    with app.app_context():
+        db.session.add_all(
+            [TaskList(name="home", userid=userid), TaskList(name="work", userid=userid)]
+        )
+        db.session.commit()
+        taskid = addfinishedtask(userid, "file taxes", "home", "work")
+        assert archivetasks(datetime.utcnow() - timedelta(days=1)) == 1
+        assert db.session.get(Task, taskid) is None
+    return taskid
+
+
+def test_archiving_moves_a_task_out_and_restore_brings_it_back(client, archived):
+    assert client.get("/getUserTasks/").json["tasks"] == []
+    (entry,) = client.get("/api/v1/archive/").json["tasks"]
+    assert (entry["taskid"], entry["name"]) == (archived, "file taxes")
+
+    response = client.post(f"/api/v1/archive/{entry['id']}/restore/")
+    assert response.status_code == 201
+    restored = response.json
+    assert restored["complete"] is True
+    assert sorted(restored["tasklistnames"]) == ["home", "work"]
+    with app.app_context():
+        task = db.session.get(Task, restored["id"])
+        assert sorted((s.name, s.complete, s.priority) for s in task.subtasks) == [
+            ("file taxes step 0", True, 0),
+            ("file taxes step 1", False, 1),
+        ]
+    assert client.get("/api/v1/archive/").json["tasks"] == []
+    # it's a task again, and doesn't count as finished long ago
+    assert [task["name"] for task in client.get("/getUserTasks/").json["tasks"]] == [
+        "file taxes"
+    ]
+    with app.app_context():
+        assert archivetasks(datetime.utcnow() - timedelta(days=1)) == 0
+
+
+def test_the_archive_is_only_searched_and_restored_by_its_owner(client, user, archived):
+    _, username, _ = user
+    with app.app_context():
+        other = User(f"{username}other", "otherpassword")
+        db.session.add(other)
+        db.session.commit()
+        addfinishedtask(other.id, "file taxes for others")
+        assert archivetasks(datetime.utcnow() - timedelta(days=1)) == 1
+        (theirs,) = ArchivedTask.query.filter_by(userid=other.id)
+        theirid = theirs.id
+
+    found = client.get("/api/v1/archive/search/?q=taxes").json["tasks"]
+    assert [task["name"] for task in found] == ["file taxes"]
+    response = client.get("/api/v1/archive/search/?q=others")
+    assert response.json["tasks"] == []
+    assert client.post(f"/api/v1/archive/{theirid}/restore/").status_code == 404
+
+
+def test_an_archive_search_offset_too_big_for_sqlite_is_rejected(client):
+    query = {"q": "taxes", "offset": 2**64}
+    assert client.get("/api/v1/archive/search/", query_string=query).status_code == 400
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import event
+
+from app import app, db, Task, TaskList, TasksToTaskLists
+
+
+@pytest.fixture
+def taskids(user) -> list[int]:
+    userid, _, _ = user
+    with app.app_context():
+        tasks = [Task(name=f"task {i}", userid=userid) for i in range(30)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        return [task.id for task in tasks]
+
+
+def statements(send) -> tuple[object, list[tuple[str, bool]]]:
+    """send()'s result and the (statement, executemany) pairs it ran"""
+    ran = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        ran.append((statement, executemany))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        return send(), ran
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_a_new_list_attaches_its_tasks_in_bulk(client, user, taskids):
+    userid, _, _ = user
+    # a repeated id is only attached once
+    form = {"name": "everything", "taskids": [*map(str, taskids), str(taskids[0])]}
+    response, ran = statements(lambda: client.post("/tasklistform/", data=form))
+    assert response.status_code == 302
+
+    loads = [s for s, _ in ran if s.startswith("SELECT") and 'FROM "Tasks"' in s]
+    assert len(loads) == 1 and " IN (" in loads[0]
+    inserts = [(s, many) for s, many in ran if 'INSERT INTO "TasksToTaskLists"' in s]
+    assert len(inserts) == 1 and inserts[0][1]
+    with app.app_context():
+        tasklist = TaskList.query.filter_by(userid=userid, name="everything").one()
+        members = db.session.scalars(
+            db.select(TasksToTaskLists.c.taskid).where(
+                TasksToTaskLists.c.tlid == tasklist.id
+            )
+        ).all()
+        assert sorted(members) == taskids
+
+
+@pytest.mark.parametrize("badid", ["0", str(2**64), "not a number"])
+def test_a_task_that_isnt_yours_attaches_nothing(client, user, taskids, badid):
+    userid, _, _ = user
+    form = {"name": "broken", "taskids": [str(taskids[0]), badid]}
+    response = client.post("/tasklistform/", data=form)
+    assert response.status_code == 302
+    assert response.headers["Location"] == "/tasklistform/"
+    with app.app_context():
+        assert TaskList.query.filter_by(userid=userid, name="broken").count() == 0
@@ -0,0 +1,54 @@
+import pytest
+
+from app import app, db, Task
+
+
+@pytest.fixture
+def taskid(user):
+    userid, _, _ = user
+    with app.app_context():
+        task = Task(name="batched", userid=userid)
+        db.session.add(task)
+        db.session.commit()
+        return task.id
+
+
+@pytest.mark.parametrize(
+    "operation, message",
+    [
+        ({"op": "create", "name": "a", "tasklistids": 5}, "tasklistids must be"),
+        ({"op": "create", "name": "a", "tasklistids": [{}]}, "tasklistids must be"),
+        ({"op": "create", "name": "a", "priority": True}, "priority must be"),
+        ({"op": "delete", "id": [1]}, "id must be an integer"),
+        ({"op": "delete", "id": True}, "id must be an integer"),
+        ({"op": "delete", "ref": [0]}, "ref must be an integer"),
+        ({"op": "update"}, "id must be an integer"),
+    ],
+)
+def test_malformed_operations_are_rejected(client, operation, message):
+    response = client.post("/api/v1/batch/", json=[operation])
+    assert response.status_code == 400
+    assert response.json["applied"] is False
+    (result,) = response.json["results"]
+    assert result["status"] == "error"
+    assert result["message"].startswith(message)
+
+
+def test_complete_takes_a_real_boolean(client, taskid):
+    response = client.post(
+        "/api/v1/batch/", json=[{"op": "complete", "id": taskid, "complete": "false"}]
+    )
+    assert response.status_code == 400
+    assert response.json["results"][0]["message"] == "complete must be true or false"
+
+    response = client.post(
+        "/api/v1/batch/",
+        json=[
+            {"op": "complete", "id": taskid, "complete": True},
+            {"op": "star", "id": taskid, "starred": False},
+        ],
+    )
+    assert response.status_code == 200
+    with app.app_context():
+        task = db.session.get(Task, taskid)
+        assert task.complete is True and task.starred is False
@@ -0,0 +1,103 @@
+from app import app, db, Task, TaskList, User, TasksToTaskLists
+from app import deletetasklists, deletetasks
+
+
+def counters(userid: int) -> dict:
+    """The user's and their lists' (open, completed) counters next to the real
+    counts"""
+    rows = {}
+    for complete, key in ((False, "open"), (True, "completed")):
+        tasks = db.session.query(db.func.count()).select_from(Task)
+        tasks = tasks.filter(Task.userid == userid, Task.complete == complete)
+        rows.setdefault("user", {})[key] = tasks.scalar()
+        for tasklist in TaskList.query.filter_by(userid=userid):
+            listed = tasks.join(TasksToTaskLists).filter(
+                TasksToTaskLists.c.tlid == tasklist.id
+            )
+            rows.setdefault(tasklist.name, {})[key] = listed.scalar()
+    user = db.session.get(User, userid)
+    stored = {"user": {"open": user.opentasks, "completed": user.completedtasks}}
+    for tasklist in TaskList.query.filter_by(userid=userid):
+        stored[tasklist.name] = {
+            "open": tasklist.opentasks,
+            "completed": tasklist.completedtasks,
+        }
+    return {"counters": stored, "actual": rows}
+
+
+def test_counters_follow_every_change(user):
+    userid, _, _ = user
+    with app.app_context():
+        home = TaskList(name="home", userid=userid)
+        work = TaskList(name="work", userid=userid)
+        tasks = [Task(name=f"task {i}", userid=userid) for i in range(4)]
+        for task in tasks:
+            task.tasklists = [home]
+        tasks[3].tasklists = [home, work]
+        db.session.add_all([home, work, *tasks])
+        db.session.commit()
+        steps = []
+
+        # complete, then reopen
+        tasks[0].complete = True
+        tasks[1].complete = True
+        db.session.commit()
+        steps.append(counters(userid))
+        tasks[1].complete = False
+        db.session.commit()
+        steps.append(counters(userid))
+
+        # move to another list
+        tasks[0].tasklists = [work]
+        tasks[2].tasklists = []
+        db.session.commit()
+        steps.append(counters(userid))
+
+        # delete tasks, then a list
+        deletetasks([tasks[1].id], userid)
+        db.session.commit()
+        steps.append(counters(userid))
+        deletetasklists([work.id], userid)
+        db.session.commit()
+        steps.append(counters(userid))
+
+    for step in steps:
+        assert step["counters"] == step["actual"]
+    assert steps[0]["counters"]["user"] == {"open": 2, "completed": 2}
+    assert steps[2]["counters"]["work"] == {"open": 1, "completed": 1}
+    # the list's only-in-work task goes with it, task 2 (in no list) stays
+    assert steps[-1]["counters"] == {
+        "user": {"open": 2, "completed": 0},
+        "home": {"open": 1, "completed": 0},
+    }
+
+
+def test_check_counters_finds_and_repairs_a_wrong_counter(user):
+    userid, _, _ = user
+    with app.app_context():
+        home = TaskList(name="home", userid=userid)
+        home.tasks = [Task(name="task", userid=userid)]
+        db.session.add(home)
+        db.session.commit()
+        homeid = home.id
+
+    runner = app.test_cli_runner()
+
+    def check(*options: str) -> str:
+        return runner.invoke(args=["check-counters", *options]).output
+
+    assert "all task counters are correct" in check()
+    with app.app_context():
+        db.session.execute(
+            db.update(TaskList).where(TaskList.id == homeid).values(opentasks=7)
+        )
+        db.session.commit()
+
+    output = check()
+    wrong = f"TaskLists {homeid}: counters say 7 open/0 completed, actually 1/0"
+    assert wrong in output
+    assert "1 counters are wrong" in output
+    assert "repaired 1 counters" in check("--repair")
+    assert "all task counters are correct" in check()
+    with app.app_context():
+        assert db.session.get(TaskList, homeid).opentasks == 1
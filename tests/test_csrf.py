@@ -0,0 +1,43 @@
+import pytest
+
+from app import app
+
+
+@pytest.fixture
+def csrfclient(monkeypatch):
+    """A client with CSRF protection on, as in production"""
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", True)
+    return app.test_client()
+
+
+def token(client) -> str:
+    response = client.get("/api/v1/csrf/")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-store"
+    return response.json["token"]
+
+
+def login(client, user, **extra) -> bool:
+    _, username, password = user
+    response = client.post(
+        "/login/", data={"username": username, "password": password, **extra}
+    )
+    # a rejected form is sent back to the login page
+    return response.headers["Location"] != "/login/"
+
+
+def test_the_token_is_accepted_by_the_csrf_check(csrfclient, user):
+    assert not login(csrfclient, user)
+    assert login(csrfclient, user, csrf_token=token(csrfclient))
+    # the same token keeps working for the rest of the session
+    reused = token(csrfclient)
+    for name in ("first", "second"):
+        response = csrfclient.post(
+            "/postUserTask/", data={"name": name, "csrf_token": reused}
+        )
+        assert response.status_code == 201
+
+
+def test_a_token_only_works_in_its_own_session(csrfclient, user):
+    stolen = token(app.test_client())
+    assert not login(csrfclient, user, csrf_token=stolen)
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import dbprofile
+from app import app, db
+
+
+def pragma(conn, name: str):
+    return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+@pytest.fixture(params=list(dbprofile.PROFILES))
+def engine(request, tmp_path):
+    """An engine set up by one of the profiles -> (engine, its profile)"""
+    profile = dbprofile.getprofile(request.param)
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'todo.sqlite3'}", **dbprofile.engineoptions(profile)
+    )
+    dbprofile.installpragmas(engine, profile["pragmas"])
+    yield engine, profile
+    engine.dispose()
+
+
+def test_every_connection_runs_the_profile_pragmas(engine):
+    engine, profile = engine
+    pragmas = profile["pragmas"]
+    # two connections at once, so the second is a fresh one too
+    with engine.connect() as first, engine.connect() as second:
+        for conn in (first, second):
+            assert pragma(conn, "journal_mode") == pragmas["journal_mode"].lower()
+            assert pragma(conn, "foreign_keys") == 1
+            assert pragma(conn, "busy_timeout") == pragmas["busy_timeout"]
+    assert engine.pool.size() == profile["pool_size"]
+
+
+def test_the_app_engine_uses_the_concurrent_profile():
+    with app.app_context(), db.engine.connect() as conn:
+        assert pragma(conn, "journal_mode") == "wal"
+        # NORMAL
+        assert pragma(conn, "synchronous") == 1
+
+
+def test_only_wal_lets_the_writer_commit_under_a_reader(engine):
+    engine, profile = engine
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (x INTEGER)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1)")
+    reader, writer = engine.raw_connection(), engine.raw_connection()
+    try:
+        # fail at once rather than wait busy_timeout for the lock
+        writer.execute("PRAGMA busy_timeout = 0")
+        reader.execute("BEGIN")
+        assert reader.execute("SELECT count(*) FROM t").fetchone() == (1,)
+        writer.execute("INSERT INTO t VALUES (2)")
+        if profile["pragmas"]["journal_mode"] == "WAL":
+            writer.commit()
+            # the reader keeps the snapshot it started with
+            assert reader.execute("SELECT count(*) FROM t").fetchone() == (1,)
+        else:
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                writer.commit()
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_an_unknown_profile_is_an_error():
+    with pytest.raises(ValueError):
+        dbprofile.getprofile("fastest")
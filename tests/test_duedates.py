@@ -0,0 +1,64 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from app import app, db, Task, epochms
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("", None),
+        (1760000000000, 1760000000000),
+        # seconds, as chat_gpt used to send
+        (1760000000, 1760000000000),
+        ("1760000000000", 1760000000000),
+        ("2025-10-09T08:53:20+00:00", 1760000000000),
+        (datetime(2025, 10, 9, 8, 53, 20, tzinfo=timezone.utc), 1760000000000),
+        (date(2025, 10, 9), 1759968000000),
+    ],
+)
+def test_due_dates_become_epoch_ms(value, expected):
+    assert epochms(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value", ["next tuesday", "nan", "inf", 10**30, True, [2025, 10, 9]]
+)
+def test_anything_else_is_not_a_due_date(value):
+    with pytest.raises(ValueError):
+        epochms(value)
+
+
+@pytest.fixture
+def taskid(user) -> int:
+    userid, _, _ = user
+    with app.app_context():
+        task = Task(name="water plants", duedate=1760000000000, userid=userid)
+        db.session.add(task)
+        db.session.commit()
+        return task.id
+
+
+def update(client, taskid: int, duedate):
+    return client.post(
+        "/updateUserTask/",
+        json={"id": taskid, "name": "feed cat", "duedate": duedate, "notes": ""},
+    )
+
+
+@pytest.mark.parametrize("duedate", ["next tuesday", "inf", 10**30, [1]])
+def test_updating_a_task_with_a_bad_due_date_is_a_400(client, taskid, duedate):
+    response = update(client, taskid, duedate)
+    assert response.status_code == 400
+    with app.app_context():
+        task = db.session.get(Task, taskid)
+        assert (task.name, task.duedate) == ("water plants", 1760000000000)
+
+
+def test_updating_a_task_stores_its_due_date_as_epoch_ms(client, taskid):
+    response = update(client, taskid, "2025-10-10T08:53:20+00:00")
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(Task, taskid).duedate == 1760086400000
@@ -0,0 +1,36 @@
+import pytest
+
+
+def revalidate(client, url: str) -> tuple[int, str]:
+    """Fetch url, then again with its ETag -> (second status code, the ETag)"""
+    etag = client.get(url).headers["ETag"]
+    return client.get(url, headers={"If-None-Match": etag}).status_code, etag
+
+
+@pytest.mark.parametrize(
+    "url", ["/getUserTasks/", "/getUserColor/", "/api/v1/tasks/?limit=5"]
+)
+def test_an_unchanged_resource_is_not_modified(client, url):
+    status, etag = revalidate(client, url)
+    assert status == 304
+    assert client.get(url, headers={"If-None-Match": etag}).data == b""
+
+
+def test_adding_a_task_changes_the_etag(client):
+    _, etag = revalidate(client, "/getUserTasks/")
+    response = client.post("/postUserTask/", data={"name": "water the plants"})
+    assert response.status_code == 201
+
+    response = client.get("/getUserTasks/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [task["name"] for task in response.json["tasks"]] == ["water the plants"]
+
+
+def test_changing_the_color_changes_the_etag(client):
+    _, etag = revalidate(client, "/getUserColor/")
+    assert client.post("/postUserColor/", json="#123456").status_code == 201
+
+    response = client.get("/getUserColor/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json == {"userColor": "#123456"}
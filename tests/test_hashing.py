@@ -0,0 +1,50 @@
+import re
+
+from app import app, db, User, pwd_hasher
+from hashing_examples import calibrate, load_params, save_params
+
+
+def timecost(userid: int) -> int:
+    """argon2 time_cost of the user's stored hash"""
+    with app.app_context():
+        passwordhash = db.session.get(User, userid).password_hash
+    hashed = pwd_hasher.pepper.decrypt(passwordhash).decode("utf-8")
+    return int(re.search(r"t=(\d+)", hashed).group(1))
+
+
+def login(username: str, password: str) -> bool:
+    app.config["WTF_CSRF_ENABLED"] = False
+    response = app.test_client().post(
+        "/login/", data={"username": username, "password": password}
+    )
+    # a failed login is sent back to the login form
+    return response.headers["Location"] != "/login/"
+
+
+def test_logging_in_rehashes_with_the_current_parameters(user, monkeypatch):
+    userid, username, password = user
+    assert timecost(userid) == pwd_hasher.params["time_cost"]
+    # calibrated since the password was set
+    calibrated = pwd_hasher.params["time_cost"] + 1
+    monkeypatch.setitem(pwd_hasher.params, "time_cost", calibrated)
+
+    # a wrong password changes nothing
+    assert not login(username, "wrong password")
+    assert timecost(userid) == calibrated - 1
+
+    assert login(username, password)
+    assert timecost(userid) == calibrated
+    # and the new hash still takes the password
+    assert login(username, password)
+
+
+def test_calibrated_parameters_round_trip(tmp_path):
+    path = str(tmp_path / "hashparams.json")
+    params = calibrate(target_ms=5.0, memory_cost=8 * 1024, parallelism=1)
+    assert params["memory_cost"] == 8 * 1024 and params["time_cost"] >= 1
+    save_params(path, params)
+    assert load_params(path) == params
+    # missing keys fall back to the defaults
+    save_params(path, {"time_cost": 4})
+    assert load_params(path)["time_cost"] == 4
+    assert set(load_params(path)) == set(params)
@@ -0,0 +1,59 @@
+import os
+import time
+
+import pytest
+
+from hashing_examples import UpdatedHasher
+from hashpool import HashPool, HashPoolBusy
+
+CHEAP = {"time_cost": 1, "memory_cost": 8, "parallelism": 1}
+
+
+@pytest.fixture
+def pool():
+    pool = HashPool(workers=1, queuelimit=0, timeout=0.2)
+    yield pool
+    pool.shutdown()
+
+
+def test_work_runs_in_another_process(pool):
+    assert pool.run(os.getpid) != os.getpid()
+
+
+def test_a_full_pool_turns_callers_away_until_the_work_is_done(pool):
+    # gives up waiting for its result, but the worker stays busy until it's done
+    with pytest.raises(HashPoolBusy, match="took over"):
+        pool.run(time.sleep, 0.6)
+    start = time.perf_counter()
+    with pytest.raises(HashPoolBusy, match="busy"):
+        pool.run(int)
+    # turned away at once, not after the timeout
+    assert time.perf_counter() - start < 0.1
+    time.sleep(0.6)
+    assert pool.run(int, "7") == 7
+
+
+def test_the_hasher_hashes_and_checks_in_the_pool(pool):
+    pool.timeout = 10.0
+    hasher = UpdatedHasher(UpdatedHasher.random_pepper(), pool, CHEAP)
+    hashed = hasher.hash("correct horse")
+    assert hasher.check("correct horse", hashed)
+    assert not hasher.check("battery staple", hashed)
+
+
+class BusyPool:
+    def run(self, fn, *args):
+        raise HashPoolBusy("every password hashing worker is busy")
+
+
+def test_logging_in_while_hashing_is_busy_is_a_503(user, monkeypatch):
+    from app import app, pwd_hasher
+
+    _, username, password = user
+    app.config["WTF_CSRF_ENABLED"] = False
+    monkeypatch.setattr(pwd_hasher, "pool", BusyPool())
+    response = app.test_client().post(
+        "/login/", data={"username": username, "password": password}
+    )
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
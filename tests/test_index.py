@@ -0,0 +1,28 @@
+from sqlalchemy import event
+
+from app import app, db, User
+
+
+def test_the_home_page_never_reads_the_users_table(client, user):
+    _, username, _ = user
+    with app.app_context():
+        # plenty of other users, which the page used to load every time
+        db.session.add_all(User(f"{username}-{i}", "password") for i in range(20))
+        db.session.commit()
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    # the first request may have to load the user into the cache
+    client.get("/index/")
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/index/")
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200
+    assert f"<p>{username}</p>" in response.get_data(as_text=True)
+    assert [s for s in statements if "Users" in s] == []
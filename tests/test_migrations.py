@@ -0,0 +1,125 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import dbprofile
+import migrations
+
+# the schema as it was before migration 1
+BASELINE = [
+    "CREATE TABLE Users (id INTEGER NOT NULL PRIMARY KEY, username VARCHAR NOT NULL "
+    "UNIQUE, themecolor VARCHAR, password_hash BLOB)",
+    "CREATE TABLE TaskLists (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, "
+    "userid INTEGER NOT NULL REFERENCES Users (id))",
+    "CREATE TABLE Tasks (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, "
+    "complete BOOLEAN NOT NULL, starred BOOLEAN NOT NULL, progressnotes VARCHAR, "
+    "duedate INTEGER, duetime TIME, priority INTEGER, notes VARCHAR, "
+    "userid INTEGER NOT NULL REFERENCES Users (id))",
+    "CREATE TABLE Subtasks (id INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, "
+    "complete BOOLEAN NOT NULL, taskid INTEGER NOT NULL REFERENCES Tasks (id), "
+    "priority INTEGER)",
+    "CREATE TABLE TasksToTaskLists (tlid VARCHAR NOT NULL REFERENCES TaskLists (id), "
+    "taskid INTEGER NOT NULL REFERENCES Tasks (id))",
+    "INSERT INTO Users (id, username) VALUES (1, 'someone')",
+    "INSERT INTO TaskLists (id, name, userid) VALUES (1, 'list', 1)",
+    "INSERT INTO Tasks (id, name, complete, starred, duedate, userid) "
+    "VALUES (1, 'task', 0, 0, 1760000000, 1)",
+    "INSERT INTO Subtasks (id, name, complete, taskid) VALUES (1, 'subtask', 0, 1)",
+    "INSERT INTO TasksToTaskLists (tlid, taskid) VALUES ('1', 1)",
+]
+
+
+class InjectedFailure(Exception):
+    pass
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'todo.sqlite3'}")
+    dbprofile.installpragmas(engine, dbprofile.getprofile("concurrent")["pragmas"])
+    with engine.begin() as conn:
+        for statement in BASELINE:
+            conn.exec_driver_sql(statement)
+    yield engine
+    engine.dispose()
+
+
+def version(engine) -> int:
+    with engine.connect() as conn:
+        return migrations.getversion(conn)
+
+
+def columns(engine, table: str) -> set[str]:
+    return {column["name"] for column in inspect(engine).get_columns(table)}
+
+
+def nocreate(conn):
+    raise AssertionError("an existing database must not be created again")
+
+
+def test_upgrade_from_baseline(engine):
+    assert migrations.upgrade(engine, nocreate) is False
+    assert version(engine) == migrations.headversion()
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT duedate FROM Tasks").scalar() == (
+            1760000000 * 1000
+        )
+
+
+def test_failed_migration_rolls_back_and_can_be_retried(engine, monkeypatch):
+    (changetracking,) = [m for m in migrations.MIGRATIONS if m.version == 3]
+    upgrade = changetracking.upgrade
+
+    def failhalfway(conn):
+        # the Users column is the first thing migration 3 adds
+        conn.exec_driver_sql(
+            "ALTER TABLE Users ADD COLUMN changeseq INTEGER NOT NULL DEFAULT 0"
+        )
+        raise InjectedFailure()
+
+    monkeypatch.setattr(changetracking, "upgrade", failhalfway)
+    with pytest.raises(InjectedFailure):
+        migrations.upgrade(engine, nocreate)
+    assert version(engine) == 2
+    assert "changeseq" not in columns(engine, "Users")
+
+    monkeypatch.setattr(changetracking, "upgrade", upgrade)
+    assert migrations.upgrade(engine, nocreate) is False
+    assert version(engine) == migrations.headversion()
+    assert "changeseq" in columns(engine, "Users")
+
+
+def test_failed_create_leaves_an_empty_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'todo.sqlite3'}")
+
+    def createhalfway(conn):
+        conn.exec_driver_sql("CREATE TABLE Users (id INTEGER NOT NULL PRIMARY KEY)")
+        raise InjectedFailure()
+
+    with pytest.raises(InjectedFailure):
+        migrations.upgrade(engine, createhalfway)
+    assert inspect(engine).get_table_names() == []
+    assert version(engine) == 0
+    engine.dispose()
+
+
+def test_memberships_become_integer_keys_without_duplicates(engine):
+    with engine.begin() as conn:
+        # the old table took the same membership twice
+        conn.exec_driver_sql(
+            "INSERT INTO TasksToTaskLists (tlid, taskid) VALUES (1, 1)"
+        )
+    migrations.upgrade(engine, nocreate)
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "SELECT tlid, typeof(tlid), taskid FROM TasksToTaskLists"
+        ).all()
+        assert [tuple(row) for row in rows] == [(1, "integer", 1)]
+        # the table is its (tlid, taskid) primary key, no rowid
+        schema = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE name = 'TasksToTaskLists'"
+        ).scalar()
+        assert schema.endswith("WITHOUT ROWID")
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT taskid FROM TasksToTaskLists WHERE tlid = 1"
+        ).all()
+        assert "USING PRIMARY KEY (tlid=?)" in plan[0][-1]
@@ -0,0 +1,98 @@
+import base64
+import json
+
+import pytest
+
+from app import app, db, Task
+
+
+@pytest.fixture
+def taskids(user) -> dict[int, dict]:
+    """user with tasks sharing due dates and priorities, some without either ->
+    task id -> its duedate and priority"""
+    userid, _, _ = user
+    with app.app_context():
+        tasks = [
+            Task(name=f"task {i}", userid=userid, duedate=duedate, priority=priority)
+            for i, (duedate, priority) in enumerate(
+                [(3000, 2), (None, 5), (1000, None), (3000, 2), (None, None)]
+                + [(2000, 1), (1000, 5), (None, 1), (2000, None), (3000, 9)]
+            )
+        ]
+        db.session.add_all(tasks)
+        db.session.commit()
+        return {
+            task.id: {"duedate": task.duedate, "priority": task.priority}
+            for task in tasks
+        }
+
+
+def walk(client, query: str, limit: int) -> list[dict]:
+    """Every task the listing returns, a page of limit at a time"""
+    tasks, cursor = [], None
+    while True:
+        url = f"/api/v1/tasks/?{query}&limit={limit}"
+        page = client.get(url + (f"&cursor={cursor}" if cursor else "")).json
+        assert page["count"] <= limit
+        tasks += page["tasks"]
+        if (cursor := page["nextcursor"]) is None:
+            return tasks
+
+
+def cursor(*fields) -> str:
+    return base64.urlsafe_b64encode(json.dumps(fields).encode()).decode()
+
+
+@pytest.mark.parametrize("sort", ["duedate", "priority"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("limit", [1, 3, 10])
+def test_pages_cover_every_task_once_nulls_last(client, taskids, sort, order, limit):
+    tasks = walk(client, f"sort={sort}&order={order}", limit)
+    assert sorted(task["id"] for task in tasks) == sorted(taskids)
+    keys = [taskids[task["id"]][sort] for task in tasks]
+    # tasks without a due date or priority come last either way
+    known = [key for key in keys if key is not None]
+    assert keys == known + [None] * (len(keys) - len(known))
+    assert known == sorted(known, reverse=order == "desc")
+
+
+def test_a_cursor_only_fits_its_own_sort(client, taskids):
+    nextcursor = client.get("/api/v1/tasks/?sort=duedate&limit=2").json["nextcursor"]
+    response = client.get(f"/api/v1/tasks/?sort=priority&limit=2&cursor={nextcursor}")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "garbage",
+    [
+        "not base64!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        cursor("duedate", "asc", 1000),
+        cursor("duedate", "asc", [1000], 1),
+        cursor("duedate", "asc", {"a": 1}, 1),
+        cursor("duedate", "asc", 1000, "1"),
+        cursor("duedate", "asc", 1000, True),
+        cursor("duedate", "asc", 2**64, 1),
+        cursor("duedate", "sideways", 1000, 1),
+        cursor(["duedate"], "asc", 1000, 1),
+    ],
+)
+def test_a_garbage_cursor_is_rejected(client, taskids, garbage):
+    for url in ["/api/v1/tasks/", "/api/v1/smartlists/planned/"]:
+        response = client.get(url, query_string={"cursor": garbage})
+        assert response.status_code == 400
+        assert response.json["message"] == "invalid cursor"
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "/api/v1/tasks/?duefrom=99999999999999999999",
+        "/api/v1/tasks/?dueto=-99999999999999999999",
+        "/api/v1/tasks/?priority=99999999999999999999",
+        "/api/v1/tasks/?list=99999999999999999999",
+        "/api/v1/tasks/due/?from=0&to=99999999999999999999",
+    ],
+)
+def test_numbers_too_big_for_sqlite_are_rejected(client, query):
+    assert client.get(query).status_code == 400
@@ -0,0 +1,18 @@
+import pytest
+
+from ratelimit import RateLimiter
+
+
+@pytest.mark.parametrize("burst, rate", [(0, 1.0), (-1, 1.0), (5, 0.0), (5, -0.5)])
+def test_limits_must_be_positive(burst, rate):
+    with pytest.raises(ValueError):
+        RateLimiter(burst=burst, rate=rate)
+
+
+def test_a_drained_key_waits_for_a_token():
+    limiter = RateLimiter(burst=2, rate=0.5)
+    assert limiter.acquire("key") == 0
+    assert limiter.acquire("key") == 0
+    assert 0 < limiter.acquire("key") <= 2
+    # other keys have buckets of their own
+    assert limiter.acquire("other") == 0
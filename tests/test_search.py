@@ -0,0 +1,71 @@
+import pytest
+
+from app import app, db, Subtask, Task, User, deletetasks
+
+
+def found(client, q: str) -> list[str]:
+    response = client.get("/api/v1/search/", query_string={"q": q})
+    assert response.status_code == 200
+    return sorted(task["name"] for task in response.json["tasks"])
+
+
+@pytest.fixture
+def othertask(user) -> int:
+    """Somebody else's task, with the same words as the tests' own -> its id"""
+    userid, username, _ = user
+    with app.app_context():
+        other = User(f"{username}other", "otherpassword")
+        db.session.add(other)
+        db.session.commit()
+        task = Task(name="buy milk", notes="oat milk", userid=other.id)
+        db.session.add(task)
+        db.session.flush()
+        db.session.add(Subtask(name="milk", taskid=task.id, userid=other.id))
+        db.session.commit()
+        return task.id
+
+
+def test_search_only_finds_your_own_tasks(client, user, othertask):
+    userid, _, _ = user
+    with app.app_context():
+        db.session.add(Task(name="buy milk", userid=userid))
+        db.session.commit()
+    assert found(client, "milk") == ["buy milk"]
+    assert found(client, "oat") == []
+    # FTS5 syntax is only ever text, so it can't widen the search
+    assert found(client, "owner : u* OR milk") == []
+
+
+def test_edits_and_deletes_reach_the_index(client, user):
+    userid, _, _ = user
+    with app.app_context():
+        task = Task(name="water plants", userid=userid)
+        db.session.add(task)
+        db.session.commit()
+        taskid = task.id
+    assert found(client, "plants") == ["water plants"]
+
+    response = client.post(
+        "/updateUserTask/",
+        json={"id": taskid, "name": "feed cat", "duedate": None, "notes": "tuna"},
+    )
+    assert response.status_code == 200
+    assert found(client, "plants") == []
+    assert found(client, "cat tuna") == ["feed cat"]
+
+    with app.app_context():
+        db.session.add(Subtask(name="open can", taskid=taskid, userid=userid))
+        db.session.commit()
+        assert found(client, "can") == ["feed cat"]
+        db.session.query(Subtask).filter_by(taskid=taskid).delete()
+        db.session.commit()
+        assert found(client, "can") == []
+
+        deletetasks([taskid], userid)
+        db.session.commit()
+    assert found(client, "cat") == []
+
+
+def test_an_offset_too_big_for_sqlite_is_rejected(client):
+    query = {"q": "milk", "offset": 2**64}
+    assert client.get("/api/v1/search/", query_string=query).status_code == 400
@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import event
+
+from app import app, db, Task, TaskList, Subtask, serializetasks
+
+
+@pytest.fixture
+def userid(user):
+    """user with three tasks in two lists, each task with a subtask"""
+    userid, _, _ = user
+    with app.app_context():
+        lists = [TaskList(name=name, userid=userid) for name in ("home", "work")]
+        tasks = [Task(name=f"task {i}", userid=userid) for i in range(3)]
+        db.session.add_all(lists + tasks)
+        for i, task in enumerate(tasks):
+            task.tasklists = lists[: i % 2 + 1]
+            db.session.add(Subtask(name=f"subtask {i}", task=task, userid=userid))
+        db.session.commit()
+    return userid
+
+
+def statements(serialize) -> tuple[list[dict], int]:
+    """serialize()'s result and how many statements it ran"""
+    count = [0]
+
+    def counter(*args):
+        count[0] += 1
+
+    event.listen(db.engine, "before_cursor_execute", counter)
+    try:
+        result = serialize()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", counter)
+    return result, count[0]
+
+
+def test_serializetasks_query_count(userid):
+    with app.app_context():
+        query = Task.query.filter_by(userid=userid).order_by(Task.id)
+        taskjson, count = statements(lambda: serializetasks(query))
+        # the tasks, then every list name for them
+        assert count == 2
+        assert [task["tasklistnames"] for task in taskjson] == [
+            ["home"],
+            ["home", "work"],
+            ["home"],
+        ]
+
+        taskjson, count = statements(lambda: serializetasks(query, True))
+        # ... and every subtask for them
+        assert count == 3
+        assert [len(task["subtasks"]) for task in taskjson] == [1, 1, 1]
+
+
+def test_serializetasks_page_query_count(userid):
+    with app.app_context():
+        page = Task.query.filter_by(userid=userid).all()
+        _, count = statements(lambda: serializetasks(page, True))
+        assert count == 2
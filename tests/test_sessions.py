@@ -0,0 +1,56 @@
+import pytest
+
+from app import app
+from serversession import MemoryStore, SessionStore
+
+
+def sid(client) -> str | None:
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"])
+    return None if cookie is None else cookie.value
+
+
+def test_login_and_logout_move_the_session_to_a_new_id(user):
+    app.config["WTF_CSRF_ENABLED"] = False
+    store = app.session_interface.store
+    client = app.test_client()
+    _, username, password = user
+    # the anonymous page stores a session -> the id an attacker could plant
+    client.get("/anonymoususer/")
+    planted = sid(client)
+    assert planted is not None and store.load(planted) is not None
+
+    response = client.post("/login/", data={"username": username, "password": password})
+    assert response.status_code == 302
+    loggedin = sid(client)
+    assert loggedin != planted
+    assert store.load(planted) is None
+    # the session's data moved along with it
+    assert client.get("/api/v0/getauts/").status_code == 200
+
+    client.get("/logout/")
+    assert sid(client) not in (planted, loggedin)
+    assert store.load(loggedin) is None
+
+
+def test_viewing_the_home_page_does_not_rewrite_the_session(client, monkeypatch):
+    store = app.session_interface.store
+    saves = []
+    save = store.save
+    monkeypatch.setattr(
+        store, "save", lambda *args: (saves.append(args[0]), save(*args))
+    )
+    assert client.get("/index/").status_code == 200
+    saves.clear()
+    for _ in range(3):
+        assert client.get("/index/").status_code == 200
+    assert saves == []
+
+
+def test_a_store_must_implement_every_method():
+    class LoadOnly(SessionStore):
+        def load(self, sid):
+            return None
+
+    with pytest.raises(TypeError):
+        LoadOnly()
+    MemoryStore()
@@ -0,0 +1,54 @@
+import pytest
+
+from app import app, db, Task, daybounds
+
+DAY = 24 * 60 * 60 * 1000
+# a client 5 hours behind UTC
+TZOFFSET = 300
+
+
+@pytest.fixture
+def due(user) -> dict[str, int]:
+    """user with tasks due around the start of today -> task name -> id"""
+    userid, _, _ = user
+    start, end = daybounds(TZOFFSET)
+    duedates = {
+        # a due date without a time is stored at the day's midnight
+        "today": start,
+        "today, later": end - 1,
+        "yesterday, at the last minute": start - 1,
+        "last week": start - 7 * DAY,
+        "tomorrow": end,
+    }
+    with app.app_context():
+        tasks = [
+            Task(name=name, duedate=duedate, userid=userid)
+            for name, duedate in duedates.items()
+        ]
+        db.session.add_all(tasks)
+        db.session.commit()
+        return {task.name: task.id for task in tasks}
+
+
+def smartlist(client, name: str) -> list[str]:
+    response = client.get(f"/api/v1/smartlists/{name}/?tzoffset={TZOFFSET}")
+    assert response.status_code == 200
+    return [task["name"] for task in response.json["tasks"]]
+
+
+def test_due_today_is_not_overdue(client, due):
+    assert smartlist(client, "today") == ["today", "today, later"]
+    assert smartlist(client, "overdue") == [
+        "last week",
+        "yesterday, at the last minute",
+    ]
+
+    counts = client.get(f"/api/v1/counts/?tzoffset={TZOFFSET}").json["smartlists"]
+    assert counts["today"] == {"open": 2, "completed": 0}
+    assert counts["overdue"] == {"open": 2, "completed": 0}
+    assert counts["planned"] == {"open": 5, "completed": 0}
+
+
+@pytest.mark.parametrize("url", ["/api/v1/smartlists/today/", "/api/v1/counts/"])
+def test_a_tzoffset_beyond_a_day_is_rejected(client, url):
+    assert client.get(url, query_string={"tzoffset": 10**12}).status_code == 400
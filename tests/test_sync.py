@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+
+from app import app, db, Task, TaskList, Tombstone, User
+from app import deletetasklists, deletetasks, prunetombstones
+
+
+def seq(client) -> int:
+    return client.get("/api/v1/sync/").json["seq"]
+
+
+def test_sync_after_pruned_tombstones_is_gone(client, user):
+    userid, _, _ = user
+    with app.app_context():
+        tasks = [Task(name=f"task {i}", userid=userid) for i in range(2)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        taskids = [task.id for task in tasks]
+    before = seq(client)
+
+    with app.app_context():
+        deletetasks([taskids[0]], userid)
+        db.session.commit()
+    synced = client.get(f"/api/v1/sync/?since={before}").json
+    assert synced["deleted"] == [{"kind": "task", "id": taskids[0]}]
+    after = synced["seq"]
+
+    with app.app_context():
+        # nothing is old enough yet
+        assert prunetombstones(datetime.utcnow() - timedelta(days=1)) == 0
+        db.session.query(Tombstone).filter_by(userid=userid).update(
+            {"deleted_at": datetime.utcnow() - timedelta(days=2)}
+        )
+        assert prunetombstones(datetime.utcnow() - timedelta(days=1)) == 1
+        db.session.commit()
+
+    # the deletion can't be told anymore -> start over
+    response = client.get(f"/api/v1/sync/?since={before}")
+    assert response.status_code == 410
+    full = client.get("/api/v1/sync/?since=0").json
+    assert [task["id"] for task in full["tasks"]] == [taskids[1]]
+    assert full["deleted"] == []
+    # a client that already saw the deletion carries on as before
+    response = client.get(f"/api/v1/sync/?since={after}")
+    assert response.status_code == 200
+
+
+def test_deleting_a_list_resyncs_the_tasks_left_in_other_lists(client, user):
+    userid, _, _ = user
+    with app.app_context():
+        home = TaskList(name="home", userid=userid)
+        work = TaskList(name="work", userid=userid)
+        shared = Task(name="shared", userid=userid)
+        homeonly = Task(name="home only", userid=userid)
+        shared.tasklists = [home, work]
+        homeonly.tasklists = [home]
+        db.session.add_all([home, work, shared, homeonly])
+        db.session.commit()
+        homeid, sharedid, homeonlyid = home.id, shared.id, homeonly.id
+    before = seq(client)
+
+    with app.app_context():
+        deletetasklists([homeid], userid)
+        db.session.commit()
+    synced = client.get(f"/api/v1/sync/?since={before}").json
+    assert [(task["id"], task["tasklistnames"]) for task in synced["tasks"]] == [
+        (sharedid, ["work"])
+    ]
+    assert sorted(
+        (tombstone["kind"], tombstone["id"]) for tombstone in synced["deleted"]
+    ) == [("task", homeonlyid), ("tasklist", homeid)]
+
+
+def test_pruning_moves_prunedseq_to_the_newest_pruned_deletion(client, user):
+    userid, _, _ = user
+    with app.app_context():
+        tasks = [Task(name=f"task {i}", userid=userid) for i in range(3)]
+        db.session.add_all(tasks)
+        db.session.commit()
+        taskids = [task.id for task in tasks]
+        seqs = []
+        for taskid in taskids:
+            deletetasks([taskid], userid)
+            db.session.commit()
+            seqs.append(db.session.get(User, userid).changeseq)
+        # the first two deletions are old enough to forget
+        db.session.query(Tombstone).filter(
+            Tombstone.userid == userid, Tombstone.changeseq <= seqs[1]
+        ).update({"deleted_at": datetime.utcnow() - timedelta(days=2)})
+        assert prunetombstones(datetime.utcnow() - timedelta(days=1)) == 2
+        db.session.commit()
+        assert db.session.get(User, userid).prunedseq == seqs[1]
+        # pruning again never moves it back
+        assert prunetombstones(datetime.utcnow() - timedelta(days=1)) == 0
+        db.session.commit()
+        assert db.session.get(User, userid).prunedseq == seqs[1]
+
+    # a client from before the second deletion missed one that is gone now
+    assert client.get(f"/api/v1/sync/?since={seqs[0]}").status_code == 410
+    # one that saw it only needs the third
+    synced = client.get(f"/api/v1/sync/?since={seqs[1]}").json
+    assert synced["deleted"] == [{"kind": "task", "id": taskids[2]}]
@@ -0,0 +1,47 @@
+import time
+
+from app import app, db, User, usercache
+from usercache import CachedUser, UserCache
+
+
+def cached(client, userid: int) -> CachedUser | None:
+    """The cache entry for userid after an authenticated request"""
+    client.get("/api/v1/tasks/")
+    return usercache.get(userid)
+
+
+def test_entries_expire_and_the_least_recently_used_goes_first():
+    cache = UserCache(maxsize=2, ttl=0.05)
+    for userid in (1, 2):
+        cache.put(CachedUser(userid, f"user{userid}", None))
+    cache.get(1)
+    cache.put(CachedUser(3, "user3", None))
+    assert cache.get(2) is None
+    assert cache.get(1).username == "user1"
+    time.sleep(0.06)
+    assert cache.get(1) is None and cache.get(3) is None
+
+
+def test_changing_the_color_drops_the_cached_user(client, user):
+    userid, _, _ = user
+    assert cached(client, userid).themecolor == "#2662cb"
+    client.post("/postUserColor/", json="#123456")
+    assert usercache.get(userid) is None
+    assert cached(client, userid).themecolor == "#123456"
+
+
+def test_changing_the_password_drops_the_cached_user(client, user):
+    userid, _, _ = user
+    assert cached(client, userid) is not None
+    with app.app_context():
+        db.session.get(User, userid).password = "new password"
+        db.session.commit()
+    assert usercache.get(userid) is None
+
+
+def test_logging_out_drops_the_cached_user(client, user):
+    userid, _, _ = user
+    assert cached(client, userid) is not None
+    client.get("/logout/")
+    assert usercache.get(userid) is None
+    assert client.get("/api/v1/tasks/").status_code != 200
@@ -0,0 +1,65 @@
+"""An in-process LRU + TTL cache of the logged in user.
+
+Flask-Login calls the user loader on every authenticated request. Instead of
+loading the full User row each time, load_user (app.py) keeps a CachedUser (just
+what requests read off current_user) per user id here. Entries expire after ttl
+seconds, so a change made by another worker process shows up within that time;
+changes made in this process invalidate the entry right away.
+"""
+
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+class CachedUser(UserMixin):
+    """A detached, read-only stand-in for User as current_user (no database
+    access, so it can outlive the request that loaded it)"""
+
+    def __init__(self, id: int, username: str, themecolor: str | None):
+        self.id: int = id
+        self.username: str = username
+        self.themecolor: str | None = themecolor
+
+    def __repr__(self):
+        return f"<User {self.id}>"
+
+
+class UserCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        # user id -> (expires at, user), least recently used first
+        self.entries: OrderedDict[int, tuple[float, CachedUser]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, userid: int) -> CachedUser | None:
+        with self.lock:
+            entry = self.entries.get(userid)
+            if entry is None:
+                return None
+            expires, user = entry
+            if expires < time.monotonic():
+                del self.entries[userid]
+                return None
+            self.entries.move_to_end(userid)
+            return user
+
+    def put(self, user: CachedUser) -> CachedUser:
+        with self.lock:
+            self.entries[user.id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return user
+
+    def invalidate(self, userid: int) -> None:
+        with self.lock:
+            self.entries.pop(userid, None)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()